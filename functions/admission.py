@@ -0,0 +1,197 @@
+"""
+Admission control for the HTTP endpoints.
+
+``limit(policy)`` wraps an ``https_fn`` handler (apply it below
+``@https_fn.on_request()``) and decides, before any Firestore or FCM work,
+whether this instance takes the request:
+
+1. Per caller rate: each (policy, caller) pair has a token bucket
+   (``fcm_sender.TokenBucket``) refilled at the policy's rate.
+2. Per caller concurrency: a caller may have at most the policy's
+   ``per_caller_in_flight`` requests running at once.
+3. Global in-flight cap: at most ``ADMISSION_MAX_IN_FLIGHT`` admitted
+   requests run on the instance. When it is full a request waits up to
+   ``ADMISSION_QUEUE_TIMEOUT_MS`` for a slot.
+
+A request failing any check gets an immediate 429 with a ``Retry-After``
+header instead of queueing behind the work it would slow down. The caller
+is the hashed bearer token if there is one, else the connection's
+``remote_addr``. Body ids and ``X-Forwarded-For`` are set by the client, so
+they are never used: a caller could rotate them to get a fresh bucket for
+every request. ``stats()`` reports admitted, queued and rejected counts per
+policy.
+"""
+
+import functools
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from firebase_functions import https_fn
+
+import fcm_sender
+
+ENABLED = os.environ.get('ADMISSION_CONTROL_ENABLED', 'true').lower() != 'false'
+
+MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', '64'))
+QUEUE_TIMEOUT_SECONDS = int(os.environ.get('ADMISSION_QUEUE_TIMEOUT_MS', '250')) / 1000
+
+# Token buckets kept per policy (least recently seen callers dropped first)
+MAX_TRACKED_CALLERS = 10000
+
+# Retry-After sent when the instance itself is saturated
+OVERLOAD_RETRY_AFTER_SECONDS = 1
+
+
+class Policy:
+    def __init__(self, rate_per_second, burst, per_caller_in_flight):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.per_caller_in_flight = per_caller_in_flight
+
+
+POLICIES = {
+    # Providers bid in bursts when a request goes out; allow a quick flurry, then ~1 bid every 2 seconds
+    'bidding': Policy(rate_per_second=0.5, burst=10, per_caller_in_flight=2),
+    # Each call fans out to many providers' devices
+    'fanout': Policy(rate_per_second=0.2, burst=5, per_caller_in_flight=1),
+    # Bulk and maintenance endpoints that sweep whole collections
+    'admin': Policy(rate_per_second=0.05, burst=2, per_caller_in_flight=1),
+    'default': Policy(rate_per_second=2, burst=20, per_caller_in_flight=4),
+}
+
+
+def caller_key(req):
+    """Identify the caller from what the client cannot pick freely: its bearer token or its address."""
+    auth = req.headers.get('Authorization', '')
+    if auth.lower().startswith('bearer ') and len(auth) > 7:
+        return 'token:' + hashlib.sha256(auth[7:].encode()).hexdigest()[:16]
+    return 'ip:' + (req.remote_addr or 'unknown')
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, queue_timeout=QUEUE_TIMEOUT_SECONDS):
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._max_in_flight = max_in_flight
+        self._queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._buckets = {name: OrderedDict() for name in POLICIES}
+        self._caller_in_flight = {}
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._metrics = {name: {'admitted': 0, 'queued': 0, 'queue_wait_ms': 0.0, 'rejected_rate': 0,
+                                'rejected_concurrency': 0, 'rejected_overload': 0} for name in POLICIES}
+
+    def _bucket(self, policy_name, caller):
+        buckets = self._buckets[policy_name]
+        bucket = buckets.get(caller)
+        if bucket is None:
+            policy = POLICIES[policy_name]
+            bucket = buckets[caller] = fcm_sender.TokenBucket(policy.rate_per_second, policy.burst)
+            while len(buckets) > MAX_TRACKED_CALLERS:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(caller)
+        return bucket
+
+    def try_admit(self, policy_name, caller):
+        """Admit a request or return (reason, retry_after_seconds). Call release() after an admitted request."""
+        policy = POLICIES[policy_name]
+        metrics = self._metrics[policy_name]
+        key = (policy_name, caller)
+        with self._lock:
+            if self._caller_in_flight.get(key, 0) >= policy.per_caller_in_flight:
+                metrics['rejected_concurrency'] += 1
+                return 'concurrency', OVERLOAD_RETRY_AFTER_SECONDS
+            wait = self._bucket(policy_name, caller).try_acquire()
+            if wait > 0:
+                metrics['rejected_rate'] += 1
+                return 'rate', wait
+            self._caller_in_flight[key] = self._caller_in_flight.get(key, 0) + 1
+
+        started = time.monotonic()
+        acquired = self._slots.acquire(blocking=False)
+        queued = not acquired
+        if queued:
+            acquired = self._slots.acquire(timeout=self._queue_timeout)
+        with self._lock:
+            if queued:
+                metrics['queued'] += 1
+                metrics['queue_wait_ms'] += (time.monotonic() - started) * 1000
+            if not acquired:
+                self._release_caller(key)
+                metrics['rejected_overload'] += 1
+                return 'overload', OVERLOAD_RETRY_AFTER_SECONDS
+            metrics['admitted'] += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        return None
+
+    def _release_caller(self, key):
+        remaining = self._caller_in_flight.get(key, 1) - 1
+        if remaining > 0:
+            self._caller_in_flight[key] = remaining
+        else:
+            self._caller_in_flight.pop(key, None)
+
+    def release(self, policy_name, caller):
+        with self._lock:
+            self._release_caller((policy_name, caller))
+            self._in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            policies = {name: dict(metrics) for name, metrics in self._metrics.items()}
+            summary = {
+                'in_flight': self._in_flight,
+                'peak_in_flight': self._peak_in_flight,
+                'max_in_flight': self._max_in_flight,
+                'tracked_callers': sum(len(buckets) for buckets in self._buckets.values()),
+            }
+        for metrics in policies.values():
+            metrics['queue_wait_ms'] = round(metrics['queue_wait_ms'], 1)
+            decided = metrics['admitted'] + metrics['rejected_rate'] + metrics['rejected_concurrency'] \
+                + metrics['rejected_overload']
+            metrics['rejection_rate'] = round(1 - metrics['admitted'] / decided, 4) if decided else None
+        summary['policies'] = policies
+        return summary
+
+
+_controller = AdmissionController()
+
+
+def get_controller():
+    return _controller
+
+
+def limit(policy_name='default'):
+    """Decorator applying admission control to an https_fn handler."""
+    if policy_name not in POLICIES:
+        raise ValueError(f"Unknown admission policy: {policy_name}")
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def admitted(req):
+            if not ENABLED:
+                return handler(req)
+            caller = caller_key(req)
+            rejection = _controller.try_admit(policy_name, caller)
+            if rejection is not None:
+                reason, retry_after = rejection
+                logging.warning(f"Rejected {handler.__name__} call from {caller} ({reason})")
+                return https_fn.Response(
+                    f"Too many requests ({reason}); retry later",
+                    status=429,
+                    headers={'Retry-After': str(max(1, math.ceil(retry_after)))}
+                )
+            try:
+                return handler(req)
+            finally:
+                _controller.release(policy_name, caller)
+        return admitted
+    return decorator
@@ -0,0 +1,266 @@
+"""
+Hot/cold archival of finished bidding data.
+
+Bidding sessions that completed or expired more than ``ARCHIVE_AFTER_DAYS``
+ago are moved out of the hot collections together with their bids, but only
+once their request is finished (completed or cancelled) or gone. A session
+marked completed only means a bid was accepted; the request it belongs to
+is still being worked and the app still reads its selected bid. The
+finished request itself is archived alongside its sessions:
+
+    archived_bidding_sessions/{sessionId}
+        requestId, userId, providerIds, bidCount, sessionStatus, createdAt, archivedAt
+        blob        zlib-compressed JSON of {session, bids: {bidId: bid}}
+
+    archived_requests/{requestId}
+        userId, status, createdAt, archivedAt, sessionIds
+        blob        zlib-compressed JSON of the request document
+
+Sessions and bids are deleted outright; ``providerIds`` and ``requestId``
+on the session archive keep them findable. A request is replaced in place
+by a tombstone that keeps its status and the fields the app lists it by,
+so task history and completed-job queries still see it:
+
+    user_requests/{requestId}
+        <TOMBSTONE_FIELDS>, archived: true, archiveRef, archivedAt
+
+Runs are driven by the old sessions, which disappear once archived, so a
+tombstone is never picked up again. Each session moves in one batch
+(archive write, session delete, bid deletes), and a request's tombstone is
+written in the same batch as its archive, so a run that stops halfway
+leaves every document either hot or archived, never both or neither.
+``unpack`` decodes a blob, datetimes included.
+"""
+
+import base64
+import json
+import logging
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+import firestore_reads
+
+ARCHIVED_REQUESTS_COLLECTION = 'archived_requests'
+ARCHIVED_SESSIONS_COLLECTION = 'archived_bidding_sessions'
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '30'))
+
+# Requests and sessions archived per run; the rest wait for the next run
+MAX_PER_RUN = int(os.environ.get('ARCHIVE_MAX_PER_RUN', '200'))
+
+# Old sessions looked at per run, including ones skipped because their request is still live
+MAX_SCANNED_PER_RUN = int(os.environ.get('ARCHIVE_MAX_SCANNED_PER_RUN', '2000'))
+SCAN_PAGE_SIZE = 200
+
+FINISHED_REQUEST_STATUSES = ['completed', 'cancelled']
+
+# Firestore allows 500 writes per batch
+MAX_BATCH_WRITES = 450
+
+# Stay well below Firestore's 1 MiB document limit
+MAX_BLOB_BYTES = 900 * 1024
+
+# Fields the app reads from a request (lib/models/user_request.dart); everything else lives in the blob
+TOMBSTONE_FIELDS = ('requestId', 'userId', 'serviceCategory', 'description', 'mediaUrls', 'userAvailability',
+                    'address', 'phoneNumber', 'location', 'preferences', 'createdAt', 'status', 'tags',
+                    'priority', 'aiPriceEstimation', 'assignedProviderId', 'selectedBidId',
+                    'finalServiceSchedule')
+
+
+class _Encoder(json.JSONEncoder):
+    def default(self, value):
+        if isinstance(value, datetime):
+            return {'__datetime__': value.isoformat()}
+        if isinstance(value, bytes):
+            return {'__bytes__': base64.b64encode(value).decode()}
+        if hasattr(value, 'latitude') and hasattr(value, 'longitude'):
+            return {'__geopoint__': [value.latitude, value.longitude]}
+        if hasattr(value, 'path'):
+            return {'__reference__': value.path}
+        return str(value)
+
+
+def _decode(value):
+    if '__datetime__' in value:
+        return datetime.fromisoformat(value['__datetime__'])
+    if '__bytes__' in value:
+        return base64.b64decode(value['__bytes__'])
+    return value
+
+
+def pack(data):
+    blob = zlib.compress(json.dumps(data, cls=_Encoder, separators=(',', ':')).encode(), 9)
+    if len(blob) > MAX_BLOB_BYTES:
+        raise ValueError(f"Archive blob is {len(blob)} bytes (limit {MAX_BLOB_BYTES})")
+    return blob
+
+
+def unpack(blob):
+    """Decode an archive blob back into documents."""
+    return json.loads(zlib.decompress(bytes(blob)), object_hook=_decode)
+
+
+def _cutoff(days):
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+def _session_bids(db, request_id):
+    return db.collection('service_bids').where('requestId', '==', request_id).get()
+
+
+def _add_session(db, batch, session_doc, bid_docs):
+    """Queue a session's archive write and the deletes of it and its bids; returns the writes queued."""
+    session = session_doc.to_dict()
+    bids = {bid_doc.id: bid_doc.to_dict() for bid_doc in bid_docs}
+    batch.set(db.collection(ARCHIVED_SESSIONS_COLLECTION).document(session_doc.id), {
+        'requestId': session.get('requestId'),
+        'userId': session.get('userId'),
+        'providerIds': sorted({bid.get('providerId') for bid in bids.values() if bid.get('providerId')}),
+        'bidCount': len(bids),
+        'sessionStatus': session.get('sessionStatus'),
+        'createdAt': session.get('createdAt'),
+        'archivedAt': firestore.SERVER_TIMESTAMP,
+        'blob': pack({'session': session, 'bids': bids}),
+    })
+    batch.delete(session_doc.reference)
+    for bid_doc in bid_docs:
+        batch.delete(bid_doc.reference)
+    return 2 + len(bid_docs)
+
+
+def _bids_by_session(sessions, bid_docs):
+    """Split a request's bids across its sessions (by receivedBids; leftovers go to the first session)."""
+    owner = {}
+    for session_doc in sessions:
+        for bid_id in session_doc.to_dict().get('receivedBids', []):
+            owner.setdefault(bid_id, session_doc.id)
+    grouped = {session_doc.id: [] for session_doc in sessions}
+    for bid_doc in bid_docs:
+        grouped[owner.get(bid_doc.id, sessions[0].id)].append(bid_doc)
+    return grouped
+
+
+def archive_session(db, session_doc):
+    """Move one session and its bids to the archive. Returns the number of bids moved."""
+    request_id = session_doc.to_dict().get('requestId')
+    bid_docs = []
+    if request_id:
+        # Bids of other sessions for the same request stay with those sessions
+        siblings = db.collection('bidding_sessions').where('requestId', '==', request_id).get()
+        sessions = [session_doc] + [sibling for sibling in siblings if sibling.id != session_doc.id]
+        bid_docs = _bids_by_session(sessions, _session_bids(db, request_id))[session_doc.id]
+    if len(bid_docs) + 2 > MAX_BATCH_WRITES:
+        raise ValueError(f"Session {session_doc.id} has too many bids ({len(bid_docs)}) to archive in one batch")
+    batch = db.batch()
+    _add_session(db, batch, session_doc, bid_docs)
+    batch.commit()
+    return len(bid_docs)
+
+
+def archive_request(db, request_doc):
+    """Move a finished request, its sessions and bids to the archive, leaving a tombstone. Returns (sessions, bids)."""
+    request_id = request_doc.id
+    request = request_doc.to_dict()
+    sessions = db.collection('bidding_sessions').where('requestId', '==', request_id).get()
+    bid_docs = _session_bids(db, request_id) if sessions else []
+    grouped = _bids_by_session(sessions, bid_docs) if sessions else {}
+
+    batch = db.batch()
+    writes = 0
+    for session_doc in sessions:
+        if writes and writes + 2 + len(grouped[session_doc.id]) > MAX_BATCH_WRITES - 2:
+            # Commit whole sessions at a time; the request tombstone goes in the last batch
+            batch.commit()
+            batch = db.batch()
+            writes = 0
+        writes += _add_session(db, batch, session_doc, grouped[session_doc.id])
+
+    archive_ref = db.collection(ARCHIVED_REQUESTS_COLLECTION).document(request_id)
+    batch.set(archive_ref, {
+        'userId': request.get('userId'),
+        'status': request.get('status'),
+        'createdAt': request.get('createdAt'),
+        'archivedAt': firestore.SERVER_TIMESTAMP,
+        'sessionIds': [session_doc.id for session_doc in sessions],
+        'blob': pack(request),
+    })
+    tombstone = {field: request[field] for field in TOMBSTONE_FIELDS if field in request}
+    tombstone.update({
+        'archived': True,
+        'archiveRef': archive_ref.path,
+        'archivedAt': firestore.SERVER_TIMESTAMP,
+    })
+    batch.set(request_doc.reference, tombstone)
+    batch.commit()
+    return len(sessions), len(bid_docs)
+
+
+def _scan(query, order_field, max_scanned, page_size=SCAN_PAGE_SIZE):
+    """Documents of ``query`` ordered by ``order_field``, fetched page by page, at most ``max_scanned``."""
+    query = query.order_by(order_field)
+    last = None
+    scanned = 0
+    while scanned < max_scanned:
+        page_query = query.limit(min(page_size, max_scanned - scanned))
+        if last is not None:
+            page_query = page_query.start_after(last)
+        page = page_query.get()
+        yield from page
+        scanned += len(page)
+        if len(page) < page_size:
+            return
+        last = page[-1]
+
+
+def run(db, days=ARCHIVE_AFTER_DAYS, max_items=MAX_PER_RUN, max_scanned=MAX_SCANNED_PER_RUN):
+    """Archive completed or expired sessions older than ``days`` whose request is finished. Returns a report."""
+    cutoff = _cutoff(days)
+    report = {'requests': 0, 'sessions': 0, 'bids': 0, 'skipped_live': 0, 'failed': 0}
+    handled_requests = set()
+
+    sources = (
+        (db.collection('bidding_sessions').where('sessionStatus', '==', 'completed').where('createdAt', '<', cutoff),
+         'createdAt'),
+        (db.collection('bidding_sessions').where('sessionStatus', '==', 'active').where('deadline', '<', cutoff),
+         'deadline'),
+    )
+    for query, order_field in sources:
+        for session_doc in _scan(query, order_field, max_scanned):
+            if report['requests'] + report['sessions'] >= max_items:
+                return report
+            request_id = session_doc.to_dict().get('requestId')
+            if request_id in handled_requests:
+                continue
+            try:
+                request_doc = db.collection('user_requests').document(request_id).get() if request_id else None
+                request = request_doc.to_dict() if request_doc is not None and request_doc.exists else None
+                if request is not None and request.get('status') not in FINISHED_REQUEST_STATUSES:
+                    # Accepted or still bidding: the request is live and the app still reads its bids
+                    report['skipped_live'] += 1
+                    continue
+                if request is None or request.get('archived'):
+                    report['bids'] += archive_session(db, session_doc)
+                    report['sessions'] += 1
+                else:
+                    handled_requests.add(request_id)
+                    sessions, bids = archive_request(db, request_doc)
+                    report['requests'] += 1
+                    report['sessions'] += sessions
+                    report['bids'] += bids
+            except Exception as e:
+                logging.error(f"Error archiving bidding session {session_doc.id}: {str(e)}")
+                report['failed'] += 1
+    return report
+
+
+def find_archived_sessions(db, request_id):
+    """Archived sessions of a request, decoded: [{session, bids}]."""
+    return [
+        unpack(snapshot.get('blob'))
+        for snapshot in firestore_reads.select_fields(
+            db.collection(ARCHIVED_SESSIONS_COLLECTION).where('requestId', '==', request_id), ['blob']
+        ).get()
+    ]
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark the Cloud Functions in main.py against the in-memory fakes.
+
+Every function runs against fake_firebase, so a full pass takes milliseconds
+and needs no emulator or credentials. Latency and failure rates can be
+simulated to see how fan-out paths behave when Firestore or FCM are slow.
+
+Usage:
+    python bench_functions.py
+    python bench_functions.py --providers 200 --iterations 20 --latency-ms 5
+    python bench_functions.py --only submit_bid --profile
+"""
+
+import argparse
+import cProfile
+import pstats
+import statistics
+import time
+import uuid
+
+from flask import Request
+from firebase_functions import firestore_fn
+from werkzeug.test import EnvironBuilder
+
+import fake_firebase
+
+
+def make_request(body, method='POST'):
+    """Build a Flask request like the one https_fn handlers receive."""
+    return Request(EnvironBuilder(method=method, json=body).get_environ())
+
+
+def make_change_event(db, path, before, after, params):
+    """Build a Firestore document-updated event for a trigger function."""
+    ref = db.document(path)
+    before_snapshot = fake_firebase.FakeDocumentSnapshot(ref, before)
+    after_snapshot = fake_firebase.FakeDocumentSnapshot(ref, after)
+    return firestore_fn.Event(
+        specversion='1.0',
+        id='bench',
+        source='bench',
+        type='google.cloud.firestore.document.v1.updated',
+        time=None,
+        data=firestore_fn.Change(before=before_snapshot, after=after_snapshot),
+        subject=None,
+        location='us-central1',
+        project='bench',
+        database='(default)',
+        namespace='(default)',
+        document=path,
+        params=params,
+    )
+
+
+def seed(db, provider_count, tokens_per_provider):
+    providers = {}
+    for i in range(provider_count):
+        providers[f"provider_{i:04d}"] = {
+            'companyName': f"Provider {i} Services",
+            'status': 'verified',
+            'service_categories': ['plumbing', 'electrical'],
+            'service_areas': ['Seattle', 'Bellevue'],
+            'fcmTokens': [f"token_{i}_{t}" for t in range(tokens_per_provider)],
+        }
+    db.seed('providers', providers)
+    db.seed('users', {
+        'user_0001': {'name': 'Bench User', 'fcmTokens': ['user_token_1', 'user_token_2']},
+    })
+    return list(providers)
+
+
+def new_matched_request(db, provider_ids):
+    request_id = uuid.uuid4().hex[:20]
+    db.seed('user_requests', {request_id: {
+        'userId': 'user_0001',
+        'serviceCategory': 'plumbing',
+        'description': 'Kitchen sink is leaking under the cabinet and needs a new trap',
+        # A distinct address per request keeps duplicate suppression out of the fan-out timings
+        'address': f"{request_id[:8]} Pine St, Seattle",
+        'status': 'matched',
+        'matchedProviders': provider_ids,
+        'preferences': {'urgency': 'high'},
+        'aiPriceEstimation': {'suggestedRange': {'min': 120, 'max': 200}},
+    }})
+    return request_id
+
+
+def build_scenarios(main, backend, provider_ids):
+    db = backend.db
+
+    def send_bidding_notification():
+        return main.send_bidding_notification.__wrapped__(make_request({
+            'provider_ids': provider_ids,
+            # A repeated request_id is a retry and skips providers already reached
+            'request_id': f"bench_request_{uuid.uuid4().hex[:8]}",
+            'task_description': 'Emergency plumbing repair - burst pipe in kitchen',
+            'suggested_price': '150-250',
+            'urgency': 'critical',
+            'deadline_hours': 2,
+        }))
+
+    def initiate_bidding_session():
+        request_id = new_matched_request(db, provider_ids)
+        after = db.dump('user_requests')[request_id]
+        before = dict(after, status='pending')
+        event = make_change_event(db, f"user_requests/{request_id}", before, after,
+                                  {'request_id': request_id})
+        return main.initiate_bidding_session.__wrapped__(event)
+
+    def submit_bid():
+        request_id = new_matched_request(db, provider_ids)
+        return main.submit_bid.__wrapped__(make_request({
+            'request_id': request_id,
+            'provider_id': provider_ids[0],
+            'price_quote': 150,
+            'availability': 'Available today 2-5 PM',
+            'bid_message': 'I can handle this job professionally.',
+        }))
+
+    def accept_bid():
+        request_id = new_matched_request(db, provider_ids)
+        bids = {
+            f"{request_id}_{provider_id}": {
+                'requestId': request_id,
+                'providerId': provider_id,
+                'userId': 'user_0001',
+                'priceQuote': 150.0,
+                'bidStatus': 'pending',
+            }
+            for provider_id in provider_ids[:5]
+        }
+        db.seed('service_bids', bids)
+        bid_id = next(iter(bids))
+        return main.accept_bid.__wrapped__(make_request({'bid_id': bid_id, 'user_id': 'user_0001'}))
+
+    def update_provider_status():
+        provider_id = provider_ids[0]
+        current = db.dump('providers')[provider_id]
+        next_status = 'active' if current.get('status') == 'verified' else 'verified'
+        return main.update_provider_status.__wrapped__(make_request({
+            'provider_id': provider_id,
+            'status': next_status,
+        }))
+
+    def bulk_update_provider_status():
+        providers = db.dump('providers')
+        return main.bulk_update_provider_status.__wrapped__(make_request({'updates': [
+            {'provider_id': provider_id,
+             'status': 'active' if providers[provider_id].get('status') == 'verified' else 'verified'}
+            for provider_id in provider_ids
+        ]}))
+
+    def update_provider_profile():
+        return main.update_provider_profile.__wrapped__(make_request({'provider_id': provider_ids[0]}))
+
+    def send_provider_notification():
+        provider_id = provider_ids[0]
+        after = db.dump('providers')[provider_id]
+        before = dict(after, status='pending')
+        after['status'] = 'verified'
+        event = make_change_event(db, f"providers/{provider_id}", before, after,
+                                  {'provider_id': provider_id})
+        return main.send_provider_notification.__wrapped__(event)
+
+    return {
+        'send_bidding_notification': send_bidding_notification,
+        'initiate_bidding_session': initiate_bidding_session,
+        'submit_bid': submit_bid,
+        'accept_bid': accept_bid,
+        'update_provider_status': update_provider_status,
+        'bulk_update_provider_status': bulk_update_provider_status,
+        'update_provider_profile': update_provider_profile,
+        'send_provider_notification': send_provider_notification,
+    }
+
+
+def run_scenario(backend, scenario, iterations):
+    timings = []
+    statuses = {}
+    reads_before = backend.db.stats['reads']
+    writes_before = backend.db.stats['writes']
+    calls_before = backend.messaging.api_calls
+    sent_before = len(backend.messaging.sent)
+    for _ in range(iterations):
+        start = time.perf_counter()
+        try:
+            result = scenario()
+            status = getattr(result, 'status_code', 'ok')
+        except Exception as e:
+            status = type(e).__name__
+        timings.append((time.perf_counter() - start) * 1000.0)
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        'mean_ms': statistics.fmean(timings),
+        'p50_ms': statistics.median(timings),
+        'p95_ms': sorted(timings)[max(0, int(len(timings) * 0.95) - 1)],
+        'reads': (backend.db.stats['reads'] - reads_before) / iterations,
+        'writes': (backend.db.stats['writes'] - writes_before) / iterations,
+        'fcm_calls': (backend.messaging.api_calls - calls_before) / iterations,
+        'fcm_messages': (len(backend.messaging.sent) - sent_before) / iterations,
+        'statuses': statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmark Cloud Functions against in-memory fakes')
+    parser.add_argument('--providers', type=int, default=50, help='Number of seeded providers')
+    parser.add_argument('--tokens', type=int, default=2, help='FCM tokens per provider')
+    parser.add_argument('--iterations', type=int, default=10, help='Runs per function')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Simulated Firestore latency per call')
+    parser.add_argument('--fcm-latency-ms', type=float, default=None, help='Simulated FCM latency per call')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Simulated Firestore failure rate')
+    parser.add_argument('--fcm-failure-rate', type=float, default=None, help='Simulated FCM failure rate')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for simulated conditions')
+    parser.add_argument('--only', action='append', help='Run only the named function (repeatable)')
+    parser.add_argument('--profile', action='store_true', help='Print cProfile stats for each function')
+    parser.add_argument('--admission', action='store_true',
+                        help='Keep admission control on (the bench calls from one caller, so expect 429s)')
+    args = parser.parse_args()
+
+    backend = fake_firebase.install(
+        latency_ms=args.latency_ms,
+        failure_rate=args.failure_rate,
+        fcm_latency_ms=args.fcm_latency_ms,
+        fcm_failure_rate=args.fcm_failure_rate,
+        seed=args.seed,
+    )
+    import main as functions_main
+    functions_main.admission.ENABLED = args.admission
+
+    provider_ids = seed(backend.db, args.providers, args.tokens)
+    scenarios = build_scenarios(functions_main, backend, provider_ids)
+
+    print(f"{'function':<28} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'reads':>7} {'writes':>7} {'fcm':>5} {'msgs':>7}  statuses")
+    for name, scenario in scenarios.items():
+        if args.only and name not in args.only:
+            continue
+        profiler = cProfile.Profile() if args.profile else None
+        if profiler:
+            profiler.enable()
+        result = run_scenario(backend, scenario, args.iterations)
+        if profiler:
+            profiler.disable()
+        print(f"{name:<28} {result['mean_ms']:>9.2f} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+              f"{result['reads']:>7.1f} {result['writes']:>7.1f} {result['fcm_calls']:>5.1f} "
+              f"{result['fcm_messages']:>7.1f}  {result['statuses']}")
+        if profiler:
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+
+    fake_firebase.uninstall()
+
+
+if __name__ == "__main__":
+    main()
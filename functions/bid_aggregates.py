@@ -0,0 +1,85 @@
+"""
+Live bid aggregates kept on each bidding session.
+
+``bidding_sessions/{id}.bidAggregates`` holds the bid count, price
+min/max/sum/mean, a histogram of price benchmarks and summaries of the
+cheapest bids. submit_bid folds each new bid in inside the same transaction
+that creates it, so a bid comparison view reads one document instead of
+every bid.
+"""
+
+import os
+
+AGGREGATES_FIELD = 'bidAggregates'
+
+BENCHMARKS = ('low', 'normal', 'high')
+
+# Number of bid summaries kept in bestBids (cheapest first)
+BEST_BIDS_LIMIT = int(os.environ.get('BID_AGGREGATES_BEST_BIDS', '5'))
+
+
+def empty_aggregates():
+    return {
+        'count': 0,
+        'sumPrice': 0.0,
+        'minPrice': None,
+        'maxPrice': None,
+        'meanPrice': None,
+        'benchmarkHistogram': {benchmark: 0 for benchmark in BENCHMARKS},
+        'bestBids': [],
+    }
+
+
+def bid_summary(bid_id, bid_data):
+    """The fields of a bid a comparison view needs without opening the bid document."""
+    return {
+        'bidId': bid_id,
+        'providerId': bid_data.get('providerId'),
+        'priceQuote': bid_data.get('priceQuote'),
+        'priceBenchmark': bid_data.get('priceBenchmark'),
+        'availability': bid_data.get('availability'),
+        'createdAt': bid_data.get('createdAt'),
+    }
+
+
+def _summary_sort_key(summary):
+    # Cheapest first; equal prices keep submission order
+    created_at = summary.get('createdAt')
+    return (summary.get('priceQuote'), created_at.timestamp() if created_at is not None else float('inf'))
+
+
+def add_bid(aggregates, bid_id, bid_data):
+    """Return new aggregates with one more bid folded in. ``aggregates`` may be None."""
+    current = aggregates or empty_aggregates()
+    price = float(bid_data['priceQuote'])
+    count = current.get('count', 0) + 1
+    sum_price = current.get('sumPrice', 0.0) + price
+
+    histogram = {benchmark: 0 for benchmark in BENCHMARKS}
+    histogram.update(current.get('benchmarkHistogram') or {})
+    benchmark = bid_data.get('priceBenchmark', 'normal')
+    histogram[benchmark] = histogram.get(benchmark, 0) + 1
+
+    best_bids = [summary for summary in current.get('bestBids', []) if summary.get('bidId') != bid_id]
+    best_bids.append(bid_summary(bid_id, bid_data))
+    best_bids.sort(key=_summary_sort_key)
+
+    min_price = current.get('minPrice')
+    max_price = current.get('maxPrice')
+    return {
+        'count': count,
+        'sumPrice': sum_price,
+        'minPrice': price if min_price is None else min(min_price, price),
+        'maxPrice': price if max_price is None else max(max_price, price),
+        'meanPrice': round(sum_price / count, 2),
+        'benchmarkHistogram': histogram,
+        'bestBids': best_bids[:BEST_BIDS_LIMIT],
+    }
+
+
+def from_bids(bids):
+    """Build aggregates from scratch from (bid_id, bid_data) pairs, e.g. to backfill old sessions."""
+    aggregates = empty_aggregates()
+    for bid_id, bid_data in bids:
+        aggregates = add_bid(aggregates, bid_id, bid_data)
+    return aggregates
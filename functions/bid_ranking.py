@@ -0,0 +1,178 @@
+"""
+Server-side scoring and top-k selection of a request's bids.
+
+Each bid gets a weighted score from five components in [0, 1]: price
+against the AI-suggested range, provider rating (thumbs-up ratio), completed
+jobs, availability fit and distance. The scales match the provider matching
+rules in the app (provider_matching_service.dart). Top-k selection uses a
+heap, and finished rankings are cached per session, keyed by bid count, so
+they are recomputed only when a new bid lands.
+"""
+
+import heapq
+import math
+import threading
+from collections import OrderedDict
+
+WEIGHTS = {
+    'price': 0.35,
+    'rating': 0.25,
+    'experience': 0.15,
+    'availability': 0.15,
+    'distance': 0.10,
+}
+
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 50
+
+# Jobs completed at which the experience component saturates
+EXPERIENCE_SATURATION_JOBS = 100
+
+# Sessions whose rankings are kept in instance memory
+MEMORY_CACHE_SIZE = 256
+
+PROVIDER_RANKING_FIELDS = ('companyName', 'rating', 'thumbs_up_count', 'total_jobs_completed',
+                           'accepting_new_requests', 'availability_status')
+
+
+def price_score(price, suggested_min=None, suggested_max=None, lowest_bid=None):
+    """1.0 at or just below the bottom of the suggested range, falling off above it."""
+    if price is None or price <= 0:
+        return 0.0
+    if suggested_min and suggested_max and suggested_max >= suggested_min:
+        if price < suggested_min:
+            # Far below the range is more likely a misquote than a bargain
+            return 0.7 if price < suggested_min * 0.5 else 1.0
+        if price <= suggested_max:
+            span = suggested_max - suggested_min
+            return 1.0 - 0.4 * ((price - suggested_min) / span if span else 0.0)
+        return 0.6 * suggested_max / price
+    # Without an AI range, compare against the cheapest bid
+    return (lowest_bid / price) if lowest_bid else 0.5
+
+
+def rating_score(provider):
+    """Thumbs-up ratio on the same scale as _calculateThumbsUpScore in the app."""
+    try:
+        total = int(provider.get('total_jobs_completed') or 0)
+        thumbs_up = int(provider.get('thumbs_up_count') or 0)
+    except (TypeError, ValueError):
+        total, thumbs_up = 0, 0
+    if total == 0:
+        try:
+            return min(1.0, float(provider.get('rating')) / 5.0)
+        except (TypeError, ValueError):
+            return 0.5
+    ratio = thumbs_up / total
+    for threshold, score in ((0.9, 1.0), (0.8, 0.9), (0.7, 0.8), (0.6, 0.6), (0.5, 0.4)):
+        if ratio >= threshold:
+            return score
+    return 0.2
+
+
+def experience_score(provider):
+    try:
+        jobs = max(0, int(provider.get('total_jobs_completed') or 0))
+    except (TypeError, ValueError):
+        return 0.0
+    return min(1.0, math.log1p(jobs) / math.log1p(EXPERIENCE_SATURATION_JOBS))
+
+
+def availability_score(availability_text, provider, urgency='normal'):
+    if provider.get('accepting_new_requests') is False or provider.get('availability_status') == 'unavailable':
+        return 0.3
+    text = (availability_text or '').lower()
+    if any(word in text for word in ('now', 'asap', 'immediately', 'today', 'tonight')):
+        return 1.0
+    if 'tomorrow' in text:
+        return 0.6 if urgency in ('critical', 'high') else 0.8
+    return 0.4 if urgency in ('critical', 'high') else 0.6
+
+
+def distance_score(distance_km):
+    """Same buckets as _distanceToScore in the app; unknown distance scores as 'fair'."""
+    if distance_km is None:
+        return 0.6
+    for limit, score in ((5.0, 1.0), (10.0, 0.8), (20.0, 0.6), (30.0, 0.4)):
+        if distance_km <= limit:
+            return score
+    return 0.2
+
+
+def score_bid(bid, provider, distance_km, suggested_min, suggested_max, lowest_bid, urgency):
+    components = {
+        'price': price_score(bid.get('priceQuote'), suggested_min, suggested_max, lowest_bid),
+        'rating': rating_score(provider),
+        'experience': experience_score(provider),
+        'availability': availability_score(bid.get('availability'), provider, urgency),
+        'distance': distance_score(distance_km),
+    }
+    total = sum(WEIGHTS[name] * value for name, value in components.items())
+    return round(total, 4), {name: round(value, 3) for name, value in components.items()}
+
+
+def rank(bids, providers, distances, k, suggested_min=None, suggested_max=None, urgency='normal'):
+    """
+    Return the k best bids as ranked summaries.
+
+    ``bids`` is a list of (bid_id, bid_data); ``providers`` maps provider id to
+    profile data; ``distances`` maps provider id to km.
+    """
+    prices = [bid.get('priceQuote') for _, bid in bids if bid.get('priceQuote')]
+    lowest_bid = min(prices) if prices else None
+
+    def scored():
+        for bid_id, bid in bids:
+            provider = providers.get(bid.get('providerId')) or {}
+            score, components = score_bid(bid, provider, distances.get(bid.get('providerId')),
+                                          suggested_min, suggested_max, lowest_bid, urgency)
+            # Ties go to the cheaper bid
+            yield (score, -(bid.get('priceQuote') or 0)), bid_id, bid, provider, components
+
+    top = heapq.nlargest(k, scored(), key=lambda item: item[0])
+    return [
+        {
+            'rank': position,
+            'bidId': bid_id,
+            'providerId': bid.get('providerId'),
+            'companyName': provider.get('companyName', 'Provider'),
+            'priceQuote': bid.get('priceQuote'),
+            'priceBenchmark': bid.get('priceBenchmark'),
+            'availability': bid.get('availability'),
+            'bidStatus': bid.get('bidStatus'),
+            'score': key[0],
+            'components': components,
+        }
+        for position, (key, bid_id, bid, provider, components) in enumerate(top, start=1)
+    ]
+
+
+class RankingCache:
+    """Small per-instance LRU of rankings keyed by session, valid while the bid count is unchanged."""
+
+    def __init__(self, size=MEMORY_CACHE_SIZE):
+        self._size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id, bid_count, k):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry['bidCount'] != bid_count or entry['k'] < k:
+                return None
+            self._entries.move_to_end(session_id)
+            return entry['ranked'][:k]
+
+    def put(self, session_id, bid_count, k, ranked):
+        with self._lock:
+            self._entries[session_id] = {'bidCount': bid_count, 'k': k, 'ranked': ranked}
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+
+_cache = RankingCache()
+
+
+def get_cache():
+    return _cache
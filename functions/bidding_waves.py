@@ -0,0 +1,139 @@
+"""
+Progressive (wave-based) fan-out of bidding invitations.
+
+Instead of pushing every matched provider at once, a bidding session
+notifies the best ``BIDDING_WAVE_SIZE`` providers first. The
+advance_bidding_waves job notifies the next wave once the wave window has
+passed, unless the session already has ``BIDDING_WAVE_TARGET_BIDS`` bids, is
+no longer active or has reached its deadline. Wave state lives on the
+session:
+
+    bidding_sessions/{sessionId}.waveState
+        active              false once no further wave will be sent
+        wave                waves sent so far
+        waveSize, targetBids
+        pendingProviders    providers not yet notified, best first
+        nextWaveAt          when the next wave is due
+        notification        {taskDescription, suggestedPrice, urgency, category}
+        completedReason     why waves stopped (target_bids, deadline, exhausted, closed)
+
+``notifiedProviders`` on the session grows wave by wave. Providers are
+ordered by their position in ``matchedProviders`` (the matcher sorts by
+overall score), nudged by how quickly they have answered past requests.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+
+WAVE_SIZE = int(os.environ.get('BIDDING_WAVE_SIZE', '5'))
+TARGET_BIDS = int(os.environ.get('BIDDING_WAVE_TARGET_BIDS', '3'))
+
+# Minutes to wait for bids before the next wave, by urgency
+WAVE_WINDOW_MINUTES = {
+    'critical': int(os.environ.get('BIDDING_WAVE_WINDOW_CRITICAL_MINUTES', '3')),
+    'high': int(os.environ.get('BIDDING_WAVE_WINDOW_HIGH_MINUTES', '5')),
+    'normal': int(os.environ.get('BIDDING_WAVE_WINDOW_MINUTES', '10')),
+    'low': int(os.environ.get('BIDDING_WAVE_WINDOW_LOW_MINUTES', '20')),
+}
+
+# Weight of past responsiveness against match rank when ordering providers
+RESPONSIVENESS_WEIGHT = 0.3
+
+# Median response time (minutes) that scores 0.5 responsiveness
+RESPONSE_TIME_PIVOT_MINUTES = 30
+
+# Due sessions handled per advancer run
+ADVANCE_PAGE_SIZE = 100
+
+PROVIDER_FIELDS = ['responseTime']
+
+
+def window(urgency):
+    return timedelta(minutes=WAVE_WINDOW_MINUTES.get(urgency, WAVE_WINDOW_MINUTES['normal']))
+
+
+def _responsiveness(provider_data):
+    p50 = ((provider_data or {}).get('responseTime') or {}).get('p50Minutes')
+    if p50 is None:
+        return 0.5
+    return 1 / (1 + p50 / RESPONSE_TIME_PIVOT_MINUTES)
+
+
+def order_providers(matched_providers, provider_data):
+    """Matched providers best first: match rank, adjusted by responsiveness ({provider_id: profile})."""
+    matched_providers = list(dict.fromkeys(matched_providers))
+    count = len(matched_providers)
+
+    def score(item):
+        position, provider_id = item
+        rank_score = 1 - position / count
+        return ((1 - RESPONSIVENESS_WEIGHT) * rank_score
+                + RESPONSIVENESS_WEIGHT * _responsiveness(provider_data.get(provider_id)))
+
+    return [provider_id for _position, provider_id in sorted(enumerate(matched_providers), key=score, reverse=True)]
+
+
+def start(ordered_providers, urgency, notification, now=None):
+    """Split providers into the first wave and the wave state to store on the session."""
+    now = now or datetime.now(timezone.utc)
+    first_wave, pending = ordered_providers[:WAVE_SIZE], ordered_providers[WAVE_SIZE:]
+    state = {
+        'active': bool(pending),
+        'wave': 1,
+        'waveSize': WAVE_SIZE,
+        'targetBids': TARGET_BIDS,
+        'pendingProviders': pending,
+        'nextWaveAt': now + window(urgency),
+        'notification': notification,
+    }
+    if not pending:
+        state['completedReason'] = 'exhausted'
+    return first_wave, state
+
+
+def _as_utc(moment):
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+
+def advance(session_data, bid_count, now=None):
+    """
+    Decide what a due session does next.
+    Returns (wave_provider_ids, state_update); the wave is empty when fan-out stops.
+    """
+    now = now or datetime.now(timezone.utc)
+    state = session_data.get('waveState') or {}
+    pending = list(state.get('pendingProviders', []))
+    deadline = session_data.get('deadline')
+
+    reason = None
+    if session_data.get('sessionStatus') != 'active':
+        reason = 'closed'
+    elif bid_count >= state.get('targetBids', TARGET_BIDS):
+        reason = 'target_bids'
+    elif deadline is not None and _as_utc(deadline) <= now:
+        reason = 'deadline'
+    elif not pending:
+        reason = 'exhausted'
+    if reason:
+        return [], {'waveState.active': False, 'waveState.completedReason': reason}
+
+    size = state.get('waveSize', WAVE_SIZE)
+    wave, rest = pending[:size], pending[size:]
+    urgency = (state.get('notification') or {}).get('urgency', 'normal')
+    update = {
+        'waveState.wave': state.get('wave', 1) + 1,
+        'waveState.pendingProviders': rest,
+        'waveState.nextWaveAt': now + window(urgency),
+        'waveState.active': bool(rest),
+    }
+    if not rest:
+        update['waveState.completedReason'] = 'exhausted'
+    return wave, update
+
+
+def due_sessions_query(db, now=None, limit=ADVANCE_PAGE_SIZE):
+    now = now or datetime.now(timezone.utc)
+    return (db.collection('bidding_sessions')
+            .where('waveState.active', '==', True)
+            .where('waveState.nextWaveAt', '<=', now)
+            .limit(limit))
@@ -0,0 +1,224 @@
+"""
+Device-token registry for push notifications.
+
+Each device lives in a small ``devices`` subcollection document under its
+owner (``providers/{id}/devices/{device_id}`` or ``users/{id}/devices/{device_id}``)
+with its token, platform, app version, last-seen time and failure count.
+Token refreshes become small writes instead of rewrites of the profile
+document. Sends only build the APNS or Android config that each device's
+platform needs.
+
+Profiles that have not registered any devices yet still carry a bare
+``fcmTokens`` array; those tokens are treated as platform ``unknown`` and
+get both configs, exactly as before.
+
+A token that registers under a new owner is first unsubscribed from its
+previous provider's broadcast topics, so it stops receiving that provider's
+bidding broadcasts.
+"""
+
+import hashlib
+import logging
+
+from firebase_admin import firestore, messaging
+
+import doc_cache
+import fcm_sender
+import fcm_topics
+import firestore_reads
+
+DEVICES_COLLECTION = 'devices'
+
+PLATFORMS = ('ios', 'android', 'web', 'unknown')
+
+# Firestore 'in' filters accept at most 30 values
+MAX_IN_FILTER_VALUES = 30
+
+# Commit pruning writes before hitting the 500-write batch limit
+MAX_BATCH_WRITES = 450
+
+
+class Device:
+    def __init__(self, token, platform='unknown', reference=None):
+        self.token = token
+        self.platform = platform if platform in PLATFORMS else 'unknown'
+        self.reference = reference
+
+    def wants_apns(self):
+        return self.platform in ('ios', 'unknown')
+
+    def wants_android(self):
+        return self.platform in ('android', 'unknown')
+
+
+def device_id(token):
+    """Stable document id for a token (tokens can exceed comfortable id lengths)."""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:40]
+
+
+def devices_collection(db, owner_collection, owner_id):
+    return db.collection(owner_collection).document(owner_id).collection(DEVICES_COLLECTION)
+
+
+def _leave_provider_topics(db, token, provider_ids):
+    """Helper function to unsubscribe a token from the broadcast topics of providers it no longer belongs to."""
+    profiles = firestore_reads.get_all_fields(
+        db, [db.collection('providers').document(provider_id) for provider_id in provider_ids],
+        fcm_topics.SUBSCRIPTION_FIELDS
+    )
+    topics = set()
+    for snapshot in profiles.values():
+        if snapshot.exists:
+            topics |= fcm_topics.provider_topics(snapshot.to_dict())
+    for topic in sorted(topics):
+        messaging.unsubscribe_from_topic([token], topic)
+    return len(topics)
+
+
+def register(db, owner_collection, owner_id, token, platform='unknown', app_version=''):
+    """
+    Add or refresh a device token for an owner with a single small write.
+    A token that moved to another account is removed from its previous owner
+    and from that owner's broadcast topics.
+    """
+    platform = platform if platform in PLATFORMS else 'unknown'
+    device_ref = devices_collection(db, owner_collection, owner_id).document(device_id(token))
+
+    batch = db.batch()
+    previous = firestore_reads.select_fields(
+        db.collection_group(DEVICES_COLLECTION).where('token', '==', token),
+        ['ownerId', 'ownerCollection']
+    ).get()
+    moved = [snapshot for snapshot in previous if snapshot.reference.path != device_ref.path]
+    previous_providers = [
+        snapshot.to_dict().get('ownerId') for snapshot in moved
+        if snapshot.to_dict().get('ownerCollection') == 'providers' and snapshot.to_dict().get('ownerId')
+    ]
+    if previous_providers:
+        try:
+            left = _leave_provider_topics(db, token, previous_providers)
+            logging.info(f"Unsubscribed moved device from {left} topics of its previous provider")
+        except Exception as e:
+            logging.error(f"Error unsubscribing moved device from its previous provider's topics: {str(e)}")
+    for snapshot in moved:
+        batch.delete(snapshot.reference)
+
+    batch.set(device_ref, {
+        'token': token,
+        'platform': platform,
+        'appVersion': app_version or '',
+        'ownerId': owner_id,
+        'ownerCollection': owner_collection,
+        'lastSeen': firestore.SERVER_TIMESTAMP,
+        'failureCount': 0,
+    }, merge=True)
+    batch.commit()
+    return device_ref
+
+
+def load_devices(db, owner_collection, owner_ids, legacy_tokens=None):
+    """
+    Return {owner_id: [Device]} for the given owners.
+
+    Registry devices are fetched with one collection-group query per 30 owners.
+    Tokens from ``legacy_tokens`` ({owner_id: fcmTokens}) that are not in the
+    registry are added as platform ``unknown``.
+    """
+    owner_ids = list(dict.fromkeys(owner_ids))
+    devices = {owner_id: [] for owner_id in owner_ids}
+
+    for start in range(0, len(owner_ids), MAX_IN_FILTER_VALUES):
+        chunk = owner_ids[start:start + MAX_IN_FILTER_VALUES]
+        query = (db.collection_group(DEVICES_COLLECTION)
+                 .where('ownerCollection', '==', owner_collection)
+                 .where('ownerId', 'in', chunk))
+        for snapshot in firestore_reads.select_fields(query, ['token', 'platform', 'ownerId']).stream():
+            data = snapshot.to_dict()
+            if data.get('token') and data.get('ownerId') in devices:
+                devices[data['ownerId']].append(Device(data['token'], data.get('platform'), snapshot.reference))
+
+    for owner_id, tokens in (legacy_tokens or {}).items():
+        registered = {device.token for device in devices.setdefault(owner_id, [])}
+        for token in tokens or []:
+            if token not in registered:
+                devices[owner_id].append(Device(token))
+                registered.add(token)
+
+    return devices
+
+
+def build_message(device, notification=None, data=None, apns=None, android=None, **kwargs):
+    """Build a message for one device, keeping only the platform config it can use."""
+    return messaging.Message(
+        notification=notification,
+        data=data,
+        token=device.token,
+        apns=apns if device.wants_apns() else None,
+        android=android if device.wants_android() else None,
+        **kwargs
+    )
+
+
+class FailurePruner:
+    """
+    Collects per-device send failures and applies them in batched writes.
+
+    Tokens FCM reports as unregistered are deleted from the registry and from
+    the legacy ``fcmTokens`` array. Other failures bump the device's failureCount.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._batch = db.batch()
+        self._writes = 0
+        self.removed = 0
+
+    def _write(self, action, *args):
+        getattr(self._batch, action)(*args)
+        self._writes += 1
+        if self._writes >= MAX_BATCH_WRITES:
+            self.commit()
+
+    def add(self, owner_collection, owner_id, devices, response):
+        invalid_legacy_tokens = []
+        for device, result in zip(devices, response.responses):
+            # None is a message a throttled send never got to
+            if result is None or result.success:
+                continue
+            if fcm_sender.is_token_invalid(result.exception):
+                self.removed += 1
+                if device.reference is not None:
+                    self._write('delete', device.reference)
+                else:
+                    invalid_legacy_tokens.append(device.token)
+            elif device.reference is not None:
+                self._write('update', device.reference, {'failureCount': firestore.Increment(1)})
+        if invalid_legacy_tokens:
+            self._write('update', self._db.collection(owner_collection).document(owner_id), {
+                'fcmTokens': firestore.ArrayRemove(invalid_legacy_tokens)
+            })
+            doc_cache.invalidate(owner_collection, owner_id)
+
+    def commit(self):
+        if self._writes:
+            self._batch.commit()
+            self._batch = self._db.batch()
+            self._writes = 0
+
+
+def prune_failures(db, owner_collection, jobs):
+    """
+    Apply failures for completed send jobs.
+    ``jobs`` is a list of (owner_id, devices, future) whose futures have finished.
+    """
+    pruner = FailurePruner(db)
+    for owner_id, devices, future in jobs:
+        response = fcm_sender.job_response(future)
+        if response is not None:
+            pruner.add(owner_collection, owner_id, devices, response)
+    try:
+        pruner.commit()
+    except Exception as e:
+        logging.error(f"Error pruning failed device tokens: {str(e)}")
+    if pruner.removed:
+        logging.info(f"Removed {pruner.removed} unregistered device tokens from {owner_collection}")
@@ -0,0 +1,143 @@
+"""
+Warm-instance read-through cache for user and provider documents.
+
+Notification helpers look up the same few profiles over and over during a
+bid storm (the requester's tokens on every bid, every bidder's tokens and
+name again right after accept_bid). ``get`` and ``get_many`` serve those from
+instance memory for ``DOC_CACHE_TTL_SECONDS`` and fetch only the misses, in
+one projected multi-get. Entries remember which fields were fetched, so a
+lookup asking for a field the entry lacks is a miss and refetches the union.
+
+Writes made by this instance invalidate their entries directly; the
+providers update trigger also invalidates, which keeps the instance serving
+it current. Other instances rely on the TTL, so only data that may be a few
+seconds stale (tokens, names) should be read through here.
+"""
+
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import firestore_reads
+
+TTL_SECONDS = float(os.environ.get('DOC_CACHE_TTL_SECONDS', '60'))
+MAX_ENTRIES = int(os.environ.get('DOC_CACHE_MAX_ENTRIES', '2048'))
+
+# Log hit-rate metrics every this many lookups (0 disables)
+LOG_EVERY = int(os.environ.get('DOC_CACHE_LOG_EVERY', '1000'))
+
+
+class CachedDocument:
+    """The part of a DocumentSnapshot call sites use: id, exists and to_dict()."""
+
+    def __init__(self, doc_id, exists, data):
+        self.id = doc_id
+        self.exists = exists
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self.exists else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class DocCache:
+    def __init__(self, ttl_seconds=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, db, collection, doc_id, fields):
+        return self.get_many(db, collection, [doc_id], fields)[doc_id]
+
+    def get_many(self, db, collection, doc_ids, fields):
+        """Return {doc_id: CachedDocument}, fetching every miss in one multi-get."""
+        fields = frozenset(fields)
+        doc_ids = list(dict.fromkeys(doc_ids))
+        results = {}
+        fetch_fields = set(fields)
+        now = time.monotonic()
+
+        with self._lock:
+            for doc_id in doc_ids:
+                entry = self._entries.get((collection, doc_id))
+                if entry is not None and entry['expires'] <= now:
+                    del self._entries[(collection, doc_id)]
+                    self._metrics['expired'] += 1
+                    entry = None
+                if entry is not None and (not entry['exists'] or fields <= entry['fields']):
+                    self._entries.move_to_end((collection, doc_id))
+                    self._metrics['hits'] += 1
+                    results[doc_id] = CachedDocument(doc_id, entry['exists'], entry['data'])
+                    continue
+                if entry is not None:
+                    # Widen the projection so the refreshed entry serves both callers
+                    fetch_fields |= entry['fields']
+                self._metrics['misses'] += 1
+            lookups = self._metrics['hits'] + self._metrics['misses']
+
+        misses = [doc_id for doc_id in doc_ids if doc_id not in results]
+        if misses:
+            snapshots = firestore_reads.get_all_fields(
+                db, [db.collection(collection).document(doc_id) for doc_id in misses], fetch_fields
+            )
+            expires = time.monotonic() + self._ttl
+            with self._lock:
+                for doc_id in misses:
+                    snapshot = snapshots.get(doc_id)
+                    exists = snapshot is not None and snapshot.exists
+                    data = snapshot.to_dict() if exists else None
+                    self._entries[(collection, doc_id)] = {
+                        'expires': expires, 'fields': frozenset(fetch_fields), 'exists': exists, 'data': data
+                    }
+                    self._entries.move_to_end((collection, doc_id))
+                    results[doc_id] = CachedDocument(doc_id, exists, data)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+                    self._metrics['evictions'] += 1
+
+        if LOG_EVERY and lookups // LOG_EVERY != (lookups - len(doc_ids)) // LOG_EVERY:
+            logging.info(f"Doc cache stats: {self.stats()}")
+        return results
+
+    def invalidate(self, collection, doc_id):
+        with self._lock:
+            if self._entries.pop((collection, doc_id), None) is not None:
+                self._metrics['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['entries'] = len(self._entries)
+        lookups = metrics['hits'] + metrics['misses']
+        metrics['hit_rate'] = round(metrics['hits'] / lookups, 4) if lookups else None
+        return metrics
+
+
+_cache = DocCache()
+
+
+def get_cache():
+    return _cache
+
+
+def get(db, collection, doc_id, fields):
+    return _cache.get(db, collection, doc_id, fields)
+
+
+def get_many(db, collection, doc_ids, fields):
+    return _cache.get_many(db, collection, doc_ids, fields)
+
+
+def invalidate(collection, doc_id):
+    _cache.invalidate(collection, doc_id)
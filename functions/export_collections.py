@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Stream Firestore collections to compressed files for analysis.
+
+Collections are paged with cursors (never loaded whole) and written chunk by
+chunk as gzip JSONL, or as Parquet when pyarrow is installed and --format
+parquet is given. Firestore types become portable values: timestamps are
+ISO-8601 UTC strings, document references are their paths, GeoPoints are
+{"latitude", "longitude"} and bytes are base64.
+
+Full exports split the document-id keyspace into --partitions ranges that are
+read in parallel. After a successful run the newest watermark value is
+saved per collection. With --incremental only documents whose watermark is
+newer are exported, partitioned by time range. The watermark is a field
+every document of the collection carries: createdAt for requests, bids and
+sessions (not every writer stamps updatedAt on them, so incremental runs
+pick up new documents and full exports pick up later edits), the write
+timestamp for notifications and audit samples, updatedAt for rollups.
+
+Output layout:
+    <out>/<collection>/<run_id>/part-<partition>-<chunk>.jsonl.gz
+    <out>/<collection>/<run_id>/manifest.json
+    <out>/export_state.json
+
+Usage:
+    python export_collections.py --out ../exports
+    python export_collections.py --out ../exports --incremental --partitions 8
+    python export_collections.py service_bids --out ../exports --format parquet
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import firebase_admin
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+DEFAULT_COLLECTIONS = ['user_requests', 'service_bids', 'bidding_sessions', 'provider_notifications',
+                       'provider_notification_rollups', 'provider_notification_samples']
+
+# Watermark field per collection: one set when every document is written. Bids and sessions are created
+# without updatedAt and new requests only get it on their first status update.
+WATERMARK_FIELDS = {
+    'user_requests': 'createdAt',
+    'service_bids': 'createdAt',
+    'bidding_sessions': 'createdAt',
+    'provider_notifications': 'timestamp',
+    'provider_notification_samples': 'timestamp',
+}
+DEFAULT_WATERMARK_FIELD = 'updatedAt'
+
+# Characters Firestore auto-ids are drawn from, in sort order; used to split the id keyspace
+AUTO_ID_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+PAGE_SIZE = 500
+ROWS_PER_FILE = 100000
+
+
+def to_portable(value):
+    """Convert Firestore values to JSON-friendly ones, recursively."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc).isoformat()
+    if isinstance(value, dict):
+        return {key: to_portable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_portable(item) for item in value]
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    if hasattr(value, 'latitude') and hasattr(value, 'longitude'):
+        return {'latitude': value.latitude, 'longitude': value.longitude}
+    if hasattr(value, 'path') and hasattr(value, 'id'):
+        # DocumentReference
+        return value.path
+    return str(value)
+
+
+def document_row(document_id, path, data):
+    row = {'_id': document_id, '_path': path}
+    row.update(to_portable(data))
+    return row
+
+
+class JsonlChunkWriter:
+    """Writes rows to rotating gzip JSONL files."""
+
+    extension = 'jsonl.gz'
+
+    def __init__(self, directory, prefix, rows_per_file):
+        self._directory = directory
+        self._prefix = prefix
+        self._rows_per_file = rows_per_file
+        self._file = None
+        self._rows_in_file = 0
+        self.files = []
+        self.rows = 0
+
+    def _open(self):
+        path = os.path.join(self._directory, f"{self._prefix}-{len(self.files):05d}.{self.extension}")
+        self.files.append(os.path.basename(path))
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._rows_in_file = 0
+
+    def write(self, row):
+        if self._file is None or self._rows_in_file >= self._rows_per_file:
+            self.close()
+            self._open()
+        self._file.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self._rows_in_file += 1
+        self.rows += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetChunkWriter:
+    """
+    Writes rows to rotating Parquet files, one row group per buffered chunk.
+
+    Top-level fields of the first chunk become typed columns; nested values are
+    stored as JSON strings. Fields that show up later or do not fit their column
+    type are kept in an ``_extra`` JSON column.
+    """
+
+    extension = 'parquet'
+    ROW_GROUP_SIZE = 5000
+
+    def __init__(self, directory, prefix, rows_per_file):
+        import pyarrow
+        import pyarrow.parquet
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._directory = directory
+        self._prefix = prefix
+        self._rows_per_file = rows_per_file
+        self._schema = None
+        self._writer = None
+        self._rows_in_file = 0
+        self._buffer = []
+        self.files = []
+        self.rows = 0
+
+    def _column_type(self, values):
+        pa = self._pa
+        present = [value for value in values if value is not None]
+        if present and all(isinstance(value, bool) for value in present):
+            return pa.bool_()
+        if present and all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+            return pa.int64()
+        if present and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+            return pa.float64()
+        return pa.string()
+
+    def _infer_schema(self, rows):
+        names = []
+        for row in rows:
+            for name in row:
+                if name not in names:
+                    names.append(name)
+        fields = [self._pa.field(name, self._column_type([row.get(name) for row in rows])) for name in names]
+        fields.append(self._pa.field('_extra', self._pa.string()))
+        return self._pa.schema(fields)
+
+    def _coerce(self, value, column_type):
+        pa = self._pa
+        if value is None:
+            return None, True
+        if column_type == pa.string():
+            return (value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)), True
+        if column_type == pa.bool_():
+            return value, isinstance(value, bool)
+        if column_type == pa.int64():
+            return value, isinstance(value, int) and not isinstance(value, bool)
+        return value, isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def _flush_buffer(self):
+        if not self._buffer:
+            return
+        if self._schema is None:
+            self._schema = self._infer_schema(self._buffer)
+        columns = {field.name: [] for field in self._schema}
+        for row in self._buffer:
+            extra = {}
+            for field in self._schema:
+                if field.name == '_extra':
+                    continue
+                value, fits = self._coerce(row.get(field.name), field.type)
+                columns[field.name].append(value if fits else None)
+                if not fits:
+                    extra[field.name] = row[field.name]
+            for name, value in row.items():
+                if name not in columns:
+                    extra[name] = value
+            columns['_extra'].append(json.dumps(extra, ensure_ascii=False) if extra else None)
+        if self._writer is None:
+            path = os.path.join(self._directory, f"{self._prefix}-{len(self.files):05d}.{self.extension}")
+            self.files.append(os.path.basename(path))
+            self._writer = self._pq.ParquetWriter(path, self._schema, compression='zstd')
+        self._writer.write_table(self._pa.table(columns, schema=self._schema))
+        self._rows_in_file += len(self._buffer)
+        self._buffer = []
+        if self._rows_in_file >= self._rows_per_file:
+            self._writer.close()
+            self._writer = None
+            self._rows_in_file = 0
+
+    def write(self, row):
+        self._buffer.append(row)
+        self.rows += 1
+        if len(self._buffer) >= self.ROW_GROUP_SIZE:
+            self._flush_buffer()
+
+    def close(self):
+        self._flush_buffer()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+WRITERS = {
+    'jsonl': JsonlChunkWriter,
+    'parquet': ParquetChunkWriter,
+}
+
+
+def id_partitions(count):
+    """Split the document-id keyspace into ``count`` [start, end) ranges (None = unbounded)."""
+    if count <= 1:
+        return [(None, None)]
+    step = len(AUTO_ID_ALPHABET) / count
+    bounds = [AUTO_ID_ALPHABET[int(round(i * step))] for i in range(1, count)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def time_partitions(start, end, count):
+    """Split (start, end] into ``count`` contiguous time ranges."""
+    if count <= 1 or start is None:
+        return [(start, end)]
+    step = (end - start) / count
+    bounds = [start + step * i for i in range(1, count)]
+    return list(zip([start] + bounds, bounds + [end]))
+
+
+def _paged(query, order_fields, page_size):
+    """Yield every snapshot of ``query`` page by page, resuming each page after the last document."""
+    for field in order_fields:
+        query = query.order_by(field)
+    cursor = None
+    while True:
+        page_query = query.limit(page_size)
+        if cursor is not None:
+            page_query = page_query.start_after(cursor)
+        page = page_query.get()
+        yield from page
+        if len(page) < page_size:
+            return
+        cursor = page[-1]
+
+
+def export_partition(db, collection, partition, incremental, watermark_field, writer, page_size):
+    """Export one partition and return the newest watermark value seen in it."""
+    collection_ref = db.collection(collection)
+    query = collection_ref
+    start, end = partition
+    if incremental:
+        if start is not None:
+            query = query.where(watermark_field, '>', start)
+        query = query.where(watermark_field, '<=', end)
+        order_fields = [watermark_field, FieldPath.document_id()]
+    else:
+        if start is not None:
+            query = query.where(FieldPath.document_id(), '>=', collection_ref.document(start))
+        if end is not None:
+            query = query.where(FieldPath.document_id(), '<', collection_ref.document(end))
+        order_fields = [FieldPath.document_id()]
+
+    newest = None
+    for snapshot in _paged(query, order_fields, page_size):
+        data = snapshot.to_dict() or {}
+        value = data.get(watermark_field)
+        if isinstance(value, datetime) and (newest is None or value > newest):
+            newest = value
+        writer.write(document_row(snapshot.id, snapshot.reference.path, data))
+    writer.close()
+    return newest
+
+
+def load_state(state_path):
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_state(state_path, state):
+    temp_path = f"{state_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, state_path)
+
+
+def export_collection(db, collection, out_dir, state, incremental=False, partitions=1, fmt='jsonl',
+                      page_size=PAGE_SIZE, rows_per_file=ROWS_PER_FILE, watermark_field=None):
+    watermark_field = watermark_field or WATERMARK_FIELDS.get(collection, DEFAULT_WATERMARK_FIELD)
+    collection_state = state.get(collection, {})
+    since = None
+    # A watermark saved for another field does not bound this one; fall back to a full export
+    if incremental and collection_state.get('watermark') and \
+            collection_state.get('watermark_field', watermark_field) == watermark_field:
+        since = datetime.fromisoformat(collection_state['watermark'])
+    incremental = incremental and since is not None
+
+    run_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    run_dir = os.path.join(out_dir, collection, run_id)
+    os.makedirs(run_dir, exist_ok=True)
+
+    started = time.monotonic()
+    until = datetime.now(timezone.utc)
+    ranges = time_partitions(since, until, partitions) if incremental else id_partitions(partitions)
+    writers = [WRITERS[fmt](run_dir, f"part-{index:03d}", rows_per_file) for index in range(len(ranges))]
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [
+            executor.submit(export_partition, db, collection, partition, incremental, watermark_field,
+                            writer, page_size)
+            for partition, writer in zip(ranges, writers)
+        ]
+        newest_values = [future.result() for future in futures]
+
+    newest = max([value for value in newest_values if value is not None], default=None)
+    if newest is None and since is not None:
+        newest = since
+    elapsed = time.monotonic() - started
+    rows = sum(writer.rows for writer in writers)
+    manifest = {
+        'collection': collection,
+        'run_id': run_id,
+        'mode': 'incremental' if incremental else 'full',
+        'format': fmt,
+        'watermark_field': watermark_field,
+        'since': since.isoformat() if since else None,
+        'watermark': newest.isoformat() if newest else None,
+        'partitions': len(ranges),
+        'rows': rows,
+        'files': sorted(name for writer in writers for name in writer.files),
+        'elapsed_seconds': round(elapsed, 2),
+        'rows_per_second': round(rows / elapsed, 1) if elapsed > 0 else None,
+    }
+    with open(os.path.join(run_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    if newest is not None:
+        state[collection] = {'watermark': newest.isoformat(), 'watermark_field': watermark_field,
+                             'last_run': run_id}
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream Firestore collections to compressed files')
+    parser.add_argument('collections', nargs='*', default=DEFAULT_COLLECTIONS,
+                        help=f"Collections to export (default: {' '.join(DEFAULT_COLLECTIONS)})")
+    parser.add_argument('--out', default='exports', help='Output directory')
+    parser.add_argument('--format', choices=sorted(WRITERS), default='jsonl',
+                        help='gzip JSONL, or Parquet (requires pyarrow)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only export documents changed since the saved watermark')
+    parser.add_argument('--partitions', type=int, default=1, help='Partitions read in parallel per collection')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='Documents per query page')
+    parser.add_argument('--rows-per-file', type=int, default=ROWS_PER_FILE, help='Rows before starting a new file')
+    parser.add_argument('--watermark-field', help='Override the watermark field for every collection')
+    parser.add_argument('--state', help='Watermark state file (default: <out>/export_state.json)')
+    parser.add_argument('--fake', action='store_true', help='Read from the in-memory fake backend (benchmarking)')
+    args = parser.parse_args()
+
+    if args.format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet needs pyarrow (pip install pyarrow)")
+
+    if args.fake:
+        import fake_firebase
+        db = fake_firebase.install().db
+    else:
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app()
+        db = firestore.client()
+
+    os.makedirs(args.out, exist_ok=True)
+    state_path = args.state or os.path.join(args.out, 'export_state.json')
+    state = load_state(state_path)
+
+    for collection in args.collections:
+        manifest = export_collection(
+            db, collection, args.out, state,
+            incremental=args.incremental,
+            partitions=max(1, args.partitions),
+            fmt=args.format,
+            page_size=args.page_size,
+            rows_per_file=args.rows_per_file,
+            watermark_field=args.watermark_field,
+        )
+        # Save after every collection so a later failure does not lose earlier watermarks
+        save_state(state_path, state)
+        print(f"{collection}: {manifest['rows']} rows ({manifest['mode']}) in {manifest['elapsed_seconds']}s "
+              f"-> {len(manifest['files'])} files, watermark {manifest['watermark']}")
+
+
+if __name__ == "__main__":
+    main()
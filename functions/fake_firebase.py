@@ -0,0 +1,897 @@
+#!/usr/bin/env python3
+"""
+In-process fake of the Firestore client and FCM messaging used by main.py.
+
+The emulator takes too long to start for quick iteration on hot loops, so this
+module keeps every document in memory and records every FCM payload instead of
+sending it. Both fakes accept simulated latency and failure rates so that retry
+and fan-out paths can be exercised too.
+
+Usage:
+    import fake_firebase
+    backend = fake_firebase.install(latency_ms=2, failure_rate=0.01)
+    backend.db.collection('providers').document('p1').set({...})
+    import main
+    main.submit_bid.__wrapped__(request)
+    print(backend.messaging.sent)
+    fake_firebase.uninstall()
+"""
+
+import copy
+import itertools
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from firebase_admin import exceptions as firebase_exceptions
+from firebase_admin import firestore, messaging
+from google.api_core import exceptions as api_exceptions
+from google.cloud.firestore_v1 import _helpers as firestore_helpers
+from google.cloud.firestore_v1 import bulk_writer as firestore_bulk_writer
+from google.cloud.firestore_v1.types import write as firestore_write
+
+DOCUMENT_ID = '__name__'
+
+
+class SimulatedConditions:
+    """Latency and failure injection shared by the fake backends."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Sleep for one simulated round trip."""
+        if self.latency_ms <= 0 and self.jitter_ms <= 0:
+            return
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+        time.sleep((self.latency_ms + jitter) / 1000.0)
+
+    def should_fail(self):
+        if self.failure_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+
+# ---------------------------------------------------------------------------
+# Firestore
+# ---------------------------------------------------------------------------
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _get_path(data, field_path):
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return value, True
+
+
+def _set_path(data, field_path, value):
+    parts = field_path.split('.')
+    target = data
+    for part in parts[:-1]:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    target[parts[-1]] = value
+
+
+def _delete_path(data, field_path):
+    parts = field_path.split('.')
+    target = data
+    for part in parts[:-1]:
+        target = target.get(part)
+        if not isinstance(target, dict):
+            return
+    target.pop(parts[-1], None)
+
+
+def _apply_transform(current, value):
+    """Resolve a write value against the current field value, handling sentinels."""
+    if value is firestore.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, firestore.ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        for item in value.values:
+            if item not in result:
+                result.append(item)
+        return result
+    if isinstance(value, firestore.ArrayRemove):
+        if not isinstance(current, list):
+            return []
+        return [item for item in current if item not in value.values]
+    if isinstance(value, firestore.Increment):
+        base = current if isinstance(current, (int, float)) else 0
+        return base + value.value
+    if isinstance(value, firestore.Maximum):
+        if not isinstance(current, (int, float)):
+            return value.value
+        return max(current, value.value)
+    if isinstance(value, firestore.Minimum):
+        if not isinstance(current, (int, float)):
+            return value.value
+        return min(current, value.value)
+    if isinstance(value, dict):
+        return {k: _apply_transform(None, v) for k, v in value.items()}
+    return copy.deepcopy(value)
+
+
+def _merge_into(current, data):
+    """Deep-merge ``data`` into ``current`` the way ``set(..., merge=True)`` does."""
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            current.pop(key, None)
+        elif isinstance(value, dict) and value:
+            if not isinstance(current.get(key), dict):
+                current[key] = {}
+            _merge_into(current[key], value)
+        else:
+            current[key] = _apply_transform(current.get(key), value)
+
+
+def _project(data, field_paths):
+    if field_paths is None:
+        return copy.deepcopy(data)
+    projected = {}
+    for field_path in field_paths:
+        value, found = _get_path(data, field_path)
+        if found:
+            _set_path(projected, field_path, copy.deepcopy(value))
+    return projected
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = _now()
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        if self._data is None:
+            return None
+        value, found = _get_path(self._data, field_path)
+        if not found:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class _Filter:
+    def __init__(self, field_path, op, value):
+        self.field_path = field_path
+        self.op = op
+        self.value = value
+
+    def matches(self, doc_id, path, data):
+        if self.field_path == DOCUMENT_ID:
+            actual, found = doc_id, True
+            expected = self.value.id if isinstance(self.value, FakeDocumentReference) else self.value
+            if isinstance(expected, str) and '/' in expected:
+                actual = path
+        else:
+            actual, found = _get_path(data, self.field_path)
+            expected = self.value
+        # The client spells array operators with underscores
+        op = self.op.replace('_', '-')
+        if op == '==':
+            return found and actual == expected
+        if op == '!=':
+            return found and actual is not None and actual != expected
+        if op == 'in':
+            return found and actual in expected
+        if op == 'not-in':
+            return found and actual is not None and actual not in expected
+        if op == 'array-contains':
+            return found and isinstance(actual, list) and expected in actual
+        if op == 'array-contains-any':
+            return found and isinstance(actual, list) and any(v in actual for v in expected)
+        if not found or actual is None:
+            return False
+        try:
+            if op == '<':
+                return actual < expected
+            if op == '<=':
+                return actual <= expected
+            if op == '>':
+                return actual > expected
+            if op == '>=':
+                return actual >= expected
+        except TypeError:
+            return False
+        raise ValueError(f"Unsupported operator: {op}")
+
+
+class FakeQuery:
+    def __init__(self, client, parent_path, collection_id, all_descendants=False,
+                 filters=None, orders=None, limit=None, offset=0,
+                 start_after=None, field_paths=None):
+        self._client = client
+        self._parent_path = parent_path
+        self._collection_id = collection_id
+        self._all_descendants = all_descendants
+        self._filters = filters or []
+        self._orders = orders or []
+        self._limit = limit
+        self._offset = offset
+        self._start_after = start_after
+        self._field_paths = field_paths
+
+    def _copy(self, **overrides):
+        state = {
+            'filters': list(self._filters),
+            'orders': list(self._orders),
+            'limit': self._limit,
+            'offset': self._offset,
+            'start_after': self._start_after,
+            'field_paths': self._field_paths,
+        }
+        state.update(overrides)
+        return FakeQuery(self._client, self._parent_path, self._collection_id,
+                         self._all_descendants, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [_Filter(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + [(field_path, direction)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def offset(self, num_to_skip):
+        return self._copy(offset=num_to_skip)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start_after=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copy(field_paths=list(field_paths))
+
+    def _matching_paths(self):
+        prefix = f"{self._parent_path}/" if self._parent_path else ''
+        for path in self._client._sorted_paths():
+            if not path.startswith(prefix):
+                continue
+            parts = path.split('/')
+            if parts[-2] != self._collection_id:
+                continue
+            if not self._all_descendants and '/'.join(parts[:-2]) != self._parent_path:
+                continue
+            yield path
+
+    def _sort_key_for(self, path, data):
+        key = []
+        for field_path, _direction in self._orders:
+            if field_path == DOCUMENT_ID:
+                value = path
+            else:
+                value, _found = _get_path(data, field_path)
+            key.append((value is not None, value))
+        return key
+
+    def _results(self):
+        self._client.conditions.delay()
+        if self._client.conditions.should_fail():
+            raise api_exceptions.ServiceUnavailable('Simulated Firestore outage')
+        with self._client._lock:
+            rows = []
+            for path in self._matching_paths():
+                entry = self._client._docs[path]
+                doc_id = path.rsplit('/', 1)[-1]
+                if all(f.matches(doc_id, path, entry['data']) for f in self._filters):
+                    rows.append((path, entry))
+            for index in reversed(range(len(self._orders))):
+                field_path, direction = self._orders[index]
+                rows.sort(
+                    key=lambda row: self._sort_key_for(row[0], row[1]['data'])[index],
+                    reverse=direction == 'DESCENDING',
+                )
+            if self._start_after is not None:
+                rows = self._apply_cursor(rows)
+            rows = rows[self._offset:]
+            if self._limit is not None:
+                rows = rows[:self._limit]
+            self._client.stats['reads'] += max(len(rows), 1)
+            return [
+                FakeDocumentSnapshot(
+                    self._client.document(path),
+                    _project(entry['data'], self._field_paths),
+                    entry['create_time'],
+                    entry['update_time'],
+                )
+                for path, entry in rows
+            ]
+
+    def _apply_cursor(self, rows):
+        cursor = self._start_after
+        if isinstance(cursor, FakeDocumentSnapshot):
+            for index, (path, _entry) in enumerate(rows):
+                if path == cursor.reference.path:
+                    return rows[index + 1:]
+            cursor_path = cursor.reference.path
+            cursor_data = cursor._data or {}
+        else:
+            cursor_path = cursor.get(DOCUMENT_ID)
+            if isinstance(cursor_path, FakeDocumentReference):
+                cursor_path = cursor_path.path
+            elif isinstance(cursor_path, str) and '/' not in cursor_path:
+                # Bare document ids are resolved against the queried collection, like the real client
+                cursor_path = '/'.join(p for p in (self._parent_path, self._collection_id, cursor_path) if p)
+            cursor_data = cursor
+        orders = self._orders or [(DOCUMENT_ID, 'ASCENDING')]
+        cursor_key = []
+        for field_path, _direction in orders:
+            if field_path == DOCUMENT_ID:
+                value = cursor_path
+            else:
+                value, _found = _get_path(cursor_data, field_path)
+            cursor_key.append((value is not None, value))
+        descending = orders[0][1] == 'DESCENDING'
+        for index, (path, entry) in enumerate(rows):
+            key = self._sort_key_for(path, entry['data']) if self._orders else [(True, path)]
+            if (key < cursor_key) if descending else (key > cursor_key):
+                return rows[index:]
+        return []
+
+    def stream(self, transaction=None):
+        return iter(self._results())
+
+    def get(self, transaction=None):
+        return self._results()
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, path):
+        parent_path, _, collection_id = path.rpartition('/')
+        super().__init__(client, parent_path, collection_id)
+        self._path = path
+
+    @property
+    def id(self):
+        return self._collection_id
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def parent(self):
+        parent_path = self._path.rpartition('/')[0]
+        return self._client.document(parent_path) if parent_path else None
+
+    def document(self, document_id=None):
+        if document_id is None:
+            document_id = uuid.uuid4().hex[:20]
+        return self._client.document(f"{self._path}/{document_id}")
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return _now(), ref
+
+    def list_documents(self, page_size=None):
+        return [self._client.document(path) for path in self._matching_paths()]
+
+
+class FakeDocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+
+    @property
+    def id(self):
+        return self.path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        return FakeCollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def collection(self, collection_id):
+        return FakeCollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocumentReference) and other.path == self.path
+
+    def __deepcopy__(self, memo):
+        # References are immutable and stored inside documents, so copies can share them
+        return self
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def get(self, field_paths=None, transaction=None):
+        return self._client._get(self.path, field_paths)
+
+    def create(self, document_data):
+        self._client._commit([('create', self.path, document_data, None)])
+
+    def set(self, document_data, merge=False):
+        self._client._commit([('set', self.path, document_data, merge)])
+
+    def update(self, field_updates, option=None):
+        self._client._commit([('update', self.path, field_updates, option)])
+
+    def delete(self):
+        self._client._commit([('delete', self.path, None, None)])
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference.path, document_data, None))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference.path, document_data, merge))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(('update', reference.path, field_updates, option))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference.path, None, None))
+
+    def commit(self):
+        if len(self._writes) > 500:
+            raise api_exceptions.InvalidArgument('maximum 500 writes allowed per request')
+        writes, self._writes = self._writes, []
+        self._client._commit(writes)
+        return [_now() for _ in writes]
+
+
+class FakeBulkWriter:
+    """BulkWriter compatible with ``client.bulk_writer()``.
+
+    Operations are sent in batches of 20 like the real writer. Each write
+    succeeds or fails on its own, failures go to the ``on_write_error``
+    callback and are retried when it returns True.
+    """
+
+    BATCH_SIZE = 20
+
+    def __init__(self, client, options=None):
+        self._client = client
+        self.options = options or firestore_bulk_writer.BulkWriterOptions()
+        self._operations = []
+        self._closed = False
+        self._on_write_result = None
+        self._on_write_error = firestore_bulk_writer.BulkWriter._default_on_error
+        self._on_batch_result = None
+
+    def _add(self, operation):
+        if self._closed:
+            raise Exception('BulkWriter is closed and cannot accept new operations')
+        self._operations.append(operation)
+        if len(self._operations) >= self.BATCH_SIZE:
+            self._send(self._operations[:self.BATCH_SIZE])
+            self._operations = self._operations[self.BATCH_SIZE:]
+
+    def create(self, reference, document_data, attempts=0):
+        self._add(firestore_bulk_writer.BulkWriterCreateOperation(reference, document_data, attempts))
+
+    def set(self, reference, document_data, merge=False, attempts=0):
+        self._add(firestore_bulk_writer.BulkWriterSetOperation(reference, document_data, merge, attempts))
+
+    def update(self, reference, field_updates, option=None, attempts=0):
+        self._add(firestore_bulk_writer.BulkWriterUpdateOperation(reference, field_updates, option, attempts))
+
+    def delete(self, reference, option=None, attempts=0):
+        self._add(firestore_bulk_writer.BulkWriterDeleteOperation(reference, option, attempts))
+
+    def on_write_result(self, callback):
+        self._on_write_result = callback
+
+    def on_write_error(self, callback):
+        self._on_write_error = callback or firestore_bulk_writer.BulkWriter._default_on_error
+
+    def on_batch_result(self, callback):
+        self._on_batch_result = callback
+
+    @staticmethod
+    def _as_write(operation):
+        if isinstance(operation, firestore_bulk_writer.BulkWriterCreateOperation):
+            return ('create', operation.reference.path, operation.document_data, None)
+        if isinstance(operation, firestore_bulk_writer.BulkWriterSetOperation):
+            return ('set', operation.reference.path, operation.document_data, operation.merge)
+        if isinstance(operation, firestore_bulk_writer.BulkWriterUpdateOperation):
+            return ('update', operation.reference.path, operation.field_updates, None)
+        return ('delete', operation.reference.path, None, None)
+
+    def _send(self, operations):
+        while operations:
+            self._client.conditions.delay()
+            self._client.stats['commits'] += 1
+            retries = []
+            for operation in operations:
+                code, message = 0, ''
+                if self._client.conditions.should_fail():
+                    code, message = 14, 'Simulated Firestore outage'
+                else:
+                    try:
+                        self._client._apply_writes([self._as_write(operation)], count_commit=False)
+                    except api_exceptions.NotFound as e:
+                        code, message = 5, str(e)
+                    except api_exceptions.AlreadyExists as e:
+                        code, message = 6, str(e)
+                if code == 0:
+                    if self._on_write_result:
+                        self._on_write_result(operation.reference,
+                                              firestore_write.WriteResult(update_time=_now()), self)
+                    continue
+                operation.attempts += 1
+                failure = firestore_bulk_writer.BulkWriteFailure(operation, code, message)
+                if self._on_write_error(failure, self):
+                    retries.append(operation)
+            operations = retries
+
+    def flush(self):
+        operations, self._operations = self._operations, []
+        for start in range(0, len(operations), self.BATCH_SIZE):
+            self._send(operations[start:start + self.BATCH_SIZE])
+
+    def close(self):
+        self.flush()
+        self._closed = True
+
+
+class FakeTransaction(FakeWriteBatch):
+    """Transaction compatible with ``firestore.transactional``.
+
+    Commits are serialized on the client lock, so concurrent transactions in a
+    benchmark behave as if Firestore had retried them in order.
+    """
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _begin(self, retry_id=None):
+        self._id = uuid.uuid4().bytes
+        self._client._lock.acquire()
+
+    def _clean_up(self):
+        self._writes = []
+        if self._id is not None:
+            self._id = None
+            self._client._lock.release()
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        writes = list(self._writes)
+        try:
+            self._client._commit(writes)
+        finally:
+            self._clean_up()
+        return [_now() for _ in writes]
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, FakeDocumentReference):
+            return iter([ref_or_query.get()])
+        return ref_or_query.stream()
+
+
+class FakeFirestoreClient:
+    """In-memory stand-in for ``google.cloud.firestore.Client``."""
+
+    def __init__(self, conditions=None):
+        self.conditions = conditions or SimulatedConditions()
+        self._docs = {}
+        self._lock = threading.RLock()
+        self.stats = {'reads': 0, 'writes': 0, 'commits': 0}
+
+    # -- public API -------------------------------------------------------
+
+    def collection(self, *path):
+        return FakeCollectionReference(self, '/'.join(path))
+
+    def collection_group(self, collection_id):
+        return FakeQuery(self, '', collection_id, all_descendants=True)
+
+    def document(self, *path):
+        return FakeDocumentReference(self, '/'.join(path))
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return FakeTransaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def bulk_writer(self, options=None):
+        return FakeBulkWriter(self, options)
+
+    @staticmethod
+    def write_option(**kwargs):
+        name, value = kwargs.popitem()
+        if name == 'last_update_time':
+            return firestore_helpers.LastUpdateOption(value)
+        return firestore_helpers.ExistsOption(value)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        self.conditions.delay()
+        for ref in references:
+            yield self._get(ref.path, field_paths, simulate=False)
+
+    def collections(self):
+        ids = sorted({path.split('/')[0] for path in self._docs})
+        return [self.collection(collection_id) for collection_id in ids]
+
+    # -- helpers for benchmarks ---------------------------------------------
+
+    def seed(self, collection, documents):
+        """Load ``{doc_id: data}`` into a collection without simulated latency."""
+        with self._lock:
+            for doc_id, data in documents.items():
+                now = _now()
+                self._docs[f"{collection}/{doc_id}"] = {
+                    'data': copy.deepcopy(data),
+                    'create_time': now,
+                    'update_time': now,
+                }
+
+    def dump(self, collection):
+        """Return ``{doc_id: data}`` for a top-level collection."""
+        with self._lock:
+            prefix = f"{collection}/"
+            return {
+                path[len(prefix):]: copy.deepcopy(entry['data'])
+                for path, entry in self._docs.items()
+                if path.startswith(prefix) and '/' not in path[len(prefix):]
+            }
+
+    def reset(self):
+        with self._lock:
+            self._docs.clear()
+            for key in self.stats:
+                self.stats[key] = 0
+
+    # -- internals -------------------------------------------------------------
+
+    def _sorted_paths(self):
+        return sorted(self._docs)
+
+    def _get(self, path, field_paths=None, simulate=True):
+        if simulate:
+            self.conditions.delay()
+        if self.conditions.should_fail():
+            raise api_exceptions.ServiceUnavailable('Simulated Firestore outage')
+        with self._lock:
+            self.stats['reads'] += 1
+            entry = self._docs.get(path)
+            ref = self.document(path)
+            if entry is None:
+                return FakeDocumentSnapshot(ref, None)
+            return FakeDocumentSnapshot(
+                ref, _project(entry['data'], field_paths),
+                entry['create_time'], entry['update_time'],
+            )
+
+    def _commit(self, writes):
+        self.conditions.delay()
+        if self.conditions.should_fail():
+            raise api_exceptions.ServiceUnavailable('Simulated Firestore outage')
+        self._apply_writes(writes)
+
+    def _apply_writes(self, writes, count_commit=True):
+        with self._lock:
+            staged = {}
+            for kind, path, data, merge in writes:
+                entry = staged.get(path, self._docs.get(path))
+                if kind == 'create' and entry is not None and entry['data'] is not None:
+                    raise api_exceptions.AlreadyExists(f"Document already exists: {path}")
+                if kind == 'update' and (entry is None or entry['data'] is None):
+                    raise api_exceptions.NotFound(f"No document to update: {path}")
+                # For updates the last slot carries the write option (precondition), if any
+                if (kind == 'update' and isinstance(merge, firestore_helpers.LastUpdateOption)
+                        and entry['update_time'] != merge._last_update_time):
+                    raise api_exceptions.FailedPrecondition(f"Document was updated since it was read: {path}")
+                if kind == 'delete':
+                    staged[path] = None
+                    continue
+                now = _now()
+                if kind == 'update':
+                    current = copy.deepcopy(entry['data'])
+                    for field_path, value in data.items():
+                        if value is firestore.DELETE_FIELD:
+                            _delete_path(current, field_path)
+                            continue
+                        existing, _found = _get_path(current, field_path)
+                        _set_path(current, field_path, _apply_transform(existing, value))
+                    new_data = current
+                elif merge:
+                    current = copy.deepcopy(entry['data']) if entry and entry['data'] else {}
+                    _merge_into(current, data)
+                    new_data = current
+                else:
+                    new_data = {k: _apply_transform(None, v) for k, v in data.items()
+                                if v is not firestore.DELETE_FIELD}
+                staged[path] = {
+                    'data': new_data,
+                    'create_time': entry['create_time'] if entry else now,
+                    'update_time': now,
+                }
+            for path, entry in staged.items():
+                if entry is None:
+                    self._docs.pop(path, None)
+                else:
+                    self._docs[path] = entry
+            self.stats['writes'] += len(writes)
+            if count_commit:
+                self.stats['commits'] += 1
+
+
+# ---------------------------------------------------------------------------
+# Messaging
+# ---------------------------------------------------------------------------
+
+class FakeMessaging:
+    """Records FCM payloads instead of sending them."""
+
+    def __init__(self, conditions=None):
+        self.conditions = conditions or SimulatedConditions()
+        self.sent = []
+        self.failed = []
+        self.topics = {}
+        self.api_calls = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _failure(self):
+        return firebase_exceptions.UnavailableError('Simulated FCM outage')
+
+    def _record(self, message):
+        if self.conditions.should_fail():
+            exception = self._failure()
+            with self._lock:
+                self.failed.append((message, exception))
+            return messaging.SendResponse(None, exception)
+        with self._lock:
+            message_id = f"projects/fake/messages/{next(self._ids)}"
+            self.sent.append(message)
+        return messaging.SendResponse({'name': message_id}, None)
+
+    def send(self, message, dry_run=False, app=None):
+        self.conditions.delay()
+        with self._lock:
+            self.api_calls += 1
+        response = self._record(message)
+        if response.exception is not None:
+            raise response.exception
+        return response.message_id
+
+    def send_each(self, messages, dry_run=False, app=None):
+        if len(messages) > 500:
+            raise ValueError('messages must not contain more than 500 elements.')
+        self.conditions.delay()
+        with self._lock:
+            self.api_calls += 1
+        return messaging.BatchResponse([self._record(message) for message in messages])
+
+    def _manage_topic(self, tokens, topic, subscribe):
+        if isinstance(tokens, str):
+            tokens = [tokens]
+        self.conditions.delay()
+        results = []
+        with self._lock:
+            self.api_calls += 1
+            members = self.topics.setdefault(topic, set())
+            for token in tokens:
+                if self.conditions.should_fail():
+                    results.append({'error': 'UNAVAILABLE'})
+                    continue
+                if subscribe:
+                    members.add(token)
+                else:
+                    members.discard(token)
+                results.append({})
+        return messaging.TopicManagementResponse({'results': results})
+
+    def subscribe_to_topic(self, tokens, topic, app=None):
+        return self._manage_topic(tokens, topic, subscribe=True)
+
+    def unsubscribe_from_topic(self, tokens, topic, app=None):
+        return self._manage_topic(tokens, topic, subscribe=False)
+
+    def reset(self):
+        with self._lock:
+            self.sent.clear()
+            self.failed.clear()
+            self.topics.clear()
+            self.api_calls = 0
+
+
+# ---------------------------------------------------------------------------
+# Installation
+# ---------------------------------------------------------------------------
+
+class FakeBackend:
+    def __init__(self, db, messaging_fake):
+        self.db = db
+        self.messaging = messaging_fake
+
+
+_originals = {}
+_installed = None
+
+
+def install(latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0,
+            fcm_latency_ms=None, fcm_failure_rate=None, seed=None):
+    """Patch ``firestore.client`` and the ``messaging`` send/topic functions with fakes.
+
+    The FCM settings default to the Firestore ones when not given.
+    """
+    global _installed
+    if _installed is not None:
+        uninstall()
+
+    db = FakeFirestoreClient(SimulatedConditions(latency_ms, jitter_ms, failure_rate, seed))
+    fcm = FakeMessaging(SimulatedConditions(
+        latency_ms if fcm_latency_ms is None else fcm_latency_ms,
+        jitter_ms,
+        failure_rate if fcm_failure_rate is None else fcm_failure_rate,
+        None if seed is None else seed + 1,
+    ))
+
+    _originals['firestore.client'] = firestore.client
+    _originals['messaging.send'] = messaging.send
+    _originals['messaging.send_each'] = messaging.send_each
+    _originals['messaging.subscribe_to_topic'] = messaging.subscribe_to_topic
+    _originals['messaging.unsubscribe_from_topic'] = messaging.unsubscribe_from_topic
+    firestore.client = lambda app=None, database_id=None: db
+    messaging.send = fcm.send
+    messaging.send_each = fcm.send_each
+    messaging.subscribe_to_topic = fcm.subscribe_to_topic
+    messaging.unsubscribe_from_topic = fcm.unsubscribe_from_topic
+
+    _installed = FakeBackend(db, fcm)
+    return _installed
+
+
+def uninstall():
+    """Restore the real Firestore client and messaging functions."""
+    global _installed
+    if _installed is None:
+        return
+    firestore.client = _originals.pop('firestore.client')
+    messaging.send = _originals.pop('messaging.send')
+    messaging.send_each = _originals.pop('messaging.send_each')
+    messaging.subscribe_to_topic = _originals.pop('messaging.subscribe_to_topic')
+    messaging.unsubscribe_from_topic = _originals.pop('messaging.unsubscribe_from_topic')
+    _installed = None
@@ -0,0 +1,130 @@
+"""
+Compact FCM payloads and keep them within FCM's size limits.
+
+FCM rejects a message whose data payload, or whose APNs payload, is over
+4 KB. Bidding alerts used to carry the full task description in the data
+payload and copy the whole payload again into the APNs custom data and
+the Android config. This module builds the data payload once:
+
+- ``compact_data`` drops empty values and cuts long fields to per-field
+  byte budgets (``FIELD_BUDGETS``), leaving ids untouched; clients fetch
+  full details by ``request_id``.
+- ``reference`` is the id-only stand-in used wherever the payload used to
+  be duplicated.
+- ``fit`` measures a built message's serialized sections (``measure``)
+  before it is sent. An oversized message is rebuilt with the shrinkable
+  fields halved, then removed; if it still does not fit,
+  ``PayloadTooLargeError`` is raised so the caller can skip it instead of
+  having the whole batch fail.
+"""
+
+import json
+import logging
+import os
+
+from firebase_admin import _messaging_encoder
+
+# FCM's limit for the data payload and for the APNs payload
+MAX_PAYLOAD_BYTES = 4096
+
+# Margin left for fields FCM adds on delivery (from, collapse_key, gcm.message_id, ...)
+HEADROOM_BYTES = int(os.environ.get('FCM_PAYLOAD_HEADROOM_BYTES', '512'))
+
+# Byte budgets for free-text fields; other fields are short ids and enums
+FIELD_BUDGETS = {
+    'task_description': 240,
+    'suggested_price': 40,
+    'title': 120,
+    'body': 240,
+}
+
+# Fields shrunk, in order, when a message is over budget
+SHRINKABLE_FIELDS = ('task_description', 'suggested_price')
+
+ELLIPSIS = '…'
+
+
+class PayloadTooLargeError(ValueError):
+    def __init__(self, sizes):
+        self.sizes = sizes
+        super().__init__(f"FCM payload over {MAX_PAYLOAD_BYTES} bytes even after compaction: {sizes}")
+
+
+def truncate(text, max_bytes):
+    """Cut ``text`` to at most ``max_bytes`` of UTF-8, on a character boundary, marking the cut."""
+    text = '' if text is None else str(text)
+    encoded = text.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return text
+    keep = max(0, max_bytes - len(ELLIPSIS.encode('utf-8')))
+    return encoded[:keep].decode('utf-8', errors='ignore').rstrip() + ELLIPSIS
+
+
+def compact_data(fields, budgets=None):
+    """FCM data payload from ``fields``: string values, no empties, free text cut to its byte budget."""
+    budgets = FIELD_BUDGETS if budgets is None else budgets
+    data = {}
+    for key, value in fields.items():
+        if value is None or value == '':
+            continue
+        value = str(value)
+        if key in budgets:
+            value = truncate(value, budgets[key])
+        data[key] = value
+    return data
+
+
+def reference(data):
+    """Id-only stand-in for a payload that would otherwise be repeated in platform config."""
+    return {key: data[key] for key in ('type', 'request_id') if key in data}
+
+
+def _encoded_size(value):
+    return len(json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+
+def measure(message):
+    """Serialized byte sizes of a message's data, APNs payload, Android config and the whole message."""
+    encoded = _messaging_encoder.MessageEncoder().default(message)
+    return {
+        'data': sum(len(k.encode('utf-8')) + len(v.encode('utf-8')) for k, v in (encoded.get('data') or {}).items()),
+        'apns': _encoded_size((encoded.get('apns') or {}).get('payload') or {}),
+        'android': _encoded_size(encoded.get('android') or {}),
+        'total': _encoded_size(encoded),
+    }
+
+
+def _over_budget(sizes):
+    limit = MAX_PAYLOAD_BYTES - HEADROOM_BYTES
+    return sizes['data'] > limit or sizes['apns'] > limit
+
+
+def fit(build, data, shrinkable=SHRINKABLE_FIELDS):
+    """
+    Build a message with ``build(data)``, shrinking ``shrinkable`` fields of ``data`` until it fits.
+    Returns the message; raises PayloadTooLargeError if it cannot be made to fit.
+    """
+    data = dict(data)
+    message = build(data)
+    sizes = measure(message)
+    for field in shrinkable:
+        while _over_budget(sizes) and field in data:
+            current = len(data[field].encode('utf-8'))
+            if current > 32:
+                data[field] = truncate(data[field], current // 2)
+            else:
+                del data[field]
+            message = build(data)
+            sizes = measure(message)
+    if _over_budget(sizes):
+        raise PayloadTooLargeError(sizes)
+    return message
+
+
+def fit_or_skip(build, data, label):
+    """``fit``, logging and returning None for a message that cannot be sent."""
+    try:
+        return fit(build, data)
+    except PayloadTooLargeError as e:
+        logging.error(f"Skipping {label}: {str(e)}")
+        return None
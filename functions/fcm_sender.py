@@ -0,0 +1,195 @@
+"""
+Rate-limited FCM sending shared by every notification path in main.py.
+
+All sends on a warm instance draw from one token bucket so that large fan-outs
+stay at the configured quota ceiling instead of tripping FCM's limits. Messages
+that fail with transient errors (UNAVAILABLE, INTERNAL, QUOTA_EXCEEDED) are
+retried by index with jittered exponential backoff; everything else is
+reported back to the caller unchanged. A send cut short by backpressure
+hands back what it already sent (``FCMBackpressureError.partial``) so that
+delivered messages are not counted as failed or sent again.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+
+from firebase_admin import exceptions as firebase_exceptions
+from firebase_admin import messaging
+
+# FCM accepts at most 500 messages per send_each call
+MAX_BATCH_SIZE = 500
+
+SEND_RATE_PER_SECOND = float(os.environ.get('FCM_SEND_RATE_PER_SECOND', '500'))
+SEND_BURST = int(os.environ.get('FCM_SEND_BURST', '500'))
+MAX_WAIT_SECONDS = float(os.environ.get('FCM_MAX_WAIT_SECONDS', '10'))
+MAX_ATTEMPTS = int(os.environ.get('FCM_MAX_ATTEMPTS', '4'))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+
+RETRYABLE_ERRORS = (
+    firebase_exceptions.UnavailableError,
+    firebase_exceptions.InternalError,
+    firebase_exceptions.DeadlineExceededError,
+    messaging.QuotaExceededError,
+)
+
+# Errors that mean the token itself is dead and should be dropped from profiles
+INVALID_TOKEN_ERRORS = (
+    messaging.UnregisteredError,
+    messaging.SenderIdMismatchError,
+)
+
+
+class PartialBatchResponse:
+    """Responses of a send cut short, lined up with its messages; None marks a message that was not sent."""
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    @property
+    def success_count(self):
+        return sum(1 for response in self.responses if response is not None and response.success)
+
+    @property
+    def failure_count(self):
+        return sum(1 for response in self.responses if response is not None and not response.success)
+
+    @property
+    def unsent_count(self):
+        return sum(1 for response in self.responses if response is None)
+
+
+class FCMBackpressureError(Exception):
+    """
+    Raised when the send budget stays exhausted for longer than the caller may wait.
+    From send_each, ``partial`` holds the responses of the messages sent before it gave up.
+    """
+
+    def __init__(self, retry_after, partial=None):
+        super().__init__(f"FCM send budget exhausted, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.partial = partial
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at ``rate`` tokens per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, count=1):
+        """Take ``count`` tokens if available. Returns 0 on success, else seconds until they would be."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= count:
+                self._tokens -= count
+                return 0.0
+            return (count - self._tokens) / self.rate
+
+    def acquire(self, count=1, max_wait=None):
+        """Block until ``count`` tokens are taken, raising FCMBackpressureError past ``max_wait``."""
+        if count > self.capacity:
+            raise ValueError(f"Cannot acquire {count} tokens from a bucket of {self.capacity:.0f}")
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire(count)
+            if wait == 0.0:
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise FCMBackpressureError(wait)
+            time.sleep(wait)
+
+
+_limiter = TokenBucket(SEND_RATE_PER_SECOND, SEND_BURST)
+
+
+def get_limiter():
+    return _limiter
+
+
+def is_retryable(exception):
+    return isinstance(exception, RETRYABLE_ERRORS)
+
+
+def is_token_invalid(exception):
+    return isinstance(exception, INVALID_TOKEN_ERRORS)
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff for the given retry attempt (1-based)."""
+    ceiling = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** (attempt - 1)))
+    return random.uniform(0, ceiling)
+
+
+def send_each(messages, max_wait=MAX_WAIT_SECONDS, max_attempts=MAX_ATTEMPTS):
+    """
+    Send messages through the shared rate limiter, retrying only transient failures.
+
+    Returns a messaging.BatchResponse whose responses line up with ``messages``.
+    Raises FCMBackpressureError if the budget does not free up within ``max_wait``; its
+    ``partial`` response covers the chunks already sent.
+    """
+    responses = [None] * len(messages)
+    chunk_size = max(1, min(MAX_BATCH_SIZE, int(_limiter.capacity)))
+
+    pending = list(range(len(messages)))
+    for attempt in range(1, max_attempts + 1):
+        if attempt > 1:
+            time.sleep(_backoff(attempt - 1))
+
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            try:
+                _limiter.acquire(len(chunk), max_wait=max_wait)
+            except FCMBackpressureError as e:
+                raise FCMBackpressureError(e.retry_after, PartialBatchResponse(list(responses))) from None
+            batch_response = messaging.send_each([messages[i] for i in chunk])
+            for index, response in zip(chunk, batch_response.responses):
+                responses[index] = response
+
+        pending = [
+            i for i in pending
+            if not responses[i].success and is_retryable(responses[i].exception)
+        ]
+        if not pending:
+            break
+        if attempt < max_attempts:
+            logging.info(f"Retrying {len(pending)} transient FCM failures (attempt {attempt + 1}/{max_attempts})")
+
+    if pending:
+        logging.warning(f"Giving up on {len(pending)} FCM messages after {max_attempts} attempts")
+
+    return messaging.BatchResponse(responses)
+
+
+def job_response(future):
+    """
+    Response of a finished send job: its BatchResponse, the PartialBatchResponse of a job cut
+    short by backpressure, or None if the job failed outright.
+    """
+    exception = future.exception()
+    if exception is None:
+        return future.result()
+    if isinstance(exception, FCMBackpressureError) and exception.partial is not None:
+        return exception.partial
+    return None
+
+
+def send(message, max_wait=MAX_WAIT_SECONDS, max_attempts=MAX_ATTEMPTS):
+    """Send a single message through the limiter. Raises the final send exception on failure."""
+    response = send_each([message], max_wait=max_wait, max_attempts=max_attempts).responses[0]
+    if not response.success:
+        raise response.exception
+    return response.message_id
@@ -0,0 +1,171 @@
+"""
+FCM topic subscriptions for category x area bidding broadcasts.
+
+Every eligible provider device is subscribed to one topic per
+(service category, service area) pair, e.g. ``bidding_plumbing_seattle``.
+A wide-audience request can then go out as a handful of condition messages
+instead of one send per provider token. Subscriptions are kept in sync from
+the providers update trigger by diffing the old and new profile, over both
+the legacy ``fcmTokens`` array and the devices in the token registry.
+``resync_subscriptions`` rebuilds them from scratch, unsubscribing tokens
+from every known topic their provider no longer belongs to.
+"""
+
+import logging
+import re
+from collections import defaultdict
+
+from firebase_admin import messaging
+
+TOPIC_PREFIX = 'bidding'
+
+# FCM accepts at most 1000 tokens per subscribe/unsubscribe call
+MAX_TOKENS_PER_CALL = 1000
+
+# FCM conditions may reference at most 5 topics
+MAX_TOPICS_PER_CONDITION = 5
+
+# Only providers that could be matched receive broadcasts
+ELIGIBLE_STATUSES = ('verified', 'active')
+
+# Provider fields provider_topics() reads
+SUBSCRIPTION_FIELDS = ('status', 'is_active', 'accepting_new_requests', 'service_categories', 'service_areas')
+
+
+def _slug(value):
+    return re.sub(r'[^a-z0-9]+', '-', str(value).strip().lower()).strip('-')
+
+
+def topic_name(category, area):
+    return f"{TOPIC_PREFIX}_{_slug(category)}_{_slug(area)}"
+
+
+def topics_for(categories, areas):
+    """Return the sorted topic names for every category x area pair."""
+    if isinstance(categories, str):
+        categories = [categories]
+    if isinstance(areas, str):
+        areas = [areas]
+    topics = {
+        topic_name(category, area)
+        for category in (categories or []) if _slug(category)
+        for area in (areas or []) if _slug(area)
+    }
+    return sorted(topics)
+
+
+def provider_topics(provider_data):
+    """Topics a provider's devices should be subscribed to, given its profile."""
+    if not provider_data:
+        return set()
+    if provider_data.get('status') not in ELIGIBLE_STATUSES:
+        return set()
+    if not provider_data.get('is_active', True) or not provider_data.get('accepting_new_requests', True):
+        return set()
+    return set(topics_for(provider_data.get('service_categories', []), provider_data.get('service_areas', [])))
+
+
+def reached_by(provider_data, topics):
+    """Whether a provider's devices are subscribed to any of ``topics`` (so a broadcast to them reaches it)."""
+    return bool(provider_topics(provider_data) & set(topics))
+
+
+def build_conditions(topics):
+    """Split topics into FCM condition strings of at most MAX_TOPICS_PER_CONDITION topics each."""
+    topics = list(topics)
+    return [
+        ' || '.join(f"'{topic}' in topics" for topic in topics[i:i + MAX_TOPICS_PER_CONDITION])
+        for i in range(0, len(topics), MAX_TOPICS_PER_CONDITION)
+    ]
+
+
+def _chunks(tokens):
+    tokens = list(tokens)
+    for i in range(0, len(tokens), MAX_TOKENS_PER_CALL):
+        yield tokens[i:i + MAX_TOKENS_PER_CALL]
+
+
+def _apply(action, tokens, topic):
+    failures = 0
+    for chunk in _chunks(tokens):
+        response = action(chunk, topic)
+        failures += response.failure_count
+    return failures
+
+
+def sync_provider_subscriptions(provider_id, old_data, new_data, registered_tokens=()):
+    """
+    Subscribe/unsubscribe a provider's tokens so they match its current topics.
+
+    ``registered_tokens`` are the provider's devices from the token registry;
+    they belong to the provider before and after the update alike. Only the
+    difference between the old and new profile is sent to FCM, so an update
+    that touches neither tokens nor categories/areas makes no calls.
+    Returns (subscribed, unsubscribed) token-topic pair counts.
+    """
+    old_topics = provider_topics(old_data)
+    new_topics = provider_topics(new_data)
+    old_tokens = set((old_data or {}).get('fcmTokens', [])) | set(registered_tokens)
+    new_tokens = set((new_data or {}).get('fcmTokens', [])) | set(registered_tokens)
+
+    subscribed = 0
+    unsubscribed = 0
+    failures = 0
+
+    for topic in new_topics:
+        tokens = new_tokens if topic not in old_topics else new_tokens - old_tokens
+        if tokens:
+            failures += _apply(messaging.subscribe_to_topic, tokens, topic)
+            subscribed += len(tokens)
+
+    for topic in old_topics:
+        tokens = old_tokens if topic not in new_topics else old_tokens - new_tokens
+        if tokens:
+            failures += _apply(messaging.unsubscribe_from_topic, tokens, topic)
+            unsubscribed += len(tokens)
+
+    if subscribed or unsubscribed:
+        logging.info(f"Synced topics for provider {provider_id}: +{subscribed} / -{unsubscribed} subscriptions"
+                     f"{f' ({failures} failed)' if failures else ''}")
+    return subscribed, unsubscribed
+
+
+def resync_subscriptions(providers):
+    """
+    Rebuild subscriptions for ``providers``, a list of (provider_id, provider_data, tokens).
+
+    Every token is subscribed to its provider's topics and unsubscribed from
+    every other known topic, i.e. every category x area pair the given
+    providers list, whether or not they are currently eligible. Calls are
+    made per topic, so the cost grows with topics, not providers.
+    Returns (subscribed, unsubscribed) token-topic pair counts.
+    """
+    providers = list(providers)
+    known_topics = set()
+    for _provider_id, provider_data, _tokens in providers:
+        known_topics.update(topics_for(provider_data.get('service_categories', []),
+                                       provider_data.get('service_areas', [])))
+
+    wanted = defaultdict(set)
+    unwanted = defaultdict(set)
+    for _provider_id, provider_data, tokens in providers:
+        topics = provider_topics(provider_data)
+        for topic in known_topics:
+            (wanted if topic in topics else unwanted)[topic].update(tokens)
+
+    subscribed = 0
+    unsubscribed = 0
+    failures = 0
+    for topic in sorted(known_topics):
+        if wanted[topic]:
+            failures += _apply(messaging.subscribe_to_topic, wanted[topic], topic)
+            subscribed += len(wanted[topic])
+        # A token listed under two providers stays subscribed if either wants the topic
+        stale = unwanted[topic] - wanted[topic]
+        if stale:
+            failures += _apply(messaging.unsubscribe_from_topic, stale, topic)
+            unsubscribed += len(stale)
+
+    if failures:
+        logging.warning(f"{failures} topic subscription changes failed during resync")
+    return subscribed, unsubscribed
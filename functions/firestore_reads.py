@@ -0,0 +1,63 @@
+"""
+Projection-aware Firestore reads.
+
+Provider and user profiles carry 30+ fields, but most call sites only need
+one or two of them. Each call site declares the fields it reads and these
+helpers pass them down as a field mask, so single gets, multi-gets and
+queries only transfer and deserialize what is used.
+
+``submit`` runs a read on a shared thread pool, so a handler can issue reads
+that do not depend on each other concurrently and wait on all of them in
+about one round trip.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud.firestore_v1.field_path import FieldPath
+
+# Field sets shared by several call sites
+PROVIDER_NOTIFICATION_FIELDS = ('fcmTokens', 'companyName')
+USER_NOTIFICATION_FIELDS = ('fcmTokens',)
+
+# Project onto the document name only, for queries that just need ids/references
+ID_ONLY = (FieldPath.document_id(),)
+
+
+def get_fields(doc_ref, fields, transaction=None):
+    """Single get that only returns ``fields``."""
+    return doc_ref.get(field_paths=list(fields), transaction=transaction)
+
+
+def get_all_fields(db, doc_refs, fields):
+    """
+    Multi-get in one round trip that only returns ``fields``.
+    Returns {document_id: snapshot}; missing documents have snapshot.exists == False.
+    """
+    doc_refs = list(doc_refs)
+    if not doc_refs:
+        return {}
+    return {snapshot.id: snapshot for snapshot in db.get_all(doc_refs, field_paths=list(fields))}
+
+
+def select_fields(query, fields):
+    """Query that only returns ``fields`` for each matching document."""
+    return query.select(list(fields))
+
+
+# Threads shared by handlers issuing independent reads concurrently
+IO_WORKERS = int(os.environ.get('FIRESTORE_IO_WORKERS', '16'))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def submit(fn, *args, **kwargs):
+    """Run a read on the shared I/O pool and return its Future."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='firestore-io')
+    return _executor.submit(fn, *args, **kwargs)
@@ -0,0 +1,157 @@
+"""
+End-to-end latency tracing of the bidding funnel.
+
+Every bidding fan-out gets a trace id. It is stored on the bidding session,
+sent to providers in the FCM data payload (``trace_id``) and copied onto
+each bid, so submit_bid and accept_bid can find it. Each stage reached adds a
+timestamp to one small document per trace:
+
+    bidding_traces/{traceId}
+        requestId, category, urgency
+        stages: {matched, notified, first_bid, accepted}
+
+The request paths only make blind merge writes (the first-bid mark rides in
+submit_bid's batch). The aggregate_funnel_trace trigger turns newly added
+stages into latency histogram increments per category and urgency:
+
+    funnel_latency_histograms/{category}__{urgency}
+        {transition}: {count, sumSeconds, buckets: {le_<seconds>: n}}
+"""
+
+import re
+import uuid
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+TRACES_COLLECTION = 'bidding_traces'
+HISTOGRAMS_COLLECTION = 'funnel_latency_histograms'
+
+STAGES = ('matched', 'notified', 'first_bid', 'accepted')
+
+# Stage pairs whose latency is tracked, as (name, from_stage, to_stage)
+TRANSITIONS = (
+    ('matched_to_notified', 'matched', 'notified'),
+    ('notified_to_first_bid', 'notified', 'first_bid'),
+    ('first_bid_to_accepted', 'first_bid', 'accepted'),
+    ('matched_to_accepted', 'matched', 'accepted'),
+)
+
+# Histogram bucket upper bounds in seconds; larger values land in 'le_inf'
+BUCKET_BOUNDS = (10, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 14400, 28800, 86400, 172800)
+BUCKET_LABELS = tuple(f'le_{bound}' for bound in BUCKET_BOUNDS) + ('le_inf',)
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:20]
+
+
+def trace_ref(db, trace_id):
+    return db.collection(TRACES_COLLECTION).document(trace_id)
+
+
+def start(db, trace_id, request_id, category, urgency, stages, batch=None):
+    """Create a trace with its first stage timestamps ({stage: datetime})."""
+    data = {
+        'requestId': request_id,
+        'category': category or 'unknown',
+        'urgency': urgency or 'normal',
+        'stages': dict(stages),
+        'createdAt': firestore.SERVER_TIMESTAMP,
+    }
+    if batch is not None:
+        batch.set(trace_ref(db, trace_id), data, merge=True)
+    else:
+        trace_ref(db, trace_id).set(data, merge=True)
+
+
+def stage_update(stage, at=None):
+    """Merge data recording that a trace reached ``stage``."""
+    if stage not in STAGES:
+        raise ValueError(f"Unknown funnel stage: {stage}")
+    return {'stages': {stage: at or datetime.now(timezone.utc)}}
+
+
+def mark(db, trace_id, stage, at=None, batch=None):
+    """Record that a trace reached ``stage`` (a blind merge write; no read)."""
+    if batch is not None:
+        batch.set(trace_ref(db, trace_id), stage_update(stage, at), merge=True)
+    else:
+        trace_ref(db, trace_id).set(stage_update(stage, at), merge=True)
+
+
+def bucket_label(seconds):
+    for bound in BUCKET_BOUNDS:
+        if seconds <= bound:
+            return f'le_{bound}'
+    return 'le_inf'
+
+
+def histogram_id(category, urgency):
+    def clean(value):
+        return re.sub(r'[^a-z0-9_-]', '-', str(value or 'unknown').lower())
+    return f'{clean(category)}__{clean(urgency)}'
+
+
+def _as_utc(moment):
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+
+def new_transitions(before_stages, after_stages):
+    """Latencies ({transition: seconds}) that became measurable with this update."""
+    latencies = {}
+    for name, from_stage, to_stage in TRANSITIONS:
+        if to_stage in (before_stages or {}) or to_stage not in after_stages or from_stage not in after_stages:
+            continue
+        seconds = (_as_utc(after_stages[to_stage]) - _as_utc(after_stages[from_stage])).total_seconds()
+        if seconds >= 0:
+            latencies[name] = seconds
+    return latencies
+
+
+def record_transitions(db, category, urgency, latencies):
+    """Add latencies to the category/urgency histogram with one increment write."""
+    if not latencies:
+        return
+    db.collection(HISTOGRAMS_COLLECTION).document(histogram_id(category, urgency)).set({
+        'category': category or 'unknown',
+        'urgency': urgency or 'normal',
+        **{
+            name: {
+                'count': firestore.Increment(1),
+                'sumSeconds': firestore.Increment(seconds),
+                'buckets': {bucket_label(seconds): firestore.Increment(1)},
+            }
+            for name, seconds in latencies.items()
+        },
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
+
+def _bucket_quantile(buckets, count, q):
+    """Upper bound (seconds) of the bucket holding the q-quantile; None past the last bound."""
+    seen = 0
+    for bound in BUCKET_BOUNDS:
+        seen += buckets.get(f'le_{bound}', 0)
+        if seen >= q * count:
+            return bound
+    return None
+
+
+def summarize(histogram):
+    """Count, mean and bucket-resolution p50/p90 for each transition of a histogram document."""
+    summary = {'category': histogram.get('category'), 'urgency': histogram.get('urgency'), 'transitions': {}}
+    for name, _from_stage, _to_stage in TRANSITIONS:
+        data = histogram.get(name)
+        if not data or not data.get('count'):
+            continue
+        count = data['count']
+        buckets = data.get('buckets', {})
+        summary['transitions'][name] = {
+            'count': count,
+            'meanSeconds': round(data.get('sumSeconds', 0) / count, 1),
+            'p50Seconds': _bucket_quantile(buckets, count, 0.5),
+            'p90Seconds': _bucket_quantile(buckets, count, 0.9),
+            'buckets': {label: buckets.get(label, 0) for label in BUCKET_LABELS},
+        }
+    return summary
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Import provider profiles into Firestore.
+
+Accepted inputs are streamed record by record, so files of any size can be imported:
+  - an object keyed by provider id, like providers_import.json: {"test_provider_01": {...}, ...}
+  - an array of records: [{"id": "test_provider_01", ...}, ...]
+  - JSONL, one record per line
+
+Each record is validated and normalized with the update_provider_profile rules
+(provider_profile.py) and upserted with set(merge=True) under a stable
+document id, so re-running an import never duplicates providers. Writes go
+through BulkWriters (parallel batches, 500/50/5 ramp-up) on --workers threads.
+Progress is checkpointed to a file; an interrupted run resumes after the last
+checkpoint. Rejected rows go to a JSONL file and the run ends with a report.
+
+Usage:
+    python import_providers.py ../providers_import.json
+    python import_providers.py providers.jsonl --key-field email --workers 4 --max-ops 2000
+    python import_providers.py providers.jsonl --dry-run --rejects rejects.jsonl
+    python import_providers.py providers.jsonl --fake   # in-memory backend, for benchmarking
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+import firebase_admin
+from firebase_admin import firestore
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+
+import provider_profile
+
+READ_CHUNK_SIZE = 1 << 16
+
+# gRPC codes worth retrying: DEADLINE_EXCEEDED, ABORTED, INTERNAL, UNAVAILABLE, RESOURCE_EXHAUSTED
+RETRYABLE_CODES = (4, 8, 10, 13, 14)
+MAX_WRITE_ATTEMPTS = 10
+NOT_FOUND = 5
+
+_WHITESPACE = ' \t\r\n'
+
+
+class ImportRecord:
+    def __init__(self, ordinal, key, data, error=None):
+        self.ordinal = ordinal
+        self.key = key
+        self.data = data
+        self.error = error
+
+
+class _JSONStream:
+    """Incremental decoder over a text file that never holds more than one value plus a read chunk."""
+
+    def __init__(self, f):
+        self._f = f
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        if self._eof:
+            return False
+        chunk = self._f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ('' at end of input)."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, characters):
+        char = self.peek()
+        if char not in characters:
+            raise ValueError(f"Expected one of {characters!r} but found {char!r}")
+        self._pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # The value may continue past the buffered text; read more before giving up
+                if self._fill():
+                    continue
+                raise
+            # A number at the very end of the buffer may still be cut off
+            if end == len(self._buffer) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+def iter_records(path, key_field='id'):
+    """Yield ImportRecord(ordinal, key, data) for every record in an object, array or JSONL file."""
+    if path.endswith(('.jsonl', '.ndjson')):
+        yield from _iter_jsonl(path, key_field)
+        return
+
+    with open(path, encoding='utf-8') as f:
+        stream = _JSONStream(f)
+        opening = stream.expect('{[')
+        closing = '}' if opening == '{' else ']'
+        if stream.peek() == closing:
+            return
+        ordinal = 0
+        while True:
+            if opening == '{':
+                object_key = str(stream.value())
+                stream.expect(':')
+                data = stream.value()
+                if ordinal == 0 and not isinstance(data, dict):
+                    raise ValueError(f"{path} is not an object of records; use a .jsonl extension for JSONL")
+                # Object keys are the provider ids unless another upsert key was asked for
+                key = object_key if key_field == 'id' else _record_key(data, key_field)
+            else:
+                data = stream.value()
+                key = _record_key(data, key_field)
+            yield ImportRecord(ordinal, key, data)
+            ordinal += 1
+            if stream.expect(',' + closing) == closing:
+                return
+
+
+def _iter_jsonl(path, key_field):
+    with open(path, encoding='utf-8') as f:
+        ordinal = 0
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError as e:
+                # A malformed line is a rejected row, not a failed import
+                yield ImportRecord(ordinal, None, None, error=f"invalid JSON: {e}")
+            else:
+                yield ImportRecord(ordinal, _record_key(data, key_field), data)
+            ordinal += 1
+
+
+def _record_key(data, key_field):
+    if not isinstance(data, dict):
+        return None
+    value = data.get(key_field)
+    return str(value).strip() if value not in (None, '') else None
+
+
+def document_id_for(key, key_field):
+    """Stable document id for an upsert key. Natural ids are kept; other keys are hashed."""
+    if key_field == 'id' and '/' not in key and key not in ('.', '..') and len(key.encode('utf-8')) <= 700:
+        return key
+    return 'imp_' + hashlib.sha1(f"{key_field}:{key.lower()}".encode('utf-8')).hexdigest()[:24]
+
+
+def input_fingerprint(path):
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def load_progress(progress_path, fingerprint):
+    if not progress_path or not os.path.exists(progress_path):
+        return None
+    with open(progress_path) as f:
+        progress = json.load(f)
+    if progress.get('fingerprint') != fingerprint:
+        print(f"Ignoring {progress_path}: it belongs to a different input file")
+        return None
+    return progress
+
+
+def save_progress(progress_path, progress):
+    if not progress_path:
+        return
+    temp_path = f"{progress_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(progress, f, indent=2)
+    os.replace(temp_path, progress_path)
+
+
+class ImportStats:
+    def __init__(self, initial=None):
+        initial = initial or {}
+        self._lock = threading.Lock()
+        self.counts = {key: initial.get(key, 0) for key in
+                       ['read', 'written', 'rejected', 'write_failed', 'referrals_linked', 'referrals_missing']}
+
+    def add(self, key, amount=1):
+        with self._lock:
+            self.counts[key] += amount
+
+
+class ImportWorker:
+    """One writer thread with its own BulkWriter. The main thread hands it records over a queue."""
+
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, db, collection, options, stats, link_referrals):
+        self._db = db
+        self._collection = collection
+        self._stats = stats
+        self._link_referrals = link_referrals
+        self._queue = queue.Queue(maxsize=2000)
+        self._writer = db.bulk_writer(options=options)
+        self._writer.on_write_result(self._on_result)
+        self._writer.on_write_error(self._on_error)
+        self.failures = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _on_result(self, reference, result, writer):
+        if reference.parent.id == 'users':
+            self._stats.add('referrals_linked')
+        else:
+            self._stats.add('written')
+
+    def _on_error(self, failure, writer):
+        if failure.code in RETRYABLE_CODES and failure.attempts < MAX_WRITE_ATTEMPTS:
+            return True
+        reference = failure.operation.reference
+        if reference.parent.id == 'users':
+            # Referring users that do not exist are reported, not treated as a failed import
+            self._stats.add('referrals_missing' if failure.code == NOT_FOUND else 'write_failed')
+        else:
+            self._stats.add('write_failed')
+            self.failures.append({'document_id': reference.id, 'code': failure.code, 'error': failure.message})
+        return False
+
+    def submit(self, document_id, data):
+        self._queue.put((document_id, data))
+
+    def flush(self):
+        """Block until everything submitted so far is written (or has failed for good)."""
+        self._queue.put(self._FLUSH)
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(self._STOP)
+        self._queue.join()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is self._STOP:
+                    self._writer.close()
+                    return
+                if item is self._FLUSH:
+                    self._writer.flush()
+                    continue
+                document_id, data = item
+                provider_ref = self._db.collection(self._collection).document(document_id)
+                self._writer.set(provider_ref, data, merge=True)
+                if self._link_referrals:
+                    for user_id in data.get('referred_by_user_ids', []):
+                        self._writer.update(self._db.collection('users').document(user_id), {
+                            'referred_provider_ids': firestore.ArrayUnion([document_id])
+                        })
+            finally:
+                self._queue.task_done()
+
+
+def build_document(record, document_id, key_field):
+    """Validated, normalized document for a record, or (None, errors)."""
+    if record.error:
+        return None, [record.error]
+    errors = provider_profile.validate_provider_record(record.data)
+    if record.key is None:
+        errors.append(f"missing upsert key '{key_field}'")
+    if errors:
+        return None, errors
+    document = dict(record.data)
+    document.pop('id', None)
+    document.update(provider_profile.normalize_provider_profile(document_id, record.data))
+    document['importKey'] = f"{key_field}:{record.key}"
+    document['importedAt'] = firestore.SERVER_TIMESTAMP
+    document['updatedAt'] = firestore.SERVER_TIMESTAMP
+    return document, []
+
+
+def run_import(db, path, collection='providers', key_field='id', workers=2, initial_ops=500, max_ops=500,
+               checkpoint_every=5000, progress_path=None, rejects_path=None, dry_run=False,
+               link_referrals=True, restart=False):
+    fingerprint = input_fingerprint(path)
+    progress = None if restart else load_progress(progress_path, fingerprint)
+    resume_from = progress['next_ordinal'] if progress else 0
+    stats = ImportStats(progress['counts'] if progress else None)
+    if resume_from:
+        print(f"Resuming after record {resume_from}")
+
+    # Each worker gets an equal share of the write budget; BulkWriter ramps up from initial_ops
+    options = BulkWriterOptions(
+        initial_ops_per_second=max(1, initial_ops // workers),
+        max_ops_per_second=max(1, max_ops // workers),
+    )
+    pool = [] if dry_run else [ImportWorker(db, collection, options, stats, link_referrals) for _ in range(workers)]
+
+    rejects = open(rejects_path, 'a' if resume_from else 'w') if rejects_path else None
+    started = time.monotonic()
+    seen_ids = set()
+    next_ordinal = resume_from
+
+    def checkpoint():
+        for worker in pool:
+            worker.flush()
+        if not dry_run:
+            save_progress(progress_path, {'fingerprint': fingerprint, 'next_ordinal': next_ordinal,
+                                          'counts': stats.counts})
+        if rejects:
+            rejects.flush()
+
+    try:
+        for record in iter_records(path, key_field):
+            if record.ordinal < resume_from:
+                continue
+            stats.add('read')
+            document_id = document_id_for(record.key, key_field) if record.key else None
+            document, errors = build_document(record, document_id or '', key_field)
+            if document_id in seen_ids:
+                errors = [f"duplicate upsert key {record.key!r} in this run"]
+            if errors:
+                stats.add('rejected')
+                if rejects:
+                    rejects.write(json.dumps({'ordinal': record.ordinal, 'key': record.key, 'errors': errors}) + '\n')
+            else:
+                seen_ids.add(document_id)
+                if pool:
+                    # Same key always goes to the same worker, so its writes stay ordered
+                    pool[int(hashlib.md5(document_id.encode('utf-8')).hexdigest(), 16) % len(pool)].submit(
+                        document_id, document
+                    )
+            next_ordinal = record.ordinal + 1
+            if next_ordinal % checkpoint_every == 0:
+                checkpoint()
+                elapsed = time.monotonic() - started
+                print(f"  {next_ordinal} records, {stats.counts['written']} written "
+                      f"({(next_ordinal - resume_from) / elapsed:.0f} records/s)")
+        checkpoint()
+    finally:
+        for worker in pool:
+            worker.close()
+        if rejects:
+            rejects.close()
+
+    elapsed = time.monotonic() - started
+    processed = next_ordinal - resume_from
+    return {
+        'input': path,
+        'collection': collection,
+        'dry_run': dry_run,
+        'resumed_from': resume_from,
+        'records': next_ordinal,
+        **stats.counts,
+        'failures': [failure for worker in pool for failure in worker.failures][:100],
+        'elapsed_seconds': round(elapsed, 2),
+        'records_per_second': round(processed / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def print_report(report):
+    print(f"\nImport of {report['input']} into '{report['collection']}'"
+          f"{' (dry run)' if report['dry_run'] else ''}")
+    print(f"  records:          {report['records']} (resumed from {report['resumed_from']})")
+    print(f"  written:          {report['written']}")
+    print(f"  rejected:         {report['rejected']}")
+    print(f"  write failures:   {report['write_failed']}")
+    print(f"  referrals linked: {report['referrals_linked']} ({report['referrals_missing']} users missing)")
+    print(f"  elapsed:          {report['elapsed_seconds']}s ({report['records_per_second']} records/s)")
+    for failure in report['failures'][:10]:
+        print(f"    failed {failure['document_id']}: {failure['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream provider records into Firestore')
+    parser.add_argument('input', help='Provider records (.json object/array or .jsonl)')
+    parser.add_argument('--collection', default='providers', help='Target collection')
+    parser.add_argument('--key-field', default='id',
+                        help="Upsert key: 'id' (object keys / record id) or a record field such as email")
+    parser.add_argument('--workers', type=int, default=2, help='Writer threads, each with its own BulkWriter')
+    parser.add_argument('--initial-ops', type=int, default=500, help='Starting writes/second across all workers')
+    parser.add_argument('--max-ops', type=int, default=500, help='Ceiling writes/second across all workers')
+    parser.add_argument('--checkpoint-every', type=int, default=5000, help='Records between progress checkpoints')
+    parser.add_argument('--progress', help='Progress file (default: <input>.progress.json)')
+    parser.add_argument('--rejects', help='Write rejected rows with their errors to this JSONL file')
+    parser.add_argument('--json-report', help='Also write the report as JSON to this path')
+    parser.add_argument('--restart', action='store_true', help='Ignore saved progress and start from the top')
+    parser.add_argument('--dry-run', action='store_true', help='Validate and normalize only, write nothing')
+    parser.add_argument('--no-referrals', action='store_true',
+                        help="Do not add imported providers to their referring users' referred_provider_ids")
+    parser.add_argument('--fake', action='store_true', help='Write to the in-memory fake backend (benchmarking)')
+    args = parser.parse_args()
+
+    if args.fake:
+        import fake_firebase
+        db = fake_firebase.install().db
+    else:
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app()
+        db = firestore.client()
+
+    report = run_import(
+        db, args.input,
+        collection=args.collection,
+        key_field=args.key_field,
+        workers=max(1, args.workers),
+        initial_ops=args.initial_ops,
+        max_ops=max(args.max_ops, args.initial_ops),
+        checkpoint_every=max(1, args.checkpoint_every),
+        progress_path=args.progress or f"{args.input}.progress.json",
+        rejects_path=args.rejects,
+        dry_run=args.dry_run,
+        link_referrals=not args.no_referrals,
+        restart=args.restart,
+    )
+    print_report(report)
+
+    if args.json_report:
+        with open(args.json_report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,52 @@
 
 import firebase_admin
 from firebase_admin import credentials, firestore, messaging
-from firebase_functions import firestore_fn, https_fn
+from firebase_functions import firestore_fn, https_fn, options, scheduler_fn
+from google.api_core import exceptions as google_exceptions
+from google.cloud.firestore_v1.field_path import FieldPath
 import logging
 import json
-from datetime import datetime, timedelta
+import math
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import admission
+import archival
+import bid_aggregates
+import bid_ranking
+import bidding_waves
+import device_tokens
+import doc_cache
+import notification_audit
+import fcm_payload
+import fcm_sender
+import fcm_topics
+import firestore_reads
+import funnel_trace
+import notification_scheduler
+import price_estimation
+import provider_profile
+import provider_stats
+import request_dedup
+import response_times
 
 # Initialize Firebase Admin SDK
 if not firebase_admin._apps:
     firebase_admin.initialize_app()
 
+# Statuses that send the provider a push notification
+STATUS_NOTIFICATION_STATUSES = ['verified', 'active', 'rejected']
+
+# Set by bulk_update_provider_status on its status writes; the providers trigger leaves those to the bulk call
+STATUS_NOTIFICATION_BATCH_FIELD = 'statusNotificationBatchId'
+
+# Set by bulk_update_provider_status on providers its throttled send never reached; the trigger notifies them
+STATUS_NOTIFICATION_REQUEUE_FIELD = 'statusNotificationRequeuedAt'
+
+# Set by backfill_provider_profiles on its writes; a status it fills in is not news to the provider
+PROFILE_BACKFILL_FIELD = 'profileBackfilledAt'
+
 @firestore_fn.on_document_updated(document="providers/{provider_id}")
 def send_provider_notification(event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None]) -> None:
     """
@@ -44,130 +81,95 @@ def send_provider_notification(event: firestore_fn.Event[firestore_fn.DocumentSn
         if old_snapshot and old_snapshot.exists:
             old_data = old_snapshot.to_dict()
         
+        # Drop this instance's cached copy of the provider (names and tokens may have changed)
+        doc_cache.invalidate('providers', provider_id)
+        
+        # Keep category x area broadcast topic subscriptions in sync with the profile
+        try:
+            registered_tokens = []
+            if fcm_topics.provider_topics(old_data) != fcm_topics.provider_topics(new_data) or \
+                    set(old_data.get('fcmTokens', [])) != set(new_data.get('fcmTokens', [])):
+                # Registry devices are subscribed too: their topics follow the profile, and a token
+                # dropped from fcmTokens keeps its topics while it is still registered
+                registered_tokens = [device.token for device in device_tokens.load_devices(
+                    firestore.client(), 'providers', [provider_id]
+                )[provider_id]]
+            fcm_topics.sync_provider_subscriptions(provider_id, old_data, new_data, registered_tokens)
+        except Exception as topic_error:
+            logging.error(f"Error syncing topics for provider {provider_id}: {str(topic_error)}")
+        
         # Check if status actually changed
         new_status = new_data.get('status')
         old_status = old_data.get('status')
         
-        if new_status == old_status:
+        # A bulk update whose send was throttled hands the provider's notification back to this trigger
+        requeued = new_data.get(STATUS_NOTIFICATION_REQUEUE_FIELD) is not None and \
+            new_data.get(STATUS_NOTIFICATION_REQUEUE_FIELD) != old_data.get(STATUS_NOTIFICATION_REQUEUE_FIELD)
+        
+        if new_status == old_status and not requeued:
             logging.info(f"Status unchanged for provider {provider_id}: {new_status}")
             return
             
+        # Bulk status updates send their notifications in one fan-out (or none with notify=false) and mark the write
+        batch_id = new_data.get(STATUS_NOTIFICATION_BATCH_FIELD)
+        if not requeued and batch_id and batch_id != old_data.get(STATUS_NOTIFICATION_BATCH_FIELD):
+            logging.info(f"Status notification for provider {provider_id} handled by bulk update {batch_id}")
+            return
+            
+        # The profile backfill only fills in defaults (e.g. a missing status); it never notifies
+        backfilled = new_data.get(PROFILE_BACKFILL_FIELD) is not None and \
+            new_data.get(PROFILE_BACKFILL_FIELD) != old_data.get(PROFILE_BACKFILL_FIELD)
+        if not requeued and backfilled:
+            logging.info(f"Skipping status notification for provider {provider_id}: profile backfill write")
+            return
+            
         # Check if status changed to verified or rejected
-        if new_status in ['verified', 'active', 'rejected']:
+        if new_status in STATUS_NOTIFICATION_STATUSES:
             logging.info(f"Provider {provider_id} status changed: {old_status} -> {new_status}")
             
-            # Get FCM tokens for this provider
-            fcm_tokens = new_data.get('fcmTokens', [])
+            # Get registered devices for this provider (legacy fcmTokens as fallback)
+            db = firestore.client()
+            devices = device_tokens.load_devices(
+                db, 'providers', [provider_id], {provider_id: new_data.get('fcmTokens', [])}
+            )[provider_id]
             
-            if not fcm_tokens:
+            if not devices:
                 logging.warning(f"No FCM tokens found for provider {provider_id}")
                 return
                 
             # Get additional provider info for richer notifications
             company_name = new_data.get('companyName', 'Provider')
-            
-            # Create notification based on status
-            if new_status in ['verified', 'active']:
-                notification = messaging.Notification(
-                    title="🎉 Account Verified!",
-                    body=f"Congratulations {company_name}! You can now start accepting service requests.",
-                    image=None
-                )
-                data = {
-                    'type': 'status_update',
-                    'status': new_status,
-                    'provider_id': provider_id,
-                    'action': 'verified',
-                    'company_name': company_name,
-                    'timestamp': str(firestore.SERVER_TIMESTAMP),
-                    'click_action': 'OPEN_PROVIDER_DASHBOARD'
-                }
-            else:  # rejected
-                notification = messaging.Notification(
-                    title="Application Update",
-                    body=f"Hi {company_name}, please check your email for details about your application.",
-                    image=None
-                )
-                data = {
-                    'type': 'status_update',
-                    'status': new_status,
-                    'provider_id': provider_id,
-                    'action': 'rejected',
-                    'company_name': company_name,
-                    'timestamp': str(firestore.SERVER_TIMESTAMP),
-                    'click_action': 'OPEN_SUPPORT'
-                }
-            
-            # Send notification to all registered devices
-            messages = []
-            for token in fcm_tokens:
-                # Enhanced APNS config for iOS with action buttons
-                apns_config = messaging.APNSConfig(
-                    headers={'apns-priority': '10'},
-                    payload=messaging.APNSPayload(
-                        aps=messaging.Aps(
-                            alert=messaging.ApsAlert(
-                                title=notification.title,
-                                body=notification.body
-                            ),
-                            badge=1,
-                            sound="default",
-                            category="STATUS_UPDATE",
-                            mutable_content=True
-                        ),
-                        custom_data={
-                            'click_action': data.get('click_action', ''),
-                            'company_name': data.get('company_name', ''),
-                            'provider_id': provider_id
-                        }
-                    )
-                )
-                
-                message = messaging.Message(
-                    notification=notification,
-                    data=data,
-                    token=token,
-                    apns=apns_config
-                )
-                messages.append(message)
+            notification, messages = _build_status_notification_messages(
+                provider_id, new_status, company_name, devices
+            )
             
             # Send batch notification
             if messages:
-                response = messaging.send_each(messages)
+                response = fcm_sender.send_each(messages)
                 logging.info(f"Sent {response.success_count} notifications for provider {provider_id}")
                 
                 if response.failure_count > 0:
                     logging.warning(f"Failed to send {response.failure_count} notifications")
-                    
-                    # Remove invalid tokens
-                    invalid_tokens = []
-                    for idx, resp in enumerate(response.responses):
+                    for device, resp in zip(devices, response.responses):
                         if not resp.success:
-                            invalid_tokens.append(fcm_tokens[idx])
-                            logging.error(f"Failed to send to token {fcm_tokens[idx]}: {resp.exception}")
+                            logging.error(f"Failed to send to token {device.token}: {resp.exception}")
                     
-                    # Update provider document to remove invalid tokens
-                    if invalid_tokens:
-                        db = firestore.client()
-                        provider_ref = db.collection('providers').document(provider_id)
-                        provider_ref.update({
-                            'fcmTokens': firestore.ArrayRemove(invalid_tokens)
-                        })
-                        logging.info(f"Removed {len(invalid_tokens)} invalid tokens for provider {provider_id}")
+                    # Remove invalid tokens (transient failures were already retried and keep their token)
+                    pruner = device_tokens.FailurePruner(db)
+                    pruner.add('providers', provider_id, devices, response)
+                    pruner.commit()
+                    if pruner.removed:
+                        logging.info(f"Removed {pruner.removed} invalid tokens for provider {provider_id}")
                 
-                # Log notification to provider_notifications collection
-                db = firestore.client()
-                db.collection('provider_notifications').add({
-                    'providerId': provider_id,
+                # Full record in provider_notifications; the provider app's notification history reads it
+                audit = notification_audit.status_logger(db)
+                audit.record_response(provider_id, 'status_update', devices, response, detail={
                     'type': 'push_notification',
                     'status': new_status,
                     'title': notification.title,
-                    'body': notification.body,
-                    'sentTo': len(fcm_tokens),
-                    'successCount': response.success_count,
-                    'failureCount': response.failure_count,
-                    'timestamp': firestore.SERVER_TIMESTAMP
+                    'body': notification.body
                 })
+                audit.flush()
                 
         else:
             logging.info(f"Status change for provider {provider_id} ({old_status} -> {new_status}) does not require notification")
@@ -178,6 +180,7 @@ def send_provider_notification(event: firestore_fn.Event[firestore_fn.DocumentSn
 
 
 @https_fn.on_request()
+@admission.limit('fanout')
 def test_notification(req: https_fn.Request) -> https_fn.Response:
     """
     HTTP function to test push notifications manually.
@@ -197,15 +200,19 @@ def test_notification(req: https_fn.Request) -> https_fn.Response:
         
         # Get provider data
         db = firestore.client()
-        provider_doc = db.collection('providers').document(provider_id).get()
+        provider_doc = firestore_reads.get_fields(
+            db.collection('providers').document(provider_id), ['fcmTokens']
+        )
         
         if not provider_doc.exists:
             return https_fn.Response(f"Provider {provider_id} not found", status=404)
             
         provider_data = provider_doc.to_dict()
-        fcm_tokens = provider_data.get('fcmTokens', [])
+        devices = device_tokens.load_devices(
+            db, 'providers', [provider_id], {provider_id: provider_data.get('fcmTokens', [])}
+        )[provider_id]
         
-        if not fcm_tokens:
+        if not devices:
             return https_fn.Response(f"No FCM tokens found for provider {provider_id}", status=400)
             
         # Create test notification
@@ -222,13 +229,13 @@ def test_notification(req: https_fn.Request) -> https_fn.Response:
             'timestamp': str(firestore.SERVER_TIMESTAMP)
         }
         
-        # Send to all tokens
+        # Send to all registered devices
         messages = []
-        for token in fcm_tokens:
-            message = messaging.Message(
+        for device in devices:
+            message = device_tokens.build_message(
+                device,
                 notification=notification,
                 data=data_payload,
-                token=token,
                 apns=messaging.APNSConfig(
                     payload=messaging.APNSPayload(
                         aps=messaging.Aps(
@@ -245,7 +252,7 @@ def test_notification(req: https_fn.Request) -> https_fn.Response:
             messages.append(message)
         
         # Send batch
-        response = messaging.send_each(messages)
+        response = fcm_sender.send_each(messages)
         
         return https_fn.Response(
             f"Test notification sent! Success: {response.success_count}, Failed: {response.failure_count}",
@@ -258,6 +265,7 @@ def test_notification(req: https_fn.Request) -> https_fn.Response:
 
 
 @https_fn.on_request()
+@admission.limit()
 def update_provider_status(req: https_fn.Request) -> https_fn.Response:
     """
     HTTP function to update provider status (for admin use).
@@ -282,7 +290,7 @@ def update_provider_status(req: https_fn.Request) -> https_fn.Response:
         provider_ref = db.collection('providers').document(provider_id)
         
         # Get current status first
-        provider_doc = provider_ref.get()
+        provider_doc = firestore_reads.get_fields(provider_ref, ['status'])
         if not provider_doc.exists:
             return https_fn.Response(f"Provider {provider_id} not found", status=404)
             
@@ -311,7 +319,145 @@ def update_provider_status(req: https_fn.Request) -> https_fn.Response:
         return https_fn.Response(f"Error: {str(e)}", status=500)
 
 
+# Status writes per batch commit for bulk_update_provider_status (Firestore allows 500 writes per batch)
+BULK_STATUS_WRITE_CHUNK = 400
+
+@https_fn.on_request()
+@admission.limit('admin')
+def bulk_update_provider_status(req: https_fn.Request) -> https_fn.Response:
+    """
+    HTTP function to update many provider statuses at once (for admin review days).
+    Current statuses are read with one multi-get, changes are written in chunked batches and
+    the resulting notifications go out in one batched send instead of one trigger run each.
+    Usage: POST /bulk_update_provider_status with JSON body:
+           {"updates": [{"provider_id": "xxx", "status": "verified"}, ...], "notify": true}
+    """
+    try:
+        if req.method != 'POST':
+            return https_fn.Response("Method not allowed", status=405)
+        
+        data = req.get_json()
+        if not data or not isinstance(data.get('updates'), list):
+            return https_fn.Response("Missing updates list in request body", status=400)
+        
+        started = time.monotonic()
+        notify = data.get('notify', True)
+        batch_id = uuid.uuid4().hex
+        db = firestore.client()
+        
+        # Validate and de-duplicate; the last entry for a provider wins
+        results = {}
+        requested = {}
+        for item in data['updates']:
+            provider_id = item.get('provider_id') if isinstance(item, dict) else None
+            new_status = item.get('status') if isinstance(item, dict) else None
+            if not provider_id:
+                continue
+            if new_status not in ['pending', 'verified', 'active', 'rejected', 'suspended']:
+                results[provider_id] = {'provider_id': provider_id, 'result': 'invalid_status', 'status': new_status}
+                requested.pop(provider_id, None)
+                continue
+            requested[provider_id] = new_status
+            results.pop(provider_id, None)
+        
+        # Read every current status (plus what notifications need) in one projected multi-get
+        provider_docs = firestore_reads.get_all_fields(
+            db,
+            [db.collection('providers').document(provider_id) for provider_id in requested],
+            ['status', 'fcmTokens', 'companyName']
+        )
+        
+        changes = []
+        for provider_id, new_status in requested.items():
+            provider_doc = provider_docs.get(provider_id)
+            if provider_doc is None or not provider_doc.exists:
+                results[provider_id] = {'provider_id': provider_id, 'result': 'not_found'}
+                continue
+            current_status = provider_doc.get('status')
+            if current_status == new_status:
+                results[provider_id] = {'provider_id': provider_id, 'result': 'unchanged', 'status': new_status}
+                continue
+            changes.append((provider_id, current_status, new_status))
+        
+        # Write changes in chunked batches; a failed commit only fails its own chunk
+        commits = 0
+        updated = []
+        for start in range(0, len(changes), BULK_STATUS_WRITE_CHUNK):
+            chunk = changes[start:start + BULK_STATUS_WRITE_CHUNK]
+            batch = db.batch()
+            for provider_id, current_status, new_status in chunk:
+                update_data = {
+                    'status': new_status,
+                    'previousStatus': current_status,
+                    'statusUpdatedAt': firestore.SERVER_TIMESTAMP,
+                    'reviewedBy': 'admin',  # In production, use actual admin user ID
+                    'reviewedAt': firestore.SERVER_TIMESTAMP,
+                    # Keeps the trigger from sending its own notification for this write
+                    STATUS_NOTIFICATION_BATCH_FIELD: batch_id
+                }
+                batch.update(db.collection('providers').document(provider_id), update_data)
+            try:
+                batch.commit()
+                commits += 1
+            except Exception as commit_error:
+                logging.error(f"Bulk status batch of {len(chunk)} failed: {str(commit_error)}")
+                for provider_id, current_status, new_status in chunk:
+                    results[provider_id] = {'provider_id': provider_id, 'result': 'failed',
+                                            'error': str(commit_error)}
+                continue
+            for provider_id, current_status, new_status in chunk:
+                results[provider_id] = {'provider_id': provider_id, 'result': 'updated',
+                                        'previous_status': current_status, 'status': new_status}
+                updated.append((provider_id, new_status))
+        write_seconds = time.monotonic() - started
+        
+        # One batched fan-out for every provider whose status change needs a notification
+        notification_stats = {'sent': 0, 'failed': 0, 'unsent': [], 'throttled': None}
+        to_notify = [(provider_id, new_status) for provider_id, new_status in updated
+                     if notify and new_status in STATUS_NOTIFICATION_STATUSES]
+        if to_notify:
+            notification_stats = _send_bulk_status_notifications(db, to_notify, provider_docs)
+            if notification_stats['throttled'] is not None:
+                # Statuses are already written; hand the unsent notifications to the trigger instead of failing the call
+                logging.warning(f"Bulk status notifications for {batch_id} throttled, requeueing "
+                                f"{len(notification_stats['unsent'])}: {str(notification_stats['throttled'])}")
+                _requeue_status_notifications(db, notification_stats['unsent'])
+        
+        elapsed = time.monotonic() - started
+        processed = len(requested)
+        report = {
+            'batch_id': batch_id,
+            'requested': len(data['updates']),
+            'updated': len(updated),
+            'unchanged': sum(1 for r in results.values() if r['result'] == 'unchanged'),
+            'not_found': sum(1 for r in results.values() if r['result'] == 'not_found'),
+            'invalid': sum(1 for r in results.values() if r['result'] == 'invalid_status'),
+            'failed': sum(1 for r in results.values() if r['result'] == 'failed'),
+            'batch_commits': commits,
+            'notifications_sent': notification_stats['sent'],
+            'notifications_failed': notification_stats['failed'],
+            'notifications_throttled': notification_stats['throttled'] is not None,
+            'notifications_unsent': len(notification_stats['unsent']),
+            'elapsed_ms': round(elapsed * 1000, 1),
+            'write_ms': round(write_seconds * 1000, 1),
+            'providers_per_second': round(processed / elapsed, 1) if elapsed > 0 else None,
+        }
+        logging.info(f"Bulk status update {batch_id}: {report['updated']} updated, {report['failed']} failed "
+                     f"in {report['elapsed_ms']}ms")
+        
+        return https_fn.Response(
+            json.dumps({'report': report, 'results': list(results.values())}, indent=2),
+            status=200,
+            headers={'Content-Type': 'application/json'}
+        )
+        
+    except Exception as e:
+        logging.error(f"Error in bulk provider status update: {str(e)}")
+        return https_fn.Response(f"Error: {str(e)}", status=500)
+
+
 @https_fn.on_request()
+@admission.limit()
 def update_provider_profile(req: https_fn.Request) -> https_fn.Response:
     """
     HTTP function to update provider profile with complete data.
@@ -331,64 +477,20 @@ def update_provider_profile(req: https_fn.Request) -> https_fn.Response:
         db = firestore.client()
         provider_ref = db.collection('providers').document(provider_id)
         
-        # Get current provider data
-        provider_doc = provider_ref.get()
+        # Get current provider data (only the fields the profile is normalized from)
+        provider_doc = firestore_reads.get_fields(provider_ref, provider_profile.SOURCE_FIELDS)
         if not provider_doc.exists:
             return https_fn.Response(f"Provider {provider_id} not found", status=404)
             
         current_data = provider_doc.to_dict()
         
         # Complete provider data with all required fields
-        update_data = {
-            # Basic provider information (preserve existing or set defaults)
-            'name': current_data.get('name', 'Sample Provider'),
-            'company': current_data.get('company') or current_data.get('companyName', 'Sample Provider Services'),
-            'phone': current_data.get('phone') or current_data.get('phoneNumber', '(555) 123-4567'),
-            'location': current_data.get('location') or current_data.get('address', '123 Main St, Seattle, WA 98101'),
-            'email': current_data.get('email', 'provider@example.com'),
-            
-            # Service information
-            'service_categories': current_data.get('service_categories', ['general', 'handyman', 'maintenance']),
-            'service_areas': current_data.get('service_areas', ['Seattle', 'Bellevue', 'Redmond']),
-            
-            # Status and verification (preserve existing status)
-            'status': current_data.get('status', 'verified'),
-            'role': 'provider',
-            'verificationStep': current_data.get('verificationStep', 'completed'),
-            'is_active': current_data.get('is_active', True),
-            'accepting_new_requests': current_data.get('accepting_new_requests', True),
-            
-            # Referral system
-            'referralCode': current_data.get('referralCode', f'PROV{provider_id[-4:].upper()}'),
-            'referred_by_user_ids': current_data.get('referred_by_user_ids', []),
-            
-            # Performance metrics
-            'rating': current_data.get('rating', '4.5'),
-            'thumbs_up_count': current_data.get('thumbs_up_count', 75),
-            'total_jobs_completed': current_data.get('total_jobs_completed', 50),
-            'hourly_rate': current_data.get('hourly_rate', 85),
-            'response_time_avg': current_data.get('response_time_avg', '1-3 hours'),
-            'availability_status': current_data.get('availability_status', 'available'),
-            
-            # Professional details
-            'emergency_rate_multiplier': current_data.get('emergency_rate_multiplier', 1.5),
-            'minimum_charge': current_data.get('minimum_charge', 75),
-            'license_number': current_data.get('license_number', f'LIC{provider_id[-4:].upper()}'),
-            'insurance_verified': current_data.get('insurance_verified', True),
-            'background_check_passed': current_data.get('background_check_passed', True),
-            
-            # Timestamps (preserve existing, add missing)
-            'updatedAt': firestore.SERVER_TIMESTAMP,
-        }
-        
-        # Preserve existing timestamps if they exist
-        if 'createdAt' in current_data:
-            update_data['createdAt'] = current_data['createdAt']
-        if 'verifiedAt' in current_data:
-            update_data['verifiedAt'] = current_data['verifiedAt']
+        update_data = provider_profile.normalize_provider_profile(provider_id, current_data)
+        update_data['updatedAt'] = firestore.SERVER_TIMESTAMP
         
         # Update the provider document
         provider_ref.update(update_data)
+        doc_cache.invalidate('providers', provider_id)
         
         # Return success with updated fields
         response_data = {
@@ -426,7 +528,134 @@ def update_provider_profile(req: https_fn.Request) -> https_fn.Response:
         return https_fn.Response(f"Error: {str(e)}", status=500)
 
 
+# Providers normalized per page by backfill_provider_profiles
+PROFILE_BACKFILL_PAGE_SIZE = 300
+PROFILE_BACKFILL_JOB_ID = 'provider_profile_backfill'
+
+@https_fn.on_request()
+@admission.limit('admin')
+def backfill_provider_profiles(req: https_fn.Request) -> https_fn.Response:
+    """
+    HTTP function to normalize every provider profile with the update_provider_profile rules.
+    Streams providers in document-id order, writes only the fields that differ through a bulk
+    writer and checkpoints the cursor in maintenance_jobs so a timed-out run resumes where it stopped.
+    Writes are stamped with profileBackfilledAt so the providers trigger sends no status notifications.
+    Usage: POST /backfill_provider_profiles with JSON body:
+           {"page_size": 300, "max_seconds": 480, "restart": false, "dry_run": false}
+    """
+    try:
+        if req.method != 'POST':
+            return https_fn.Response("Method not allowed", status=405)
+        
+        data = req.get_json(silent=True) or {}
+        page_size = int(data.get('page_size', PROFILE_BACKFILL_PAGE_SIZE))
+        max_seconds = float(data.get('max_seconds', 480))
+        dry_run = bool(data.get('dry_run', False))
+        
+        started = time.monotonic()
+        db = firestore.client()
+        job_ref = db.collection('maintenance_jobs').document(PROFILE_BACKFILL_JOB_ID)
+        
+        # Resume from the last checkpoint unless asked to start over
+        job = {}
+        if not data.get('restart'):
+            job_doc = job_ref.get()
+            if job_doc.exists and job_doc.to_dict().get('status') != 'completed':
+                job = job_doc.to_dict()
+        cursor = job.get('cursor')
+        counts = {key: job.get(key, 0) for key in ['processed', 'updated', 'unchanged', 'failed', 'fieldsWritten']}
+        
+        failed_ids = []
+        
+        def _on_write_error(failure, writer):
+            # Retry transient errors a few times; anything else is reported and skipped
+            if failure.attempts < 5 and failure.code in (4, 8, 10, 13, 14):
+                return True
+            failed_ids.append(failure.operation.reference.id)
+            logging.error(f"Backfill write for provider {failure.operation.reference.id} failed: {failure.message}")
+            return False
+        
+        writer = None
+        if not dry_run:
+            writer = db.bulk_writer()
+            writer.on_write_error(_on_write_error)
+        
+        completed = False
+        while time.monotonic() - started < max_seconds:
+            query = (db.collection('providers')
+                     .order_by(FieldPath.document_id())
+                     .select(provider_profile.SOURCE_FIELDS)
+                     .limit(page_size))
+            if cursor:
+                query = query.start_after({FieldPath.document_id(): cursor})
+            page = query.get()
+            
+            for provider_doc in page:
+                current_data = provider_doc.to_dict()
+                changes = provider_profile.profile_diff(
+                    current_data, provider_profile.normalize_provider_profile(provider_doc.id, current_data)
+                )
+                counts['processed'] += 1
+                if not changes:
+                    counts['unchanged'] += 1
+                    continue
+                counts['updated'] += 1
+                counts['fieldsWritten'] += len(changes)
+                if writer is not None:
+                    changes['updatedAt'] = firestore.SERVER_TIMESTAMP
+                    # Keeps the providers trigger from notifying about statuses the backfill fills in
+                    changes[PROFILE_BACKFILL_FIELD] = firestore.SERVER_TIMESTAMP
+                    writer.update(provider_doc.reference, changes)
+            
+            if page:
+                cursor = page[-1].id
+            if writer is not None:
+                # Writes must land before the checkpoint moves past them
+                writer.flush()
+                counts['failed'] += len(failed_ids)
+                counts['updated'] -= len(failed_ids)
+                failed_ids.clear()
+            completed = len(page) < page_size
+            
+            if not dry_run:
+                job_ref.set({
+                    'type': 'provider_profile_backfill',
+                    'status': 'completed' if completed else 'running',
+                    'cursor': cursor,
+                    **counts,
+                    'updatedAt': firestore.SERVER_TIMESTAMP,
+                })
+            if completed:
+                break
+        
+        if writer is not None:
+            writer.close()
+        
+        elapsed = time.monotonic() - started
+        report = {
+            'completed': completed,
+            'dry_run': dry_run,
+            'cursor': cursor,
+            **counts,
+            'elapsed_ms': round(elapsed * 1000, 1),
+            'providers_per_second': round(counts['processed'] / elapsed, 1) if elapsed > 0 else None,
+        }
+        logging.info(f"Provider profile backfill {'completed' if completed else 'paused'}: "
+                     f"{counts['updated']} updated, {counts['unchanged']} unchanged, {counts['failed']} failed")
+        
+        return https_fn.Response(
+            json.dumps(report, indent=2),
+            status=200,
+            headers={'Content-Type': 'application/json'}
+        )
+        
+    except Exception as e:
+        logging.error(f"Error in provider profile backfill: {str(e)}")
+        return https_fn.Response(f"Error: {str(e)}", status=500)
+
+
 @https_fn.on_request()
+@admission.limit('fanout')
 def send_bidding_notification(req: https_fn.Request) -> https_fn.Response:
     """
     Send high-priority bidding notifications with alarm-style effects.
@@ -436,7 +665,20 @@ def send_bidding_notification(req: https_fn.Request) -> https_fn.Response:
         "task_description": "...",
         "suggested_price": "100-150",
         "urgency": "high",
-        "deadline_hours": 2
+        "deadline_hours": 2,
+        "service_category": "plumbing",
+        "trace_id": "optional funnel trace id"
+    }
+    When the send budget runs out the response is 429 with Retry-After; a retry with the same
+    request_id skips the providers (and the broadcast) the earlier call already reached.
+    Broadcast mode sends one topic/condition message to every subscribed provider in the
+    trade and areas instead of per-token sends; provider_ids may then be omitted, and listed
+    providers the broadcast already reaches are not sent to again: {
+        "request_id": "req123",
+        "broadcast": true,
+        "service_category": "plumbing",
+        "service_areas": ["Seattle", "Bellevue"],
+        ...
     }
     """
     try:
@@ -453,12 +695,27 @@ def send_bidding_notification(req: https_fn.Request) -> https_fn.Response:
         suggested_price = data.get('suggested_price', '')
         urgency = data.get('urgency', 'normal')  # 'normal', 'high', 'critical'
         deadline_hours = data.get('deadline_hours', 2)
+        broadcast = bool(data.get('broadcast', False))
+        broadcast_topics = []
         
-        if not provider_ids or not request_id:
+        if broadcast:
+            broadcast_topics = fcm_topics.topics_for(data.get('service_category'), data.get('service_areas', []))
+            if not broadcast_topics:
+                return https_fn.Response("Broadcast requires service_category and service_areas", status=400)
+        
+        if not request_id or not (provider_ids or broadcast):
             return https_fn.Response("Missing provider_ids or request_id", status=400)
         
         db = firestore.client()
-        total_sent = 0
+        send_jobs = []
+        broadcast_job = None
+        trace_id = data.get('trace_id') or funnel_trace.new_trace_id()
+        
+        # A retry after a 429 only sends to whoever the earlier call did not reach
+        already_reached, broadcast_sent = response_times.already_notified(db, request_id)
+        if already_reached:
+            logging.info(f"Skipping {len(already_reached)} providers already notified about request {request_id}")
+            provider_ids = [provider_id for provider_id in provider_ids if provider_id not in already_reached]
         
         # Get deadline timestamp
         deadline = datetime.now() + timedelta(hours=deadline_hours)
@@ -485,137 +742,160 @@ def send_bidding_notification(req: https_fn.Request) -> https_fn.Response:
             'bidding_providers': provider_ids,  # Track which providers can bid
             'bids_received': [],  # Track received bids
         }
+        if broadcast:
+            service_request_data['broadcast_topics'] = broadcast_topics
         
-        # Create the service request
-        service_request_ref.set(service_request_data)
-        logging.info(f"Created service request {request_id} for bidding")
+        # Create the service request, unless an earlier call for this request already did
+        if already_reached or broadcast_sent:
+            logging.info(f"Resuming bidding notifications for service request {request_id}")
+        else:
+            service_request_ref.set(service_request_data)
+            logging.info(f"Created service request {request_id} for bidding")
+        
+        if broadcast and broadcast_sent:
+            logging.info(f"Broadcast for request {request_id} already sent")
+        elif broadcast:
+            # One condition message per group of topics replaces a send per provider token
+            title, body, sound, badge_count = _bidding_alert_content(urgency, task_description, deadline_str)
+            data_payload = fcm_payload.compact_data({
+                'type': 'bidding_opportunity',
+                'request_id': request_id,
+                'urgency': urgency,
+                'task_description': task_description,
+                'suggested_price': suggested_price,
+                'deadline_timestamp': int(deadline.timestamp()),
+                'deadline_hours': deadline_hours,
+                'click_action': 'OPEN_BIDDING_SCREEN',
+                'sound_effect': sound,
+                'badge_increment': badge_count,
+                'delivery': 'broadcast',
+                'trace_id': trace_id
+            })
+            messages = [
+                message for message in (
+                    fcm_payload.fit_or_skip(
+                        lambda payload, condition=condition: _build_bidding_alert_message(
+                            title, body, sound, badge_count, urgency, request_id, payload, condition=condition
+                        ),
+                        data_payload,
+                        f"bidding broadcast for request {request_id}"
+                    )
+                    for condition in fcm_topics.build_conditions(broadcast_topics)
+                ) if message is not None
+            ]
+            broadcast_job = notification_scheduler.submit(
+                messages,
+                urgency=urgency,
+                deadline_timestamp=int(deadline.timestamp())
+            )
+            send_jobs.append(broadcast_job)
+            logging.info(f"Queued {len(messages)} broadcast messages for {len(broadcast_topics)} topics")
 
+        # Fetch tokens and names for every provider in one projected multi-get
+        provider_docs = firestore_reads.get_all_fields(
+            db,
+            [db.collection('providers').document(provider_id) for provider_id in provider_ids],
+            firestore_reads.PROVIDER_NOTIFICATION_FIELDS + (fcm_topics.SUBSCRIPTION_FIELDS if broadcast else ())
+        )
+        if broadcast:
+            # Providers subscribed to the broadcast topics already get the condition message
+            covered = {
+                provider_id for provider_id, snapshot in provider_docs.items()
+                if snapshot.exists and fcm_topics.reached_by(snapshot.to_dict(), broadcast_topics)
+            }
+            if covered:
+                logging.info(f"Skipping {len(covered)} listed providers already reached by the broadcast")
+                provider_ids = [provider_id for provider_id in provider_ids if provider_id not in covered]
+        provider_devices = device_tokens.load_devices(db, 'providers', provider_ids, {
+            provider_id: snapshot.to_dict().get('fcmTokens', [])
+            for provider_id, snapshot in provider_docs.items() if snapshot.exists
+        })
+        device_jobs = []
+        
         for provider_id in provider_ids:
             try:
                 # Get provider data
-                provider_doc = db.collection('providers').document(provider_id).get()
-                if not provider_doc.exists:
+                provider_doc = provider_docs.get(provider_id)
+                if provider_doc is None or not provider_doc.exists:
                     logging.warning(f"Provider {provider_id} not found")
                     continue
                     
                 provider_data = provider_doc.to_dict()
                 company_name = provider_data.get('companyName', 'Provider')
-                fcm_tokens = provider_data.get('fcmTokens', [])
+                devices = provider_devices.get(provider_id, [])
                 
-                if not fcm_tokens:
+                if not devices:
                     logging.warning(f"No FCM tokens for provider {provider_id}")
                     continue
                 
-                # Create high-priority notification based on urgency
-                if urgency == 'critical':
-                    title = "🚨 URGENT SERVICE REQUEST"
-                    body = f"Critical task available! {task_description[:60]}... Deadline: {deadline_str}"
-                    sound = "default"  # Use iOS default sound (loudest available)
-                    priority = "high"
-                    badge_count = 3  # Red badge - highest urgency
-                elif urgency == 'high':
-                    title = "⏰ NEW SERVICE OPPORTUNITY"
-                    body = f"High-value task: {task_description[:50]}... Respond by {deadline_str}"
-                    sound = "default"  # Use iOS default sound
-                    priority = "high"
-                    badge_count = 2  # Orange badge - high urgency
-                else:
-                    title = "💼 Service Request Available"
-                    body = f"New opportunity: {task_description[:60]}... Deadline: {deadline_str}"
-                    sound = "default"  # Use iOS default sound
-                    priority = "normal"
-                    badge_count = 1  # Yellow badge - normal urgency
-                
-                # Enhanced notification payload
-                notification = messaging.Notification(
-                    title=title,
-                    body=body
-                )
+                title, body, sound, badge_count = _bidding_alert_content(urgency, task_description, deadline_str)
                 
-                # Rich data payload
-                data_payload = {
+                # Compact data payload; the app fetches full details by request_id
+                data_payload = fcm_payload.compact_data({
                     'type': 'bidding_opportunity',
                     'request_id': request_id,
                     'provider_id': provider_id,
                     'urgency': urgency,
                     'task_description': task_description,
                     'suggested_price': suggested_price,
-                    'deadline_timestamp': str(int(deadline.timestamp())),
-                    'deadline_hours': str(deadline_hours),
+                    'deadline_timestamp': int(deadline.timestamp()),
+                    'deadline_hours': deadline_hours,
                     'click_action': 'OPEN_BIDDING_SCREEN',
                     'sound_effect': sound,
-                    'badge_increment': str(badge_count)
-                }
+                    'badge_increment': badge_count,
+                    'trace_id': trace_id
+                })
                 
-                # Create messages for each FCM token
-                messages = []
-                for token in fcm_tokens:
-                    message = messaging.Message(
-                        notification=notification,
-                        data=data_payload,
-                        token=token,
-                        # iOS-specific configuration for stronger notifications
-                        apns=messaging.APNSConfig(
-                            headers={
-                                'apns-priority': '10',  # High priority
-                                'apns-push-type': 'alert'
-                            },
-                            payload=messaging.APNSPayload(
-                                aps=messaging.Aps(
-                                    alert=messaging.ApsAlert(
-                                        title=title,
-                                        body=body,
-                                        launch_image='notification_bg.png'
-                                    ),
-                                    badge=badge_count,
-                                    sound=sound,
-                                    content_available=True,
-                                    mutable_content=True,
-                                    category='BIDDING_OPPORTUNITY',
-                                    thread_id=f'bidding_{request_id}'
-                                ),
-                                # Custom payload for app-specific handling
-                                custom_data={
-                                    'bidding_data': data_payload,
-                                    'vibration_pattern': 'strong' if urgency in ['high', 'critical'] else 'normal',
-                                    'led_color': '#FF4444' if urgency == 'critical' else '#FFA500' if urgency == 'high' else '#00FF00'
-                                }
-                            )
-                        ),
-                        # Android-specific configuration
-                        android=messaging.AndroidConfig(
-                            priority='high',
-                            notification=messaging.AndroidNotification(
-                                title=title,
-                                body=body,
-                                icon='ic_notification',
-                                color='#FF6B35',
-                                sound='default' if urgency != 'critical' else 'alarm',
-                                channel_id='bidding_alerts',
-                                priority='high',
-                                # Removed unsupported parameters
-                                sticky=True,  # Harder to dismiss
-                                local_only=False
+                # Create messages for each registered device, each checked against FCM's size limits
+                messages = [
+                    message for message in (
+                        fcm_payload.fit_or_skip(
+                            lambda payload, device=device: _build_bidding_alert_message(
+                                title, body, sound, badge_count, urgency, request_id, payload, device=device
                             ),
-                            data=data_payload
+                            data_payload,
+                            f"bidding notification for provider {provider_id}"
                         )
-                    )
-                    messages.append(message)
+                        for device in devices
+                    ) if message is not None
+                ]
                 
-                # Send notifications
+                # Queue notifications; critical and earlier-deadline work is sent first
                 if messages:
-                    response = messaging.send_each(messages)
-                    total_sent += response.success_count
-                    
-                    if response.failure_count > 0:
-                        logging.warning(f"Failed to send {response.failure_count} notifications to {provider_id}")
-                    
-                    logging.info(f"Sent {response.success_count} bidding notifications to {company_name}")
+                    future = notification_scheduler.submit(
+                        messages,
+                        urgency=urgency,
+                        deadline_timestamp=int(deadline.timestamp())
+                    )
+                    send_jobs.append(future)
+                    device_jobs.append((provider_id, devices, future))
+                    logging.info(f"Queued {len(messages)} {urgency} bidding notifications for {company_name}")
                     
             except Exception as provider_error:
                 logging.error(f"Error sending to provider {provider_id}: {str(provider_error)}")
                 continue
         
+        total_sent, total_failed, backpressure = notification_scheduler.wait_all(send_jobs)
+        if total_failed > 0:
+            logging.warning(f"Failed to send {total_failed} bidding notifications for request {request_id}")
+            device_tokens.prune_failures(db, 'providers', device_jobs)
+        
+        audit = notification_audit.AuditLogger(db)
+        audit.record_jobs('bidding_opportunity', device_jobs, detail={'requestId': request_id, 'urgency': urgency})
+        audit.flush()
+        response_times.record_notification_jobs(db, request_id, device_jobs, broadcast_job=broadcast_job)
+        if total_sent:
+            funnel_trace.start(db, trace_id, request_id, data.get('service_category'), urgency,
+                               {'notified': datetime.now(timezone.utc)})
+        
+        if backpressure is not None:
+            logging.warning(f"Bidding notifications throttled after {total_sent} sends: {str(backpressure)}")
+            return https_fn.Response(
+                f"Notification budget exhausted after {total_sent} sends, retry later",
+                status=429,
+                headers={'Retry-After': str(math.ceil(backpressure.retry_after))}
+            )
+        
         return https_fn.Response(
             f"Bidding notifications sent successfully! Total: {total_sent}",
             status=200
@@ -626,6 +906,120 @@ def send_bidding_notification(req: https_fn.Request) -> https_fn.Response:
         return https_fn.Response(f"Error: {str(e)}", status=500)
 
 
+@https_fn.on_request()
+@admission.limit()
+def register_device_token(req: https_fn.Request) -> https_fn.Response:
+    """
+    HTTP function to register or refresh a device token in the owner's devices subcollection.
+    Usage: POST /register_device_token with JSON body: {"owner_type": "provider", "owner_id": "xxx",
+           "token": "fcm_token", "platform": "ios", "app_version": "1.0.0"}
+    """
+    try:
+        if req.method != 'POST':
+            return https_fn.Response("Method not allowed", status=405)
+        
+        data = req.get_json()
+        if not data or 'owner_id' not in data or 'token' not in data:
+            return https_fn.Response("Missing owner_id or token in request body", status=400)
+        
+        owner_type = data.get('owner_type', 'provider')
+        if owner_type not in ['provider', 'user']:
+            return https_fn.Response("owner_type must be 'provider' or 'user'", status=400)
+        
+        owner_collection = 'providers' if owner_type == 'provider' else 'users'
+        owner_id = data['owner_id']
+        token = data['token']
+        platform = data.get('platform', 'unknown')
+        
+        db = firestore.client()
+        owner_ref = db.collection(owner_collection).document(owner_id)
+        owner_doc = firestore_reads.get_fields(
+            owner_ref,
+            ['status', 'is_active', 'accepting_new_requests', 'service_categories', 'service_areas']
+        )
+        if not owner_doc.exists:
+            return https_fn.Response(f"{owner_type.title()} {owner_id} not found", status=404)
+        
+        device_tokens.register(db, owner_collection, owner_id, token, platform, data.get('app_version', ''))
+        
+        # New provider devices join the broadcast topics straight away
+        if owner_type == 'provider':
+            try:
+                provider_data = owner_doc.to_dict()
+                provider_data['fcmTokens'] = [token]
+                fcm_topics.sync_provider_subscriptions(owner_id, None, provider_data)
+            except Exception as topic_error:
+                logging.error(f"Error subscribing device to topics for provider {owner_id}: {str(topic_error)}")
+        
+        logging.info(f"Registered {platform} device for {owner_type} {owner_id}")
+        return https_fn.Response(f"Device registered for {owner_type} {owner_id}", status=200)
+        
+    except Exception as e:
+        logging.error(f"Error registering device token: {str(e)}")
+        return https_fn.Response(f"Error: {str(e)}", status=500)
+
+
+@https_fn.on_request()
+@admission.limit('admin')
+def resync_provider_topics(req: https_fn.Request) -> https_fn.Response:
+    """
+    HTTP function to subscribe every provider's tokens to its category x area topics and
+    unsubscribe them from the known topics that no longer apply (e.g. ineligible providers).
+    Needed once before enabling broadcast mode; afterwards the providers trigger keeps them in sync.
+    Usage: POST /resync_provider_topics
+    """
+    try:
+        if req.method != 'POST':
+            return https_fn.Response("Method not allowed", status=405)
+        
+        db = firestore.client()
+        providers = []
+        
+        provider_docs = db.collection('providers').select(
+            ['status', 'is_active', 'accepting_new_requests', 'service_categories', 'service_areas', 'fcmTokens']
+        ).stream()
+        for provider_doc in provider_docs:
+            provider_data = provider_doc.to_dict()
+            # Include registry devices, not just the legacy token array
+            devices = device_tokens.load_devices(
+                db, 'providers', [provider_doc.id], {provider_doc.id: provider_data.get('fcmTokens', [])}
+            )[provider_doc.id]
+            providers.append((provider_doc.id, provider_data, [device.token for device in devices]))
+        
+        subscribed, unsubscribed = fcm_topics.resync_subscriptions(providers)
+        
+        logging.info(f"Resynced topics for {len(providers)} providers "
+                     f"(+{subscribed} / -{unsubscribed} subscriptions)")
+        return https_fn.Response(
+            f"Resynced topics for {len(providers)} providers (+{subscribed} / -{unsubscribed} subscriptions)",
+            status=200
+        )
+        
+    except Exception as e:
+        logging.error(f"Error resyncing provider topics: {str(e)}")
+        return https_fn.Response(f"Error: {str(e)}", status=500)
+
+
+def _merge_duplicate_request(db, request_id, original_request_id, similarity):
+    """Helper function to cancel a near-duplicate request and link it to the original's bidding session"""
+    logging.info(f"Request {request_id} duplicates {original_request_id} "
+                 f"(similarity {similarity:.2f}); skipping bidding fan-out")
+    batch = db.batch()
+    batch.update(db.collection('user_requests').document(request_id), {
+        'status': 'cancelled',
+        'cancellationReason': 'duplicate',
+        'duplicateOf': original_request_id,
+        'updatedAt': firestore.SERVER_TIMESTAMP
+    })
+    sessions = (db.collection('bidding_sessions')
+                .where('requestId', '==', original_request_id)
+                .limit(1)
+                .get())
+    for session_doc in sessions:
+        batch.update(session_doc.reference, {'mergedRequestIds': firestore.ArrayUnion([request_id])})
+    batch.commit()
+
+
 @firestore_fn.on_document_updated(document="user_requests/{request_id}")
 def initiate_bidding_session(event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None]) -> None:
     """
@@ -672,26 +1066,21 @@ def initiate_bidding_session(event: firestore_fn.Event[firestore_fn.DocumentSnap
             return
             
         user_id = new_data.get('userId', '')
+        matched_at = datetime.now(timezone.utc)
+        trace_id = funnel_trace.new_trace_id()
         
-        # Create bidding session
         db = firestore.client()
-        session_data = {
-            'requestId': request_id,
-            'userId': user_id,
-            'notifiedProviders': matched_providers,
-            'receivedBids': [],
-            'sessionStatus': 'active',
-            'createdAt': firestore.SERVER_TIMESTAMP,
-            'deadline': datetime.now() + timedelta(hours=2),
-            'sessionMetadata': {
-                'notificationsSent': len(matched_providers),
-                'expectedResponses': len(matched_providers),
-            }
-        }
         
-        # Create bidding session document
-        session_ref = db.collection('bidding_sessions').document()
-        session_ref.set(session_data)
+        # Suppress near-duplicates of a recent request by the same user at the same address
+        fingerprint = request_dedup.Fingerprint(request_id, new_data)
+        try:
+            duplicate = request_dedup.find_duplicate(db, fingerprint)
+        except Exception as e:
+            logging.error(f"Error checking request {request_id} for duplicates: {str(e)}")
+            duplicate = None
+        if duplicate:
+            _merge_duplicate_request(db, request_id, duplicate[0], duplicate[1])
+            return
         
         # Send bidding notifications to matched providers
         task_description = new_data.get('description', 'Service request')
@@ -710,76 +1099,123 @@ def initiate_bidding_session(event: firestore_fn.Event[firestore_fn.DocumentSnap
         preferences = new_data.get('preferences', {})
         urgency = preferences.get('urgency', 'normal')
         
-        # Send high-priority notifications
-        notification_payload = {
-            'provider_ids': matched_providers,
-            'request_id': request_id,
-            'task_description': task_description,
-            'suggested_price': suggested_price,
+        # Notify the best providers first; advance_bidding_waves reaches the rest if bids are slow to come
+        provider_docs = firestore_reads.get_all_fields(
+            db,
+            [db.collection('providers').document(provider_id) for provider_id in matched_providers],
+            ['fcmTokens'] + bidding_waves.PROVIDER_FIELDS
+        )
+        ordered_providers = bidding_waves.order_providers(matched_providers, {
+            provider_id: snapshot.to_dict() for provider_id, snapshot in provider_docs.items() if snapshot.exists
+        })
+        first_wave, wave_state = bidding_waves.start(ordered_providers, urgency, {
+            'taskDescription': task_description,
+            'suggestedPrice': suggested_price,
             'urgency': urgency,
-            'deadline_hours': 2
+            'category': new_data.get('serviceCategory'),
+        })
+        
+        # Create bidding session
+        session_data = {
+            'requestId': request_id,
+            'userId': user_id,
+            'traceId': trace_id,
+            'notifiedProviders': first_wave,
+            'receivedBids': [],
+            'sessionStatus': 'active',
+            'createdAt': firestore.SERVER_TIMESTAMP,
+            'deadline': datetime.now() + timedelta(hours=2),
+            'waveState': wave_state,
+            'sessionMetadata': {
+                'notificationsSent': len(first_wave),
+                'expectedResponses': len(first_wave),
+                'matchedProviders': len(matched_providers),
+            }
         }
         
-        # Send notifications directly to matched providers (don't create service_requests)
-        for provider_id in matched_providers:
-            try:
-                # Get provider FCM tokens
-                provider_doc = db.collection('providers').document(provider_id).get()
-                if not provider_doc.exists:
-                    logging.warning(f"Provider {provider_id} not found")
-                    continue
-                    
-                provider_data = provider_doc.to_dict()
-                fcm_tokens = provider_data.get('fcmTokens', [])
-                
-                if not fcm_tokens:
-                    logging.warning(f"No FCM tokens for provider {provider_id}")
-                    continue
-                
-                # Send notification to each token
-                for token in fcm_tokens:
-                    message = messaging.Message(
-                        notification=messaging.Notification(
-                            title=f"🔥 New {urgency.title()} Service Request",
-                            body=f"{task_description} • {suggested_price}"
-                        ),
-                        data={
-                            'type': 'bidding_opportunity',
-                            'request_id': request_id,
-                            'urgency': urgency,
-                            'deadline_hours': '2'
-                        },
-                        token=token,
-                        android=messaging.AndroidConfig(
-                            priority='high',
-                            notification=messaging.AndroidNotification(
-                                sound='default',
-                                channel_id='bidding_notifications'
-                            )
-                        ),
-                        apns=messaging.APNSConfig(
-                            payload=messaging.APNSPayload(
-                                aps=messaging.Aps(
-                                    sound='default',
-                                    badge=2
-                                )
-                            )
-                        )
-                    )
-                    
-                    messaging.send(message)
-                    logging.info(f"Sent bidding notification to provider {provider_id}")
-                    
-            except Exception as e:
-                logging.error(f"Failed to send notification to provider {provider_id}: {str(e)}")
+        # Create bidding session document
+        session_ref = db.collection('bidding_sessions').document()
+        session_batch = db.batch()
+        session_batch.set(session_ref, session_data)
+        request_dedup.register(db, fingerprint, batch=session_batch)
+        session_batch.commit()
+        
+        total_sent = _send_bidding_wave(
+            db, request_id, first_wave, provider_docs, task_description, suggested_price, urgency,
+            deadline_hours=2, deadline_timestamp=int(session_data['deadline'].timestamp()), trace_id=trace_id
+        )
+        funnel_trace.start(db, trace_id, request_id, new_data.get('serviceCategory'), urgency, {
+            'matched': matched_at,
+            'notified': datetime.now(timezone.utc)
+        })
         
-        logging.info(f"Bidding session created and notifications sent for request {request_id}")
+        logging.info(f"Bidding session created and {total_sent} notifications sent to {len(first_wave)} of "
+                     f"{len(matched_providers)} providers (wave 1) for request {request_id}")
         
     except Exception as e:
         logging.error(f"Error initiating bidding session for request {request_id}: {str(e)}")
 
 
+@scheduler_fn.on_schedule(schedule="every 1 minutes")
+def advance_bidding_waves(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Scheduled function to notify the next wave of providers for bidding sessions
+    whose wave window has passed without enough bids.
+    """
+    db = firestore.client()
+    now = datetime.now(timezone.utc)
+    advanced = stopped = skipped = 0
+    for session_doc in bidding_waves.due_sessions_query(db, now).get():
+        try:
+            session_data = session_doc.to_dict()
+            bid_count = (session_data.get(bid_aggregates.AGGREGATES_FIELD) or {}).get(
+                'count', len(session_data.get('receivedBids', []))
+            )
+            wave, state_update = bidding_waves.advance(session_data, bid_count, now)
+            if wave:
+                state_update['notifiedProviders'] = firestore.ArrayUnion(wave)
+                state_update['sessionMetadata.notificationsSent'] = firestore.Increment(len(wave))
+                state_update['sessionMetadata.expectedResponses'] = firestore.Increment(len(wave))
+            
+            # Claim the wave before sending, so overlapping runs (or a bid landing meanwhile) can't double-send
+            try:
+                session_doc.reference.update(
+                    state_update, option=db.write_option(last_update_time=session_doc.update_time)
+                )
+            except google_exceptions.FailedPrecondition:
+                skipped += 1
+                continue
+            
+            if not wave:
+                stopped += 1
+                continue
+            
+            notification = session_data['waveState'].get('notification', {})
+            deadline = session_data['deadline']
+            if deadline.tzinfo is None:
+                deadline = deadline.replace(tzinfo=timezone.utc)
+            provider_docs = firestore_reads.get_all_fields(
+                db, [db.collection('providers').document(provider_id) for provider_id in wave], ['fcmTokens']
+            )
+            total_sent = _send_bidding_wave(
+                db, session_data['requestId'], wave, provider_docs,
+                notification.get('taskDescription', 'Service request'),
+                notification.get('suggestedPrice', 'Price available in app'),
+                notification.get('urgency', 'normal'),
+                deadline_hours=max(1, round((deadline - now).total_seconds() / 3600)),
+                deadline_timestamp=int(deadline.timestamp()),
+                trace_id=session_data.get('traceId', '')
+            )
+            advanced += 1
+            logging.info(f"Sent wave {state_update['waveState.wave']} ({total_sent} notifications to "
+                         f"{len(wave)} providers) for request {session_data['requestId']}")
+        except Exception as e:
+            logging.error(f"Error advancing bidding waves for session {session_doc.id}: {str(e)}")
+    logging.info(f"Bidding waves: {advanced} advanced, {stopped} stopped, {skipped} skipped")
+
+
 @https_fn.on_request()
+@admission.limit('bidding')
 def submit_bid(req: https_fn.Request) -> https_fn.Response:
     """
     HTTP function to submit a provider bid.
@@ -788,7 +1224,8 @@ def submit_bid(req: https_fn.Request) -> https_fn.Response:
         "provider_id": "prov456",
         "price_quote": 150.0,
         "availability": "Available today 2-5 PM",
-        "bid_message": "I can handle this job professionally..."
+        "bid_message": "I can handle this job professionally...",
+        "trace_id": "from the notification's data payload (optional)"
     }
     """
     try:
@@ -811,17 +1248,35 @@ def submit_bid(req: https_fn.Request) -> https_fn.Response:
         bid_message = data['bid_message']
         
         db = firestore.client()
+        request_ref = db.collection('user_requests').document(request_id)
+        
+        # Independent reads go out together: the request, its session (with live aggregates),
+        # whether any bid exists yet, and the bidder's name for the user notification
+        request_future = firestore_reads.submit(
+            firestore_reads.get_fields, request_ref, ['userId', 'status', 'aiPriceEstimation']
+        )
+        session_future = firestore_reads.submit(firestore_reads.select_fields(
+            db.collection('bidding_sessions').where('requestId', '==', request_id).limit(1),
+            [bid_aggregates.AGGREGATES_FIELD, 'traceId']
+        ).get)
+        existing_bids_future = firestore_reads.submit(firestore_reads.select_fields(
+            db.collection('service_bids').where('requestId', '==', request_id).limit(1),
+            firestore_reads.ID_ONLY
+        ).get)
+        firestore_reads.submit(
+            doc_cache.get, db, 'providers', provider_id, firestore_reads.PROVIDER_NOTIFICATION_FIELDS
+        )
         
         # Get user request to validate and get user_id
-        request_doc = db.collection('user_requests').document(request_id).get()
+        request_doc = request_future.result()
         if not request_doc.exists:
             return https_fn.Response("User request not found", status=404)
             
         request_data = request_doc.to_dict()
         user_id = request_data.get('userId', '')
         
-        # Check if bidding is still active
-        if request_data.get('status') != 'matched':
+        # Bidding stays open after the first bid moves the request to 'bidding'
+        if request_data.get('status') not in ('matched', 'bidding'):
             return https_fn.Response("Bidding is no longer active for this request", status=400)
         
         # Calculate price benchmark using AI estimation
@@ -848,35 +1303,51 @@ def submit_bid(req: https_fn.Request) -> https_fn.Response:
             }
         }
         
-        # Save bid to Firestore
-        bid_ref = db.collection('service_bids').document()
-        bid_ref.set(bid_data)
-        bid_id = bid_ref.id
+        # The user's devices are only needed for the notification, so load them while the bid is written
+        user_devices_future = firestore_reads.submit(_load_user_devices, db, user_id)
+        
+        # Funnel trace from the notification payload, or the one the bidding session started
+        sessions = session_future.result()
+        trace_id = data.get('trace_id') or (sessions[0].to_dict().get('traceId') if sessions else None)
+        if trace_id:
+            bid_data['traceId'] = trace_id
         
         # Update user request status to 'bidding' if this is the first bid
-        bids_query = db.collection('service_bids').where('requestId', '==', request_id).get()
-        if len(bids_query.docs) == 1:  # This is the first bid
-            db.collection('user_requests').document(request_id).update({
+        first_bid = not existing_bids_future.result()
+        extra_writes = []
+        if first_bid:
+            extra_writes.append((request_ref, {
                 'status': 'bidding',
                 'biddingStartedAt': datetime.now(),
                 'firstBidReceivedAt': datetime.now()
-            })
-            logging.info(f"Updated user request {request_id} status to 'bidding' - first bid received")
+            }))
+            if trace_id:
+                extra_writes.append((funnel_trace.trace_ref(db, trace_id), funnel_trace.stage_update('first_bid')))
         
-        # Update bidding session
-        session_query = db.collection('bidding_sessions').where('requestId', '==', request_id).limit(1)
-        sessions = session_query.get()
+        # Save bid to Firestore; the bid, the session aggregates and the request status commit together
+        bid_ref = db.collection('service_bids').document()
+        bid_id = bid_ref.id
         
+        aggregates = None
         if sessions:
-            session_doc = sessions[0]
-            session_ref = db.collection('bidding_sessions').document(session_doc.id)
-            session_ref.update({
-                'receivedBids': firestore.ArrayUnion([bid_id]),
-                'updatedAt': firestore.SERVER_TIMESTAMP
-            })
+            aggregates = _record_bid_optimistic(db, bid_ref, bid_data, sessions[0], extra_writes)
+            if aggregates is None:
+                # Another bid changed the session since it was read; fall back to a transaction
+                aggregates = _record_bid_transaction(
+                    db.transaction(), bid_ref, bid_data, sessions[0].reference, extra_writes
+                )
+        else:
+            batch = db.batch()
+            batch.set(bid_ref, bid_data)
+            for reference, update in extra_writes:
+                batch.set(reference, update, merge=True)
+            batch.commit()
+        if first_bid:
+            logging.info(f"Updated user request {request_id} status to 'bidding' - first bid received")
         
         # Send immediate notification to user about new bid
-        _send_new_bid_notification_to_user(user_id, provider_id, price_quote, price_benchmark['benchmark'])
+        _send_new_bid_notification_to_user(user_id, provider_id, price_quote, price_benchmark['benchmark'],
+                                           devices_future=user_devices_future)
         
         logging.info(f"Bid submitted: {bid_id} for request {request_id} by provider {provider_id}")
         
@@ -885,6 +1356,7 @@ def submit_bid(req: https_fn.Request) -> https_fn.Response:
                 'success': True,
                 'bid_id': bid_id,
                 'price_benchmark': price_benchmark['benchmark'],
+                'bid_count': aggregates['count'] if aggregates else None,
                 'message': 'Bid submitted successfully'
             }),
             status=200,
@@ -900,7 +1372,89 @@ def submit_bid(req: https_fn.Request) -> https_fn.Response:
         )
 
 
+@firestore_fn.on_document_created(document="service_bids/{bid_id}")
+def record_bid_response_time(event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None]) -> None:
+    """
+    Fold the time from bidding notification to bid into the provider's response-time stats.
+    """
+    bid_id = event.params["bid_id"]
+    try:
+        if event.data is None:
+            return
+        bid_data = event.data.to_dict()
+        provider_id = bid_data.get('providerId')
+        request_id = bid_data.get('requestId')
+        if not provider_id or not request_id:
+            return
+        
+        seconds = response_times.record_bid(firestore.client(), provider_id, request_id, bid_data.get('createdAt'))
+        if seconds is None:
+            logging.info(f"No notification time for bid {bid_id}; response time not recorded")
+        else:
+            logging.info(f"Provider {provider_id} bid on {request_id} after {seconds:.0f}s")
+        
+    except Exception as e:
+        logging.error(f"Error recording response time for bid {bid_id}: {str(e)}")
+
+
+@firestore_fn.on_document_written(document="bidding_traces/{trace_id}")
+def aggregate_funnel_trace(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]) -> None:
+    """
+    Add the stage latencies a funnel trace update made measurable to its category/urgency histogram.
+    """
+    trace_id = event.params["trace_id"]
+    try:
+        if event.data.after is None or not event.data.after.exists:
+            return
+        before = event.data.before.to_dict() if event.data.before and event.data.before.exists else {}
+        after = event.data.after.to_dict()
+        
+        latencies = funnel_trace.new_transitions(before.get('stages', {}), after.get('stages', {}))
+        if latencies:
+            funnel_trace.record_transitions(firestore.client(), after.get('category'), after.get('urgency'), latencies)
+            logging.info(f"Funnel trace {trace_id}: {latencies}")
+        
+    except Exception as e:
+        logging.error(f"Error aggregating funnel trace {trace_id}: {str(e)}")
+
+
+@https_fn.on_request()
+@admission.limit()
+def funnel_latency(req: https_fn.Request) -> https_fn.Response:
+    """
+    HTTP function to return the bidding funnel's stage latency distributions
+    (matched -> notified -> first bid -> accepted) per category and urgency.
+    Usage: POST /funnel_latency with JSON body: {"category": "plumbing", "urgency": "high"} (both optional)
+    """
+    try:
+        if req.method != 'POST':
+            return https_fn.Response("Method not allowed", status=405)
+        
+        data = req.get_json(silent=True) or {}
+        db = firestore.client()
+        
+        query = db.collection(funnel_trace.HISTOGRAMS_COLLECTION)
+        if data.get('category'):
+            query = query.where('category', '==', data['category'])
+        if data.get('urgency'):
+            query = query.where('urgency', '==', data['urgency'])
+        
+        distributions = [funnel_trace.summarize(snapshot.to_dict()) for snapshot in query.stream()]
+        distributions.sort(key=lambda summary: (summary['category'] or '', summary['urgency'] or ''))
+        
+        return https_fn.Response(
+            json.dumps({'distributions': distributions}),
+            status=200,
+            headers={'Content-Type': 'application/json'}
+        )
+        
+    except Exception as e:
+        logging.error(f"Error reading funnel latency: {str(e)}")
+        return https_fn.Response(f"Error: {str(e)}", status=500)
+
+
 @https_fn.on_request()
+@admission.limit()
 def accept_bid(req: https_fn.Request) -> https_fn.Response:
     """
     HTTP function to accept a bid and close the bidding session.
@@ -923,7 +1477,10 @@ def accept_bid(req: https_fn.Request) -> https_fn.Response:
         db = firestore.client()
         
         # Get the winning bid
-        bid_doc = db.collection('service_bids').document(bid_id).get()
+        bid_doc = firestore_reads.get_fields(
+            db.collection('service_bids').document(bid_id),
+            ['requestId', 'providerId', 'userId', 'priceQuote', 'traceId']
+        )
         if not bid_doc.exists:
             return https_fn.Response("Bid not found", status=404)
             
@@ -942,8 +1499,8 @@ def accept_bid(req: https_fn.Request) -> https_fn.Response:
         })
         
         # Update all other bids to rejected
-        other_bids_query = db.collection('service_bids').where('requestId', '==', request_id).where(firestore.FieldPath.document_id(), '!=', bid_id)
-        other_bids = other_bids_query.get()
+        other_bids_query = db.collection('service_bids').where('requestId', '==', request_id).where(FieldPath.document_id(), '!=', bid_id)
+        other_bids = firestore_reads.select_fields(other_bids_query, firestore_reads.ID_ONLY).get()
         
         batch = db.batch()
         for other_bid in other_bids:
@@ -952,11 +1509,13 @@ def accept_bid(req: https_fn.Request) -> https_fn.Response:
                 'rejectedAt': firestore.SERVER_TIMESTAMP,
                 'rejectionReason': 'Another bid was selected'
             })
+        if bid_data.get('traceId'):
+            funnel_trace.mark(db, bid_data['traceId'], 'accepted', batch=batch)
         batch.commit()
         
         # Update bidding session
         session_query = db.collection('bidding_sessions').where('requestId', '==', request_id).limit(1)
-        sessions = session_query.get()
+        sessions = firestore_reads.select_fields(session_query, firestore_reads.ID_ONLY).get()
         
         if sessions:
             session_doc = sessions[0]
@@ -992,6 +1551,286 @@ def accept_bid(req: https_fn.Request) -> https_fn.Response:
         return https_fn.Response(f"Error: {str(e)}", status=500)
 
 
+@https_fn.on_request()
+@admission.limit()
+def rank_bids(req: https_fn.Request) -> https_fn.Response:
+    """
+    HTTP function to return a request's best bids, scored on price, rating, experience,
+    availability and distance. Rankings are cached per session until a new bid arrives.
+    Usage: POST /rank_bids with JSON body: {"request_id": "req123", "k": 5}
+    """
+    try:
+        if req.method != 'POST':
+            return https_fn.Response("Method not allowed", status=405)
+        
+        data = req.get_json()
+        if not data or 'request_id' not in data:
+            return https_fn.Response("Missing request_id in request body", status=400)
+        
+        request_id = data['request_id']
+        k = max(1, min(int(data.get('k', bid_ranking.DEFAULT_TOP_K)), bid_ranking.MAX_TOP_K))
+        
+        db = firestore.client()
+        
+        # The session's bid count is the cache version: rankings only change when a bid lands
+        session_query = db.collection('bidding_sessions').where('requestId', '==', request_id).limit(1)
+        sessions = firestore_reads.select_fields(
+            session_query, [f'{bid_aggregates.AGGREGATES_FIELD}.count', 'receivedBids']
+        ).get()
+        if not sessions:
+            return https_fn.Response("Bidding session not found", status=404)
+        
+        session_doc = sessions[0]
+        session_data = session_doc.to_dict()
+        bid_count = (session_data.get(bid_aggregates.AGGREGATES_FIELD) or {}).get(
+            'count', len(session_data.get('receivedBids', []))
+        )
+        
+        cache = bid_ranking.get_cache()
+        ranked = cache.get(session_doc.id, bid_count, k)
+        source = 'memory'
+        
+        if ranked is None:
+            ranking_ref = db.collection('bid_rankings').document(session_doc.id)
+            ranking_doc = ranking_ref.get()
+            ranking_data = ranking_doc.to_dict() if ranking_doc.exists else {}
+            if ranking_data.get('bidCount') == bid_count and ranking_data.get('k', 0) >= k:
+                ranked = ranking_data['ranked']
+                cache.put(session_doc.id, bid_count, ranking_data['k'], ranked)
+                source = 'firestore'
+        
+        if ranked is None:
+            source = 'computed'
+            compute_k = max(k, bid_ranking.DEFAULT_TOP_K)
+            
+            request_doc = firestore_reads.get_fields(
+                db.collection('user_requests').document(request_id), ['aiPriceEstimation', 'preferences']
+            )
+            request_data = request_doc.to_dict() if request_doc.exists else {}
+            price_range = _calculate_price_benchmark(0, request_data.get('aiPriceEstimation', {}))
+            urgency = (request_data.get('preferences') or {}).get('urgency', 'normal')
+            
+            bids = [
+                (bid_doc.id, bid_doc.to_dict())
+                for bid_doc in firestore_reads.select_fields(
+                    db.collection('service_bids').where('requestId', '==', request_id),
+                    ['providerId', 'priceQuote', 'priceBenchmark', 'availability', 'bidStatus']
+                ).stream()
+            ]
+            
+            # Provider profiles in one projected multi-get; distances come from the stored match results
+            provider_docs = firestore_reads.get_all_fields(
+                db,
+                {db.collection('providers').document(bid['providerId']) for _, bid in bids if bid.get('providerId')},
+                bid_ranking.PROVIDER_RANKING_FIELDS
+            )
+            providers = {
+                provider_id: snapshot.to_dict() for provider_id, snapshot in provider_docs.items() if snapshot.exists
+            }
+            matching_doc = firestore_reads.get_fields(
+                db.collection('matching_results').document(request_id), ['matches']
+            )
+            distances = {}
+            if matching_doc.exists:
+                for match in matching_doc.to_dict().get('matches', []):
+                    if match.get('providerId') and match.get('distanceKm') is not None:
+                        distances[match['providerId']] = match['distanceKm']
+            
+            ranked = bid_ranking.rank(
+                bids, providers, distances, compute_k,
+                suggested_min=price_range.get('aiSuggestedMin'),
+                suggested_max=price_range.get('aiSuggestedMax'),
+                urgency=urgency
+            )
+            cache.put(session_doc.id, bid_count, compute_k, ranked)
+            db.collection('bid_rankings').document(session_doc.id).set({
+                'requestId': request_id,
+                'bidCount': bid_count,
+                'k': compute_k,
+                'ranked': ranked,
+                'computedAt': firestore.SERVER_TIMESTAMP
+            })
+        
+        return https_fn.Response(
+            json.dumps({
+                'request_id': request_id,
+                'session_id': session_doc.id,
+                'bid_count': bid_count,
+                'source': source,
+                'ranked': ranked[:k]
+            }),
+            status=200,
+            headers={'Content-Type': 'application/json'}
+        )
+        
+    except Exception as e:
+        logging.error(f"Error ranking bids: {str(e)}")
+        return https_fn.Response(f"Error: {str(e)}", status=500)
+
+
+@firestore_fn.on_document_created(document="reviews/{review_id}")
+def record_review_stats(event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None]) -> None:
+    """
+    Count a new review toward its provider's completed jobs and thumbs-up on the sharded counters,
+    once the review checks out against its completed request.
+    """
+    review_id = event.params["review_id"]
+    try:
+        if event.data is None:
+            return
+        deltas = provider_stats.record_review(firestore.client(), review_id, event.data.to_dict())
+        if deltas is None:
+            logging.info(f"Review {review_id} does not count toward provider stats")
+        else:
+            logging.info(f"Counted review {review_id} toward provider stats: {deltas}")
+        
+    except Exception as e:
+        logging.error(f"Error recording provider stats for review {review_id}: {str(e)}")
+
+
+@https_fn.on_request()
+@admission.limit()
+def record_provider_stats(req: https_fn.Request) -> https_fn.Response:
+    """
+    HTTP function to count a review toward its provider's stats (e.g. one the reviews trigger missed).
+    Counts only reviews of completed requests, once per request.
+    Usage: POST /record_provider_stats with JSON body: {"review_id": "rev123"}
+    """
+    try:
+        if req.method != 'POST':
+            return https_fn.Response("Method not allowed", status=405)
+        
+        data = req.get_json()
+        if not data or 'review_id' not in data:
+            return https_fn.Response("Missing review_id in request body", status=400)
+        
+        db = firestore.client()
+        review_id = data['review_id']
+        review_doc = db.collection('reviews').document(review_id).get()
+        if not review_doc.exists:
+            return https_fn.Response("Review not found", status=404)
+        
+        review = review_doc.to_dict()
+        deltas = provider_stats.record_review(db, review_id, review)
+        provider_id = review.get('providerId')
+        
+        return https_fn.Response(
+            json.dumps({
+                'success': True,
+                'counted': deltas is not None,
+                'provider_id': provider_id,
+                'stats': provider_stats.get_stats(db, provider_id) if provider_id else None
+            }),
+            status=200,
+            headers={'Content-Type': 'application/json'}
+        )
+        
+    except Exception as e:
+        logging.error(f"Error recording provider stats: {str(e)}")
+        return https_fn.Response(f"Error: {str(e)}", status=500)
+
+
+@scheduler_fn.on_schedule(schedule="every 5 minutes")
+def materialize_provider_stats(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Scheduled function to fold pending provider stat shards and response-time summaries into the
+    provider profiles.
+    """
+    db = firestore.client()
+    try:
+        report = provider_stats.materialize(db)
+        logging.info(f"Provider stats materialization: {report}")
+    except Exception as e:
+        logging.error(f"Error materializing provider stats: {str(e)}")
+    try:
+        updated = response_times.materialize(db)
+        logging.info(f"Updated response times on {updated} provider profiles")
+    except Exception as e:
+        logging.error(f"Error materializing provider response times: {str(e)}")
+
+
+@https_fn.on_request()
+@admission.limit()
+def estimate_price(req: https_fn.Request) -> https_fn.Response:
+    """
+    HTTP function to estimate a fair price range for one or more service jobs.
+    Estimates are cached by category, description and area, so repeated jobs get the same answer.
+    Usage: POST /estimate_price with JSON body: {"category": "plumbing", "description": "Leaking sink", "area": "98101"}
+       or: POST /estimate_price with JSON body: {"items": [{"category": ..., "description": ..., "area": ...}]}
+    """
+    try:
+        if req.method != 'POST':
+            return https_fn.Response("Method not allowed", status=405)
+        
+        data = req.get_json()
+        if not data:
+            return https_fn.Response("Missing request body", status=400)
+        
+        single = 'items' not in data
+        raw_items = [data] if single else data['items']
+        if not isinstance(raw_items, list) or not raw_items:
+            return https_fn.Response("items must be a non-empty list", status=400)
+        if len(raw_items) > price_estimation.MAX_BATCH_SIZE:
+            return https_fn.Response(f"At most {price_estimation.MAX_BATCH_SIZE} items per request", status=400)
+        if any(not isinstance(item, dict) or not item.get('category') or not item.get('description')
+               for item in raw_items):
+            return https_fn.Response("Each item needs a category and description", status=400)
+        if not price_estimation.is_configured():
+            return https_fn.Response("Price estimation is not configured", status=503)
+        
+        items = [
+            price_estimation.EstimateRequest(item['category'], item['description'], item.get('area', ''))
+            for item in raw_items
+        ]
+        
+        db = firestore.client()
+        estimates = price_estimation.get_estimator().estimate_many(db, items)
+        
+        body = estimates[0] if single else {'estimates': estimates}
+        return https_fn.Response(json.dumps(body), status=200, headers={'Content-Type': 'application/json'})
+        
+    except Exception as e:
+        logging.error(f"Error estimating price: {str(e)}")
+        return https_fn.Response(f"Error: {str(e)}", status=500)
+
+
+@scheduler_fn.on_schedule(schedule="every day 03:00")
+def archive_bidding_data(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Scheduled function to move completed or expired bidding sessions (with their bids) older than
+    ARCHIVE_AFTER_DAYS, and their finished requests, into the archive collections.
+    """
+    try:
+        db = firestore.client()
+        report = archival.run(db)
+        logging.info(f"Archived bidding data: {report}")
+    except Exception as e:
+        logging.error(f"Error archiving bidding data: {str(e)}")
+
+
+@https_fn.on_request()
+@admission.limit()
+def admission_metrics(req: https_fn.Request) -> https_fn.Response:
+    """
+    HTTP function to report this instance's admission-control and cache metrics.
+    Usage: POST /admission_metrics
+    """
+    try:
+        if req.method != 'POST':
+            return https_fn.Response("Method not allowed", status=405)
+        
+        metrics = {
+            'admission': admission.get_controller().stats(),
+            'doc_cache': doc_cache.get_cache().stats(),
+            'price_estimation': price_estimation.stats(),
+        }
+        return https_fn.Response(json.dumps(metrics), status=200, headers={'Content-Type': 'application/json'})
+        
+    except Exception as e:
+        logging.error(f"Error reading admission metrics: {str(e)}")
+        return https_fn.Response(f"Error: {str(e)}", status=500)
+
+
 def _calculate_price_benchmark(price_quote, ai_estimation):
     """Helper function to calculate price benchmark"""
     if not ai_estimation or 'suggestedRange' not in ai_estimation:
@@ -1028,24 +1867,376 @@ def _calculate_price_benchmark(price_quote, ai_estimation):
         return {'benchmark': 'normal', 'isAIGenerated': False}
 
 
-def _send_new_bid_notification_to_user(user_id, provider_id, price_quote, price_benchmark):
+def _bidding_alert_content(urgency, task_description, deadline_str):
+    """Helper function to pick alert title, body, sound and badge for an urgency level"""
+    if urgency == 'critical':
+        title = "🚨 URGENT SERVICE REQUEST"
+        body = f"Critical task available! {task_description[:60]}... Deadline: {deadline_str}"
+        sound = "default"  # Use iOS default sound (loudest available)
+        badge_count = 3  # Red badge - highest urgency
+    elif urgency == 'high':
+        title = "⏰ NEW SERVICE OPPORTUNITY"
+        body = f"High-value task: {task_description[:50]}... Respond by {deadline_str}"
+        sound = "default"  # Use iOS default sound
+        badge_count = 2  # Orange badge - high urgency
+    else:
+        title = "💼 Service Request Available"
+        body = f"New opportunity: {task_description[:60]}... Deadline: {deadline_str}"
+        sound = "default"  # Use iOS default sound
+        badge_count = 1  # Yellow badge - normal urgency
+    return title, body, sound, badge_count
+
+
+def _build_bidding_alert_message(title, body, sound, badge_count, urgency, request_id, data_payload,
+                                 device=None, condition=None):
+    """Helper function to build an alarm-style bidding message for a device or topic condition"""
+    notification = messaging.Notification(
+        title=title,
+        body=body
+    )
+    # iOS-specific configuration for stronger notifications
+    apns = messaging.APNSConfig(
+        headers={
+            'apns-priority': '10',  # High priority
+            'apns-push-type': 'alert'
+        },
+        payload=messaging.APNSPayload(
+            aps=messaging.Aps(
+                alert=messaging.ApsAlert(
+                    title=title,
+                    body=body,
+                    launch_image='notification_bg.png'
+                ),
+                badge=badge_count,
+                sound=sound,
+                content_available=True,
+                mutable_content=True,
+                category='BIDDING_OPPORTUNITY',
+                thread_id=f'bidding_{request_id}'
+            ),
+            # Custom payload for app-specific handling
+            # The data payload already reaches iOS; repeat only what identifies the request
+            custom_data={
+                'bidding_data': fcm_payload.reference(data_payload),
+                'vibration_pattern': 'strong' if urgency in ['high', 'critical'] else 'normal',
+                'led_color': '#FF4444' if urgency == 'critical' else '#FFA500' if urgency == 'high' else '#00FF00'
+            }
+        )
+    )
+    # Android-specific configuration
+    android = messaging.AndroidConfig(
+        priority='high',
+        notification=messaging.AndroidNotification(
+            title=title,
+            body=body,
+            icon='ic_notification',
+            color='#FF6B35',
+            sound='default' if urgency != 'critical' else 'alarm',
+            channel_id='bidding_alerts',
+            priority='high',
+            # Removed unsupported parameters
+            sticky=True,  # Harder to dismiss
+            local_only=False
+        )
+    )
+    if device is not None:
+        return device_tokens.build_message(device, notification=notification, data=data_payload,
+                                           apns=apns, android=android)
+    return messaging.Message(
+        notification=notification,
+        data=data_payload,
+        condition=condition,
+        apns=apns,
+        android=android
+    )
+
+
+def _build_status_notification_messages(provider_id, new_status, company_name, devices):
+    """Helper function to build the status update notification and one message per device"""
+    # Create notification based on status
+    if new_status in ['verified', 'active']:
+        notification = messaging.Notification(
+            title="🎉 Account Verified!",
+            body=f"Congratulations {company_name}! You can now start accepting service requests.",
+            image=None
+        )
+        data = {
+            'type': 'status_update',
+            'status': new_status,
+            'provider_id': provider_id,
+            'action': 'verified',
+            'company_name': company_name,
+            'timestamp': str(firestore.SERVER_TIMESTAMP),
+            'click_action': 'OPEN_PROVIDER_DASHBOARD'
+        }
+    else:  # rejected
+        notification = messaging.Notification(
+            title="Application Update",
+            body=f"Hi {company_name}, please check your email for details about your application.",
+            image=None
+        )
+        data = {
+            'type': 'status_update',
+            'status': new_status,
+            'provider_id': provider_id,
+            'action': 'rejected',
+            'company_name': company_name,
+            'timestamp': str(firestore.SERVER_TIMESTAMP),
+            'click_action': 'OPEN_SUPPORT'
+        }
+    
+    # Enhanced APNS config for iOS with action buttons
+    apns_config = messaging.APNSConfig(
+        headers={'apns-priority': '10'},
+        payload=messaging.APNSPayload(
+            aps=messaging.Aps(
+                alert=messaging.ApsAlert(
+                    title=notification.title,
+                    body=notification.body
+                ),
+                badge=1,
+                sound="default",
+                category="STATUS_UPDATE",
+                mutable_content=True
+            ),
+            custom_data={
+                'click_action': data.get('click_action', ''),
+                'company_name': data.get('company_name', ''),
+                'provider_id': provider_id
+            }
+        )
+    )
+    
+    messages = [
+        device_tokens.build_message(device, notification=notification, data=data, apns=apns_config)
+        for device in devices
+    ]
+    return notification, messages
+
+
+def _send_bulk_status_notifications(db, updates, provider_docs):
+    """Helper function to send status notifications for many providers in one batched send"""
+    provider_devices = device_tokens.load_devices(db, 'providers', [provider_id for provider_id, _ in updates], {
+        provider_id: provider_docs[provider_id].to_dict().get('fcmTokens', []) for provider_id, _ in updates
+    })
+    
+    messages = []
+    spans = []
+    for provider_id, new_status in updates:
+        devices = provider_devices.get(provider_id, [])
+        if not devices:
+            continue
+        company_name = provider_docs[provider_id].to_dict().get('companyName', 'Provider')
+        notification, provider_messages = _build_status_notification_messages(
+            provider_id, new_status, company_name, devices
+        )
+        spans.append((provider_id, new_status, notification, devices, len(messages), len(provider_messages)))
+        messages.extend(provider_messages)
+    
+    if not messages:
+        return {'sent': 0, 'failed': 0, 'unsent': [], 'throttled': None}
+    
+    throttled = None
+    try:
+        response = fcm_sender.send_each(messages)
+    except fcm_sender.FCMBackpressureError as e:
+        # Keep the outcome of the messages that went out before the send budget ran dry
+        throttled = e
+        response = e.partial
+    
+    # Prune dead tokens and write each provider's full notification record, all in batched writes
+    pruner = device_tokens.FailurePruner(db)
+    audit = notification_audit.status_logger(db)
+    unsent = []
+    for provider_id, new_status, notification, devices, offset, count in spans:
+        sent = [(device, result) for device, result in zip(devices, response.responses[offset:offset + count])
+                if result is not None]
+        if not sent:
+            unsent.append(provider_id)
+            continue
+        sent_devices = [device for device, _result in sent]
+        provider_response = messaging.BatchResponse([result for _device, result in sent])
+        if provider_response.failure_count > 0:
+            pruner.add('providers', provider_id, sent_devices, provider_response)
+        audit.record_response(provider_id, 'status_update', sent_devices, provider_response, detail={
+            'type': 'push_notification',
+            'status': new_status,
+            'title': notification.title,
+            'body': notification.body
+        })
+    audit.flush()
+    pruner.commit()
+    
+    logging.info(f"Sent {response.success_count} status notifications to {len(spans) - len(unsent)} providers"
+                 f"{f', {len(unsent)} not reached (send budget exhausted)' if unsent else ''}")
+    return {'sent': response.success_count, 'failed': response.failure_count, 'unsent': unsent,
+            'throttled': throttled}
+
+
+def _requeue_status_notifications(db, provider_ids):
+    """Helper function to hand providers a bulk send never reached back to the providers trigger"""
+    for start in range(0, len(provider_ids), BULK_STATUS_WRITE_CHUNK):
+        batch = db.batch()
+        for provider_id in provider_ids[start:start + BULK_STATUS_WRITE_CHUNK]:
+            batch.update(db.collection('providers').document(provider_id), {
+                STATUS_NOTIFICATION_REQUEUE_FIELD: firestore.SERVER_TIMESTAMP
+            })
+        try:
+            batch.commit()
+        except Exception as e:
+            logging.error(f"Error requeueing status notifications: {str(e)}")
+
+
+def _send_bidding_wave(db, request_id, provider_ids, provider_docs, task_description, suggested_price, urgency,
+                       deadline_hours, deadline_timestamp, trace_id):
+    """Helper function to push a bidding opportunity to one wave of providers. Returns notifications sent."""
+    provider_devices = device_tokens.load_devices(db, 'providers', provider_ids, {
+        provider_id: snapshot.to_dict().get('fcmTokens', [])
+        for provider_id, snapshot in provider_docs.items() if snapshot.exists
+    })
+    send_jobs = []
+    device_jobs = []
+    for provider_id in provider_ids:
+        try:
+            # Get provider FCM tokens
+            provider_doc = provider_docs.get(provider_id)
+            if provider_doc is None or not provider_doc.exists:
+                logging.warning(f"Provider {provider_id} not found")
+                continue
+                
+            devices = provider_devices.get(provider_id, [])
+            
+            if not devices:
+                logging.warning(f"No FCM tokens for provider {provider_id}")
+                continue
+            
+            # Send notification to each registered device
+            messages = []
+            for device in devices:
+                message = device_tokens.build_message(
+                    device,
+                    notification=messaging.Notification(
+                        title=f"🔥 New {urgency.title()} Service Request",
+                        body=fcm_payload.truncate(f"{task_description} • {suggested_price}",
+                                                  fcm_payload.FIELD_BUDGETS['body'])
+                    ),
+                    data=fcm_payload.compact_data({
+                        'type': 'bidding_opportunity',
+                        'request_id': request_id,
+                        'urgency': urgency,
+                        'deadline_hours': deadline_hours,
+                        'trace_id': trace_id
+                    }),
+                    android=messaging.AndroidConfig(
+                        priority='high',
+                        notification=messaging.AndroidNotification(
+                            sound='default',
+                            channel_id='bidding_notifications'
+                        )
+                    ),
+                    apns=messaging.APNSConfig(
+                        payload=messaging.APNSPayload(
+                            aps=messaging.Aps(
+                                sound='default',
+                                badge=2
+                            )
+                        )
+                    )
+                )
+                messages.append(message)
+            
+            future = notification_scheduler.submit(
+                messages,
+                urgency=urgency,
+                deadline_timestamp=deadline_timestamp
+            )
+            send_jobs.append(future)
+            device_jobs.append((provider_id, devices, future))
+                
+        except Exception as e:
+            logging.error(f"Failed to send notification to provider {provider_id}: {str(e)}")
+    
+    total_sent, total_failed, backpressure = notification_scheduler.wait_all(send_jobs)
+    if total_failed > 0 or backpressure is not None:
+        logging.warning(f"Failed to send {total_failed} bidding notifications for request {request_id}"
+                        f"{' (send budget exhausted)' if backpressure else ''}")
+    if total_failed > 0:
+        device_tokens.prune_failures(db, 'providers', device_jobs)
+    
+    audit = notification_audit.AuditLogger(db)
+    audit.record_jobs('bidding_opportunity', device_jobs, detail={'requestId': request_id, 'urgency': urgency})
+    audit.flush()
+    response_times.record_notification_jobs(db, request_id, device_jobs)
+    return total_sent
+
+
+def _record_bid_optimistic(db, bid_ref, bid_data, session_doc, extra_writes=()):
+    """
+    Helper function to write a bid and its session aggregates in one batch, based on the session
+    as already read. Returns None if the session changed since (the write is then not applied).
+    ``extra_writes`` are (reference, data) merges committed in the same batch.
+    """
+    current = session_doc.to_dict().get(bid_aggregates.AGGREGATES_FIELD)
+    aggregates = bid_aggregates.add_bid(current, bid_ref.id, bid_data)
+    
+    batch = db.batch()
+    batch.set(bid_ref, bid_data)
+    batch.update(session_doc.reference, {
+        'receivedBids': firestore.ArrayUnion([bid_ref.id]),
+        bid_aggregates.AGGREGATES_FIELD: aggregates,
+        'updatedAt': firestore.SERVER_TIMESTAMP
+    }, option=db.write_option(last_update_time=session_doc.update_time))
+    for reference, update in extra_writes:
+        batch.set(reference, update, merge=True)
+    try:
+        batch.commit()
+    except google_exceptions.FailedPrecondition:
+        return None
+    return aggregates
+
+
+@firestore.transactional
+def _record_bid_transaction(transaction, bid_ref, bid_data, session_ref, extra_writes=()):
+    """Helper function to create a bid and fold it into its session's live aggregates atomically"""
+    session_doc = firestore_reads.get_fields(session_ref, [bid_aggregates.AGGREGATES_FIELD], transaction=transaction)
+    current = session_doc.to_dict().get(bid_aggregates.AGGREGATES_FIELD) if session_doc.exists else None
+    aggregates = bid_aggregates.add_bid(current, bid_ref.id, bid_data)
+    
+    transaction.set(bid_ref, bid_data)
+    transaction.update(session_ref, {
+        'receivedBids': firestore.ArrayUnion([bid_ref.id]),
+        bid_aggregates.AGGREGATES_FIELD: aggregates,
+        'updatedAt': firestore.SERVER_TIMESTAMP
+    })
+    for reference, update in extra_writes:
+        transaction.set(reference, update, merge=True)
+    return aggregates
+
+
+def _load_user_devices(db, user_id):
+    """Helper function to get a user's registered devices (empty if the user does not exist)"""
+    # Cached: a bid storm notifies the same user over and over
+    user_doc = doc_cache.get(db, 'users', user_id, firestore_reads.USER_NOTIFICATION_FIELDS)
+    if not user_doc.exists:
+        return []
+    return device_tokens.load_devices(
+        db, 'users', [user_id], {user_id: user_doc.to_dict().get('fcmTokens', [])}
+    )[user_id]
+
+
+def _send_new_bid_notification_to_user(user_id, provider_id, price_quote, price_benchmark, devices_future=None):
     """Helper function to send new bid notification to user"""
     try:
         db = firestore.client()
         
-        # Get user's FCM tokens
-        user_doc = db.collection('users').document(user_id).get()
-        if not user_doc.exists:
-            return
-            
-        user_data = user_doc.to_dict()
-        fcm_tokens = user_data.get('fcmTokens', [])
+        # Get user's devices, unless the caller already started loading them
+        devices = devices_future.result() if devices_future is not None else _load_user_devices(db, user_id)
         
-        if not fcm_tokens:
+        if not devices:
             return
         
         # Get provider name
-        provider_doc = db.collection('providers').document(provider_id).get()
+        provider_doc = doc_cache.get(db, 'providers', provider_id, firestore_reads.PROVIDER_NOTIFICATION_FIELDS)
         provider_name = "A provider"
         if provider_doc.exists:
             provider_data = provider_doc.to_dict()
@@ -1068,13 +2259,13 @@ def _send_new_bid_notification_to_user(user_id, provider_id, price_quote, price_
             'click_action': 'OPEN_BID_COMPARISON'
         }
         
-        # Send to all user tokens
+        # Send to all user devices
         messages = []
-        for token in fcm_tokens:
-            message = messaging.Message(
+        for device in devices:
+            message = device_tokens.build_message(
+                device,
                 notification=notification,
                 data=data_payload,
-                token=token,
                 apns=messaging.APNSConfig(
                     payload=messaging.APNSPayload(
                         aps=messaging.Aps(
@@ -1091,8 +2282,12 @@ def _send_new_bid_notification_to_user(user_id, provider_id, price_quote, price_
             messages.append(message)
         
         if messages:
-            messaging.send_each(messages)
+            response = fcm_sender.send_each(messages)
             logging.info(f"Sent new bid notification to user {user_id}")
+            if response.failure_count > 0:
+                pruner = device_tokens.FailurePruner(db)
+                pruner.add('users', user_id, devices, response)
+                pruner.commit()
             
     except Exception as e:
         logging.error(f"Error sending new bid notification to user: {e}")
@@ -1105,22 +2300,33 @@ def _send_bid_result_notifications(request_id, winning_provider_id, winning_pric
         
         # Get all bids for this request
         bids_query = db.collection('service_bids').where('requestId', '==', request_id)
-        bids = bids_query.get()
+        bids = firestore_reads.select_fields(bids_query, ['providerId']).get()
+        
+        # Get every bidder's FCM tokens, from the cache or one projected multi-get for the misses
+        provider_docs = doc_cache.get_many(
+            db, 'providers', [bid_doc.get('providerId') for bid_doc in bids],
+            firestore_reads.PROVIDER_NOTIFICATION_FIELDS
+        )
+        provider_devices = device_tokens.load_devices(db, 'providers', list(provider_docs), {
+            provider_id: snapshot.to_dict().get('fcmTokens', [])
+            for provider_id, snapshot in provider_docs.items() if snapshot.exists
+        })
+        pruner = device_tokens.FailurePruner(db)
         
         for bid_doc in bids:
             bid_data = bid_doc.to_dict()
             provider_id = bid_data['providerId']
             
             # Get provider's FCM tokens
-            provider_doc = db.collection('providers').document(provider_id).get()
-            if not provider_doc.exists:
+            provider_doc = provider_docs.get(provider_id)
+            if provider_doc is None or not provider_doc.exists:
                 continue
                 
             provider_data = provider_doc.to_dict()
-            fcm_tokens = provider_data.get('fcmTokens', [])
+            devices = provider_devices.get(provider_id, [])
             company_name = provider_data.get('companyName', 'Provider')
             
-            if not fcm_tokens:
+            if not devices:
                 continue
             
             # Create different notifications for winner vs losers
@@ -1148,11 +2354,11 @@ def _send_bid_result_notifications(request_id, winning_provider_id, winning_pric
             
             # Send notifications
             messages = []
-            for token in fcm_tokens:
-                message = messaging.Message(
+            for device in devices:
+                message = device_tokens.build_message(
+                    device,
                     notification=notification,
                     data=data_payload,
-                    token=token,
                     apns=messaging.APNSConfig(
                         payload=messaging.APNSPayload(
                             aps=messaging.Aps(
@@ -1169,14 +2375,18 @@ def _send_bid_result_notifications(request_id, winning_provider_id, winning_pric
                 messages.append(message)
             
             if messages:
-                messaging.send_each(messages)
+                response = fcm_sender.send_each(messages)
+                pruner.add('providers', provider_id, devices, response)
                 logging.info(f"Sent bid result notification to {company_name} ({'winner' if provider_id == winning_provider_id else 'participant'})")
+        
+        pruner.commit()
                 
     except Exception as e:
         logging.error(f"Error sending bid result notifications: {e}")
 
 
 @https_fn.on_request()
+@admission.limit('admin')
 def migrate_service_requests(req: https_fn.Request) -> https_fn.Response:
     """
     HTTP function to migrate existing service_requests to user_requests collection.
@@ -1273,7 +2483,8 @@ def migrate_service_requests(req: https_fn.Request) -> https_fn.Response:
         return https_fn.Response(f"Migration failed: {str(e)}", status=500)
 
 
-@https_fn.on_request(cors=True)
+@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["get", "post"]))
+@admission.limit('admin')
 def cleanup_test_data(req: https_fn.Request) -> https_fn.Response:
     """HTTP Cloud Function to clean up old test data from Firestore"""
     try:
@@ -1289,7 +2500,9 @@ def cleanup_test_data(req: https_fn.Request) -> https_fn.Response:
             'service_bids',
             'matching_results',
             'matching_logs',
-            'service_requests'  # Legacy collection
+            'service_requests',  # Legacy collection
+            archival.ARCHIVED_REQUESTS_COLLECTION,
+            archival.ARCHIVED_SESSIONS_COLLECTION
         ]
         
         for collection_name in collections_to_cleanup:
@@ -1297,7 +2510,7 @@ def cleanup_test_data(req: https_fn.Request) -> https_fn.Response:
             
             # Get all documents in batches
             collection_ref = db.collection(collection_name)
-            docs = collection_ref.limit(500).stream()
+            docs = firestore_reads.select_fields(collection_ref.limit(500), firestore_reads.ID_ONLY).stream()
             
             # Delete in batches
             batch = db.batch()
@@ -0,0 +1,160 @@
+"""
+Buffered audit logging for push notification sends.
+
+Instead of one ``provider_notifications`` document per send, outcomes are
+summed in memory and flushed as increments to one rollup document per
+provider per time bucket:
+
+    provider_notification_rollups/{providerId}_{bucket}
+        providerId, bucketStart, bucketSeconds, updatedAt
+        totals: {notifications, sentTo, success, failure}
+        byType: {<type>: {notifications, sentTo, success, failure}}
+
+A fan-out to N providers costs N batched increments per flush rather than N
+single-document adds, and repeated sends to a provider in the same bucket
+land on the same document. A sampled fraction of sends still get a detailed
+``provider_notification_samples`` record (carrying its ``sampleRate`` so
+counts can be scaled back up). Samples are audit data only and are kept out
+of ``provider_notifications``, which the provider app shows as its
+notification history.
+
+Sampling is only for the bidding fan-outs. Provider status notifications
+belong in that history, so the status paths use ``status_logger``: every
+send gets its full ``provider_notifications`` record and no rollup.
+"""
+
+import logging
+import os
+import random
+import threading
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+import fcm_sender
+
+ROLLUP_COLLECTION = 'provider_notification_rollups'
+SAMPLE_COLLECTION = 'provider_notification_samples'
+# User-facing notification history (lib/services/notification_service.dart)
+HISTORY_COLLECTION = 'provider_notifications'
+
+BUCKET_SECONDS = int(os.environ.get('NOTIFICATION_AUDIT_BUCKET_SECONDS', '3600'))
+
+# Fraction of sends that also get a detailed provider_notification_samples record
+DETAIL_SAMPLE_RATE = float(os.environ.get('NOTIFICATION_AUDIT_DETAIL_SAMPLE_RATE', '0.05'))
+
+# Writes per batch commit (Firestore allows 500)
+WRITE_CHUNK = 400
+
+_COUNTERS = ('notifications', 'sentTo', 'success', 'failure')
+
+
+def bucket_start(moment, bucket_seconds=BUCKET_SECONDS):
+    epoch = int(moment.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % bucket_seconds, tz=timezone.utc)
+
+
+def rollup_id(provider_id, start):
+    return f"{provider_id}_{start.strftime('%Y%m%dT%H%M')}"
+
+
+class AuditLogger:
+    """Collects send outcomes and writes them as bucketed rollups on flush()."""
+
+    def __init__(self, db, sample_rate=None, bucket_seconds=BUCKET_SECONDS, rollups=True,
+                 detail_collection=SAMPLE_COLLECTION):
+        self._db = db
+        self._detail_collection = detail_collection
+        self._sample_rate = DETAIL_SAMPLE_RATE if sample_rate is None else sample_rate
+        self._rollups_enabled = rollups
+        self._bucket_seconds = bucket_seconds
+        self._rollups = {}
+        self._details = []
+        self._lock = threading.Lock()
+
+    def record(self, provider_id, notification_type, sent_to, success_count, failure_count,
+               detail=None):
+        """Add one send to the provider's current bucket; ``detail`` is kept only when sampled."""
+        start = bucket_start(datetime.now(timezone.utc), self._bucket_seconds)
+        with self._lock:
+            if self._rollups_enabled:
+                counts = self._rollups.setdefault((provider_id, start), {})
+                type_counts = counts.setdefault(notification_type, dict.fromkeys(_COUNTERS, 0))
+                type_counts['notifications'] += 1
+                type_counts['sentTo'] += sent_to
+                type_counts['success'] += success_count
+                type_counts['failure'] += failure_count
+
+            if detail is not None and self._sample_rate > 0 and random.random() < self._sample_rate:
+                self._details.append({
+                    **detail,
+                    'providerId': provider_id,
+                    'type': detail.get('type', notification_type),
+                    'sentTo': sent_to,
+                    'successCount': success_count,
+                    'failureCount': failure_count,
+                    'sampleRate': self._sample_rate,
+                    'timestamp': firestore.SERVER_TIMESTAMP,
+                })
+
+    def record_response(self, provider_id, notification_type, devices, response, detail=None):
+        self.record(provider_id, notification_type, len(devices), response.success_count,
+                    response.failure_count, detail=detail)
+
+    def record_jobs(self, notification_type, jobs, detail=None):
+        """Record finished scheduler jobs, a list of (provider_id, devices, future)."""
+        for provider_id, devices, future in jobs:
+            if not future.done():
+                continue
+            response = fcm_sender.job_response(future)
+            if response is None:
+                self.record(provider_id, notification_type, len(devices), 0, len(devices), detail=detail)
+            else:
+                # A throttled job only counts the messages it actually sent
+                sent_to = len(devices) - getattr(response, 'unsent_count', 0)
+                self.record(provider_id, notification_type, sent_to, response.success_count,
+                            response.failure_count, detail=detail)
+
+    def flush(self):
+        """Write buffered rollups and sampled details in batched commits. Errors are logged, not raised."""
+        with self._lock:
+            rollups, self._rollups = self._rollups, {}
+            details, self._details = self._details, []
+        if not rollups and not details:
+            return 0
+
+        writes = []
+        for (provider_id, start), by_type in rollups.items():
+            totals = dict.fromkeys(_COUNTERS, 0)
+            for type_counts in by_type.values():
+                for counter in _COUNTERS:
+                    totals[counter] += type_counts[counter]
+            writes.append((self._db.collection(ROLLUP_COLLECTION).document(rollup_id(provider_id, start)), {
+                'providerId': provider_id,
+                'bucketStart': start,
+                'bucketSeconds': self._bucket_seconds,
+                'totals': {counter: firestore.Increment(value) for counter, value in totals.items()},
+                'byType': {
+                    notification_type: {counter: firestore.Increment(value) for counter, value in counts.items()}
+                    for notification_type, counts in by_type.items()
+                },
+                'updatedAt': firestore.SERVER_TIMESTAMP,
+            }, True))
+        for detail in details:
+            writes.append((self._db.collection(self._detail_collection).document(), detail, False))
+
+        try:
+            for offset in range(0, len(writes), WRITE_CHUNK):
+                batch = self._db.batch()
+                for reference, data, merge in writes[offset:offset + WRITE_CHUNK]:
+                    batch.set(reference, data, merge=merge)
+                batch.commit()
+        except Exception as e:
+            logging.error(f"Error writing notification audit rollups: {str(e)}")
+            return 0
+        return len(writes)
+
+
+def status_logger(db):
+    """Logger for provider status notifications: a full detailed record for every send, no rollups."""
+    return AuditLogger(db, sample_rate=1.0, rollups=False, detail_collection=HISTORY_COLLECTION)
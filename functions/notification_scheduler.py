@@ -0,0 +1,169 @@
+"""
+Urgency-aware scheduling of notification sends.
+
+Fan-outs submit one job per provider instead of sending inline. Jobs are
+queued per urgency class and ordered by deadline inside each class. Worker
+threads pick classes by smooth weighted round-robin, so under load critical
+requests reach providers first while high and normal traffic still gets a
+guaranteed share of the send budget.
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import fcm_sender
+
+URGENCY_LEVELS = ('critical', 'high', 'normal')
+
+# Relative share of dequeues each urgency gets while all classes are backlogged
+URGENCY_WEIGHTS = {
+    'critical': int(os.environ.get('NOTIFICATION_WEIGHT_CRITICAL', '6')),
+    'high': int(os.environ.get('NOTIFICATION_WEIGHT_HIGH', '3')),
+    'normal': int(os.environ.get('NOTIFICATION_WEIGHT_NORMAL', '1')),
+}
+
+SEND_WORKERS = int(os.environ.get('NOTIFICATION_SEND_WORKERS', '4'))
+
+
+def normalize_urgency(urgency):
+    return urgency if urgency in URGENCY_LEVELS else 'normal'
+
+
+class NotificationJob:
+    def __init__(self, messages, urgency, deadline_timestamp, sequence):
+        self.messages = messages
+        self.urgency = urgency
+        # Jobs without a deadline sort after every job that has one
+        self.deadline_timestamp = deadline_timestamp if deadline_timestamp is not None else float('inf')
+        self.sequence = sequence
+        self.enqueued_at = time.monotonic()
+        self.future = Future()
+
+    def sort_key(self):
+        return (self.deadline_timestamp, self.sequence)
+
+
+class NotificationScheduler:
+    """Priority work queue feeding a small pool of send workers."""
+
+    def __init__(self, send_fn=None, workers=SEND_WORKERS, weights=None):
+        self._send_fn = send_fn or fcm_sender.send_each
+        self._workers = workers
+        self._weights = dict(weights or URGENCY_WEIGHTS)
+        self._queues = {urgency: [] for urgency in URGENCY_LEVELS}
+        self._current_weights = {urgency: 0 for urgency in URGENCY_LEVELS}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self.stats = {
+            'submitted': {urgency: 0 for urgency in URGENCY_LEVELS},
+            'completed': {urgency: 0 for urgency in URGENCY_LEVELS},
+            'queue_wait_ms': {urgency: 0.0 for urgency in URGENCY_LEVELS},
+        }
+
+    def submit(self, messages, urgency='normal', deadline_timestamp=None):
+        """Queue messages for sending. The returned Future resolves to the BatchResponse."""
+        urgency = normalize_urgency(urgency)
+        job = NotificationJob(messages, urgency, deadline_timestamp, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._queues[urgency], (job.sort_key(), job))
+            self.stats['submitted'][urgency] += 1
+            self._ensure_workers()
+            self._condition.notify()
+        return job.future
+
+    def pending(self):
+        with self._condition:
+            return {urgency: len(queue) for urgency, queue in self._queues.items()}
+
+    def _ensure_workers(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self._workers:
+            thread = threading.Thread(target=self._run, name=f"notification-sender-{len(self._threads)}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _pick_urgency(self):
+        """Smooth weighted round-robin over the non-empty urgency classes."""
+        backlogged = [u for u in URGENCY_LEVELS if self._queues[u]]
+        if not backlogged:
+            return None
+        total = 0
+        for urgency in backlogged:
+            self._current_weights[urgency] += self._weights[urgency]
+            total += self._weights[urgency]
+        # URGENCY_LEVELS is ordered most urgent first, so ties go to the more urgent class
+        chosen = max(backlogged, key=lambda u: self._current_weights[u])
+        self._current_weights[chosen] -= total
+        return chosen
+
+    def _next_job(self):
+        with self._condition:
+            while True:
+                urgency = self._pick_urgency()
+                if urgency is not None:
+                    _key, job = heapq.heappop(self._queues[urgency])
+                    if not any(self._queues.values()):
+                        self._current_weights = {u: 0 for u in URGENCY_LEVELS}
+                    return job
+                self._condition.wait()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            wait_ms = (time.monotonic() - job.enqueued_at) * 1000.0
+            try:
+                result = self._send_fn(job.messages)
+            except BaseException as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
+            with self._condition:
+                self.stats['completed'][job.urgency] += 1
+                self.stats['queue_wait_ms'][job.urgency] += wait_ms
+
+
+_scheduler = NotificationScheduler()
+
+
+def get_scheduler():
+    return _scheduler
+
+
+def submit(messages, urgency='normal', deadline_timestamp=None):
+    return _scheduler.submit(messages, urgency=urgency, deadline_timestamp=deadline_timestamp)
+
+
+def wait_all(futures):
+    """
+    Wait for submitted jobs and return (success_count, failure_count, backpressure_error).
+
+    backpressure_error is the FCMBackpressureError raised by any job, or None, so that
+    HTTP callers can answer with 429 while still reporting what was sent. Messages a
+    throttled job did send are counted; the ones it never sent are neither.
+    """
+    success_count = 0
+    failure_count = 0
+    backpressure = None
+    for future in futures:
+        try:
+            response = future.result()
+        except fcm_sender.FCMBackpressureError as e:
+            backpressure = e
+            response = e.partial
+            if response is None:
+                continue
+        except Exception as e:
+            logging.error(f"Notification job failed: {str(e)}")
+            continue
+        success_count += response.success_count
+        failure_count += response.failure_count
+    return success_count, failure_count, backpressure
@@ -0,0 +1,321 @@
+"""
+Server-side AI price estimation with a content-addressed cache.
+
+An estimate is a pure function of (service category, normalized description,
+area), so it is cached under a key derived from exactly those inputs:
+
+    sha256(category | sha256(normalized description) | normalized area)
+
+Lookups go through three layers:
+
+1. This instance's memory (TTL + LRU), served without I/O.
+2. ``price_estimates/{backend}__{key}``, shared by every instance. The first writer
+   wins (``create``), so concurrent estimations of the same job settle on one
+   stored answer and every caller sees the same range until it expires.
+3. The model backend, called only for keys missing from both. Concurrent
+   callers waiting on the same key share one call (single flight), and
+   ``estimate_many`` sends all of its misses to the backend as one batch.
+
+Backends implement ``estimate_batch(items) -> [estimate]``. ``StubBackend``
+is a deterministic local model for tests and the emulator;
+``GeminiBackend`` asks Gemini for a JSON range. ``PRICE_ESTIMATION_BACKEND``
+picks one; without it Gemini is used when ``GEMINI_API_KEY`` is set, and
+otherwise estimation is unavailable (``BackendNotConfiguredError``) so
+callers fall back rather than receive stub prices. The stub must be chosen
+explicitly. Stored estimates are kept per backend
+(``price_estimates/{backend}__{key}``), so switching backends never serves
+another model's answers. ``set_backend`` swaps the backend at runtime.
+
+Estimates use the request document's ``aiPriceEstimation`` shape
+(``suggestedRange: {min, max}``, ``average``, ``confidenceLevel``,
+``factors``), so ``_calculate_price_benchmark`` consumes them unchanged.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+from google.api_core import exceptions as google_exceptions
+
+import firestore_reads
+from text_normalize import normalize
+
+ESTIMATES_COLLECTION = 'price_estimates'
+
+TTL_SECONDS = int(os.environ.get('PRICE_ESTIMATE_TTL_SECONDS', str(7 * 24 * 3600)))
+MEMORY_MAX_ENTRIES = int(os.environ.get('PRICE_ESTIMATE_CACHE_MAX_ENTRIES', '4096'))
+
+# Most items sent to the model in one call
+MAX_BATCH_SIZE = 20
+
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
+GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash')
+GEMINI_TIMEOUT_SECONDS = 20
+
+# 'gemini' or 'stub'; empty means Gemini if it has a key, else no backend
+BACKEND = os.environ.get('PRICE_ESTIMATION_BACKEND') or ('gemini' if GEMINI_API_KEY else '')
+
+FIELDS = ('suggestedRange', 'average', 'confidenceLevel', 'factors', 'model', 'expiresAt')
+
+
+class BackendNotConfiguredError(RuntimeError):
+    pass
+
+
+def normalize_area(area):
+    """Zip codes reduce to their first five digits; other areas to normalized text."""
+    area = normalize(area)
+    compact = area.replace(' ', '')
+    return compact[:5] if len(compact) >= 5 and compact.isdigit() else area
+
+
+def cache_key(category, description, area):
+    description_hash = hashlib.sha256(normalize(description).encode()).hexdigest()
+    raw = '|'.join([normalize(category), description_hash, normalize_area(area)])
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+class EstimateRequest:
+    def __init__(self, category, description, area=''):
+        self.category = category or ''
+        self.description = description or ''
+        self.area = area or ''
+        self.key = cache_key(self.category, self.description, self.area)
+
+
+class StubBackend:
+    """Deterministic local model: category base price scaled by job size keywords."""
+
+    name = 'stub'
+
+    BASE_PRICES = {
+        'plumbing': 180, 'electrical': 200, 'hvac': 250, 'cleaning': 120,
+        'appliance repair': 160, 'handyman': 110, 'landscaping': 140,
+    }
+    SIZE_WORDS = {'replace': 1.5, 'install': 1.4, 'entire': 1.6, 'emergency': 1.3, 'small': 0.7, 'minor': 0.7}
+
+    def estimate_batch(self, items):
+        return [self._estimate(item) for item in items]
+
+    def _estimate(self, item):
+        base = self.BASE_PRICES.get(normalize(item.category), 150)
+        words = set(normalize(item.description).split())
+        factors = sorted(words & set(self.SIZE_WORDS))
+        for word in factors:
+            base *= self.SIZE_WORDS[word]
+        return {
+            'suggestedRange': {'min': round(base * 0.7), 'max': round(base * 1.3)},
+            'average': round(base),
+            'confidenceLevel': 'low',
+            'factors': factors or ['category baseline'],
+        }
+
+
+class GeminiBackend:
+    """Asks Gemini for all items of a batch in one prompt."""
+
+    name = 'gemini'
+
+    def __init__(self, api_key=GEMINI_API_KEY, model=GEMINI_MODEL):
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY is not set")
+        self._url = (f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+                     f"?key={api_key}")
+
+    def estimate_batch(self, items):
+        jobs = '\n'.join(
+            f'{i + 1}. Category: {item.category}; Area: {item.area or "unknown"}; Service: {item.description}'
+            for i, item in enumerate(items)
+        )
+        prompt = (
+            "Estimate a fair market price range in USD for each home service job below.\n"
+            f"{jobs}\n"
+            "Reply with only a JSON array, one object per job in the same order, like "
+            '{"min": 100, "max": 300, "average": 200, "confidence": "medium", "factors": ["time required"]}'
+        )
+        body = json.dumps({
+            'contents': [{'parts': [{'text': prompt}]}],
+            'generationConfig': {'temperature': 0, 'responseMimeType': 'application/json'},
+        }).encode()
+        request = urllib.request.Request(self._url, data=body, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=GEMINI_TIMEOUT_SECONDS) as response:
+            result = json.loads(response.read())
+        estimates = json.loads(result['candidates'][0]['content']['parts'][0]['text'])
+        if not isinstance(estimates, list) or len(estimates) != len(items):
+            raise ValueError(f"Expected {len(items)} estimates from Gemini, got {estimates!r}")
+        return [
+            {
+                'suggestedRange': {'min': float(estimate['min']), 'max': float(estimate['max'])},
+                'average': float(estimate.get('average') or (float(estimate['min']) + float(estimate['max'])) / 2),
+                'confidenceLevel': estimate.get('confidence', 'medium'),
+                'factors': list(estimate.get('factors', [])),
+            }
+            for estimate in estimates
+        ]
+
+
+_BACKENDS = {'stub': StubBackend, 'gemini': GeminiBackend}
+
+
+class PriceEstimator:
+    def __init__(self, backend, ttl_seconds=TTL_SECONDS, max_entries=MEMORY_MAX_ENTRIES):
+        self.backend = backend
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._memory = OrderedDict()   # key -> (monotonic expiry, estimate)
+        self._in_flight = {}           # key -> Future shared by concurrent callers
+        self._lock = threading.Lock()
+        self._metrics = {'memory_hits': 0, 'store_hits': 0, 'computed': 0, 'joined': 0, 'backend_calls': 0}
+
+    def estimate(self, db, category, description, area=''):
+        return self.estimate_many(db, [EstimateRequest(category, description, area)])[0]
+
+    def estimate_many(self, db, items):
+        """Estimates for ``items`` (EstimateRequests), in order; each carries its cacheKey and source."""
+        results = {}
+        owned = {}     # key -> (item, future) this call must resolve
+        joined = {}    # key -> future another caller is resolving
+        now = time.monotonic()
+        with self._lock:
+            for item in items:
+                if item.key in results or item.key in owned or item.key in joined:
+                    continue
+                entry = self._memory.get(item.key)
+                if entry is not None and entry[0] > now:
+                    self._memory.move_to_end(item.key)
+                    self._metrics['memory_hits'] += 1
+                    results[item.key] = dict(entry[1], source='memory')
+                elif item.key in self._in_flight:
+                    self._metrics['joined'] += 1
+                    joined[item.key] = self._in_flight[item.key]
+                else:
+                    future = Future()
+                    self._in_flight[item.key] = future
+                    owned[item.key] = (item, future)
+
+        if owned:
+            try:
+                resolved = self._resolve(db, [item for item, _future in owned.values()])
+                for key, (_item, future) in owned.items():
+                    future.set_result(resolved[key])
+            except Exception as e:
+                for _item, future in owned.values():
+                    if not future.done():
+                        future.set_exception(e)
+                raise
+            finally:
+                with self._lock:
+                    for key in owned:
+                        self._in_flight.pop(key, None)
+            results.update(resolved)
+
+        for key, future in joined.items():
+            results[key] = future.result()
+        return [dict(results[item.key]) for item in items]
+
+    def _resolve(self, db, items):
+        """Fill keys missing from memory from the shared store, then the backend."""
+        refs = {
+            item.key: db.collection(ESTIMATES_COLLECTION).document(f'{self.backend.name}__{item.key}')
+            for item in items
+        }
+        stored = firestore_reads.get_all_fields(db, list(refs.values()), FIELDS)
+        now = datetime.now(timezone.utc)
+        resolved = {}
+        misses = []
+        for item in items:
+            # get_all_fields keys snapshots by document id, which carries the backend prefix
+            snapshot = stored.get(refs[item.key].id)
+            data = snapshot.to_dict() if snapshot is not None and snapshot.exists else None
+            if data and data.get('expiresAt') and data['expiresAt'] > now:
+                resolved[item.key] = self._remember(item.key, data, 'firestore')
+            else:
+                misses.append(item)
+
+        for start in range(0, len(misses), MAX_BATCH_SIZE):
+            chunk = misses[start:start + MAX_BATCH_SIZE]
+            estimates = self.backend.estimate_batch(chunk)
+            for item, estimate in zip(chunk, estimates):
+                resolved[item.key] = self._store(db, refs[item.key], item, estimate)
+
+        with self._lock:
+            self._metrics['store_hits'] += len(items) - len(misses)
+            self._metrics['computed'] += len(misses)
+            self._metrics['backend_calls'] += -(-len(misses) // MAX_BATCH_SIZE)
+        return resolved
+
+    def _store(self, db, ref, item, estimate):
+        data = dict(estimate, model=self.backend.name, category=item.category, area=normalize_area(item.area),
+                    expiresAt=datetime.now(timezone.utc) + timedelta(seconds=self._ttl),
+                    createdAt=firestore.SERVER_TIMESTAMP)
+        try:
+            ref.create(data)
+        except google_exceptions.Conflict:
+            # Another instance estimated the same job first (or an expired entry is still there)
+            existing = firestore_reads.get_fields(ref, FIELDS)
+            current = existing.to_dict() if existing.exists else {}
+            if current.get('expiresAt') and current['expiresAt'] > datetime.now(timezone.utc):
+                return self._remember(item.key, current, 'firestore')
+            ref.set(data)
+        return self._remember(item.key, data, 'computed')
+
+    def _remember(self, key, data, source):
+        estimate = {field: data[field] for field in FIELDS if field in data and field != 'expiresAt'}
+        estimate['cacheKey'] = key
+        # Never keep an entry in memory past its stored expiry
+        ttl = self._ttl
+        if isinstance(data.get('expiresAt'), datetime):
+            ttl = min(ttl, (data['expiresAt'] - datetime.now(timezone.utc)).total_seconds())
+        with self._lock:
+            self._memory[key] = (time.monotonic() + ttl, estimate)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self._max_entries:
+                self._memory.popitem(last=False)
+        return dict(estimate, source=source)
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['entries'] = len(self._memory)
+        return metrics
+
+
+_estimator = None
+_estimator_lock = threading.Lock()
+
+
+def is_configured():
+    return _estimator is not None or BACKEND in _BACKENDS
+
+
+def get_estimator():
+    global _estimator
+    with _estimator_lock:
+        if _estimator is None:
+            if BACKEND not in _BACKENDS:
+                raise BackendNotConfiguredError(
+                    "No price estimation backend; set GEMINI_API_KEY or PRICE_ESTIMATION_BACKEND"
+                )
+            _estimator = PriceEstimator(_BACKENDS[BACKEND]())
+        return _estimator
+
+
+def stats():
+    """Estimator metrics, or None when no backend is configured."""
+    return get_estimator().stats() if is_configured() else None
+
+
+def set_backend(backend):
+    """Swap the model backend (and start from an empty memory cache)."""
+    global _estimator
+    with _estimator_lock:
+        _estimator = PriceEstimator(backend)
+    logging.info(f"Price estimation backend set to {backend.name}")
@@ -0,0 +1,122 @@
+"""
+Provider profile normalization shared by update_provider_profile and the
+profile backfill job.
+
+``normalize_provider_profile`` applies the defaulting rules for every
+profile field. ``profile_diff`` reduces the result to the fields whose stored
+value actually differs, so callers can skip writes (and the providers update
+trigger) for documents that are already normalized. ``validate_provider_record``
+checks raw records (e.g. from import files) before they are normalized.
+"""
+
+# Profile fields the normalized profile is built from
+SOURCE_FIELDS = [
+    'name', 'company', 'companyName', 'phone', 'phoneNumber', 'location', 'address', 'email',
+    'service_categories', 'service_areas', 'status', 'role', 'verificationStep', 'is_active',
+    'accepting_new_requests', 'referralCode', 'referred_by_user_ids', 'rating', 'thumbs_up_count',
+    'total_jobs_completed', 'hourly_rate', 'response_time_avg', 'availability_status',
+    'emergency_rate_multiplier', 'minimum_charge', 'license_number', 'insurance_verified',
+    'background_check_passed', 'createdAt', 'verifiedAt',
+]
+
+_MISSING = object()
+
+
+def normalize_provider_profile(provider_id, current_data):
+    """Return the complete normalized profile for a provider, preserving existing values."""
+    profile = {
+        # Basic provider information (preserve existing or set defaults)
+        'name': current_data.get('name', 'Sample Provider'),
+        'company': current_data.get('company') or current_data.get('companyName', 'Sample Provider Services'),
+        'phone': current_data.get('phone') or current_data.get('phoneNumber', '(555) 123-4567'),
+        'location': current_data.get('location') or current_data.get('address', '123 Main St, Seattle, WA 98101'),
+        'email': current_data.get('email', 'provider@example.com'),
+
+        # Service information
+        'service_categories': current_data.get('service_categories', ['general', 'handyman', 'maintenance']),
+        'service_areas': current_data.get('service_areas', ['Seattle', 'Bellevue', 'Redmond']),
+
+        # Status and verification (preserve existing status)
+        'status': current_data.get('status', 'verified'),
+        'role': 'provider',
+        'verificationStep': current_data.get('verificationStep', 'completed'),
+        'is_active': current_data.get('is_active', True),
+        'accepting_new_requests': current_data.get('accepting_new_requests', True),
+
+        # Referral system
+        'referralCode': current_data.get('referralCode', f'PROV{provider_id[-4:].upper()}'),
+        'referred_by_user_ids': current_data.get('referred_by_user_ids', []),
+
+        # Performance metrics
+        'rating': current_data.get('rating', '4.5'),
+        'thumbs_up_count': current_data.get('thumbs_up_count', 75),
+        'total_jobs_completed': current_data.get('total_jobs_completed', 50),
+        'hourly_rate': current_data.get('hourly_rate', 85),
+        'response_time_avg': current_data.get('response_time_avg', '1-3 hours'),
+        'availability_status': current_data.get('availability_status', 'available'),
+
+        # Professional details
+        'emergency_rate_multiplier': current_data.get('emergency_rate_multiplier', 1.5),
+        'minimum_charge': current_data.get('minimum_charge', 75),
+        'license_number': current_data.get('license_number', f'LIC{provider_id[-4:].upper()}'),
+        'insurance_verified': current_data.get('insurance_verified', True),
+        'background_check_passed': current_data.get('background_check_passed', True),
+    }
+
+    # Preserve existing timestamps if they exist
+    if 'createdAt' in current_data:
+        profile['createdAt'] = current_data['createdAt']
+    if 'verifiedAt' in current_data:
+        profile['verifiedAt'] = current_data['verifiedAt']
+
+    return profile
+
+
+def profile_diff(current_data, profile):
+    """Return only the fields of ``profile`` whose stored value is missing or different."""
+    return {
+        field: value for field, value in profile.items()
+        if current_data.get(field, _MISSING) != value
+    }
+
+
+VALID_STATUSES = ['pending', 'verified', 'active', 'rejected', 'suspended']
+
+_LIST_FIELDS = ['service_categories', 'service_areas', 'referred_by_user_ids']
+_NUMBER_FIELDS = ['thumbs_up_count', 'total_jobs_completed', 'hourly_rate', 'emergency_rate_multiplier',
+                  'minimum_charge']
+_BOOL_FIELDS = ['is_active', 'accepting_new_requests', 'insurance_verified', 'background_check_passed']
+
+
+def validate_provider_record(record):
+    """Return a list of problems that would keep a raw record from becoming a usable profile."""
+    if not isinstance(record, dict):
+        return ['record is not an object']
+    errors = []
+    if not (record.get('name') or record.get('company') or record.get('companyName')):
+        errors.append('missing name/company')
+    email = record.get('email')
+    if email is not None and (not isinstance(email, str) or '@' not in email):
+        errors.append(f'invalid email: {email!r}')
+    if record.get('status') is not None and record['status'] not in VALID_STATUSES:
+        errors.append(f"invalid status: {record['status']!r}")
+    for field in _LIST_FIELDS:
+        value = record.get(field)
+        if value is not None and not (isinstance(value, list) and all(isinstance(v, str) for v in value)):
+            errors.append(f'{field} must be a list of strings')
+    for field in _NUMBER_FIELDS:
+        value = record.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+            errors.append(f'{field} must be a non-negative number')
+    for field in _BOOL_FIELDS:
+        value = record.get(field)
+        if value is not None and not isinstance(value, bool):
+            errors.append(f'{field} must be true or false')
+    rating = record.get('rating')
+    if rating is not None:
+        try:
+            if not 0 <= float(rating) <= 5:
+                errors.append(f'rating out of range: {rating!r}')
+        except (TypeError, ValueError):
+            errors.append(f'invalid rating: {rating!r}')
+    return errors
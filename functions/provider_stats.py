@@ -0,0 +1,188 @@
+"""
+Sharded counters for provider performance stats.
+
+``thumbs_up_count`` and ``total_jobs_completed`` live on the provider
+profile, where every increment contends on one document and fires the
+providers update trigger. Increments instead go to one of
+``PROVIDER_STATS_SHARDS`` shard documents under the provider:
+
+    providers/{providerId}/stat_shards/{n}
+        thumbs_up_count, total_jobs_completed   pending deltas
+        dirty                                   true until drained
+        updatedAt
+
+``materialize`` periodically drains dirty shards into the profile: one batch
+adds each provider's summed deltas to the profile fields and subtracts them
+from the shards, with an update-time precondition on every shard. If an
+increment lands between the read and the commit, the batch fails as a whole
+and the provider's shards are drained one at a time instead (a shard that
+keeps changing waits for the next run), so no increment is lost or counted
+twice. ``get_stats`` returns profile values plus pending deltas.
+
+Clients never write shards. ``record_review`` counts a review once it has
+checked it against its request: the request must be completed, belong to
+the reviewer and be assigned to the reviewed provider. The request is then
+stamped with ``statsReviewId`` in the same batch as the shard increment, so
+each completed job adds at most one job and one thumbs-up.
+"""
+
+import logging
+import os
+import random
+from collections import defaultdict
+
+from firebase_admin import firestore
+from google.api_core import exceptions as google_exceptions
+
+import firestore_reads
+
+SHARDS_COLLECTION = 'stat_shards'
+
+STAT_FIELDS = ('thumbs_up_count', 'total_jobs_completed')
+
+SHARD_COUNT = int(os.environ.get('PROVIDER_STATS_SHARDS', '10'))
+
+# Attempts at counting a review when its request changes between the read and the write
+RECORD_ATTEMPTS = 3
+
+# Dirty shards read per materialization run
+MATERIALIZE_PAGE_SIZE = 500
+
+
+def shards_collection(db, provider_id):
+    return db.collection('providers').document(provider_id).collection(SHARDS_COLLECTION)
+
+
+def increment(db, provider_id, deltas, batch=None):
+    """
+    Add ``deltas`` ({stat_field: amount}) to a random shard of the provider's counters.
+    With ``batch`` the write is added to it instead of committed.
+    """
+    unknown = set(deltas) - set(STAT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown provider stats: {', '.join(sorted(unknown))}")
+    shard_ref = shards_collection(db, provider_id).document(str(random.randrange(SHARD_COUNT)))
+    data = {field: firestore.Increment(amount) for field, amount in deltas.items() if amount}
+    data['dirty'] = True
+    data['updatedAt'] = firestore.SERVER_TIMESTAMP
+    if batch is not None:
+        batch.set(shard_ref, data, merge=True)
+    else:
+        shard_ref.set(data, merge=True)
+    return shard_ref
+
+
+def review_deltas(review, request):
+    """Stat deltas a review earns its provider, or None if it must not be counted."""
+    provider_id = review.get('providerId')
+    if not provider_id or not request:
+        return None
+    if request.get('status') != 'completed' or request.get('statsReviewId'):
+        return None
+    if request.get('userId') != review.get('userId') or request.get('assignedProviderId') != provider_id:
+        return None
+    return {
+        'total_jobs_completed': 1,
+        'thumbs_up_count': 1 if review.get('serviceExpectationsMet') is True and review.get('wouldRecommend') is True
+        else 0,
+    }
+
+
+def record_review(db, review_id, review):
+    """
+    Count a review toward its provider's stats, once per completed request.
+    Returns the deltas applied, or None if the review does not count (or was already counted).
+    """
+    request_id = review.get('requestId')
+    if not request_id:
+        return None
+    request_ref = db.collection('user_requests').document(request_id)
+    for _attempt in range(RECORD_ATTEMPTS):
+        request_doc = firestore_reads.get_fields(
+            request_ref, ['status', 'userId', 'assignedProviderId', 'statsReviewId']
+        )
+        deltas = review_deltas(review, request_doc.to_dict() if request_doc.exists else None)
+        if deltas is None:
+            return None
+        batch = db.batch()
+        increment(db, review['providerId'], deltas, batch=batch)
+        batch.update(request_ref, {'statsReviewId': review_id},
+                     option=db.write_option(last_update_time=request_doc.update_time))
+        try:
+            batch.commit()
+        except google_exceptions.FailedPrecondition:
+            continue
+        return deltas
+    raise RuntimeError(f"Request {request_id} kept changing; review {review_id} not counted")
+
+
+def _pending_deltas(shard_docs):
+    totals = dict.fromkeys(STAT_FIELDS, 0)
+    for shard_doc in shard_docs:
+        data = shard_doc.to_dict() or {}
+        for field in STAT_FIELDS:
+            totals[field] += data.get(field) or 0
+    return totals
+
+
+def get_stats(db, provider_id):
+    """Current stats: the materialized profile values plus deltas still pending in shards."""
+    profile_future = firestore_reads.submit(
+        firestore_reads.get_fields, db.collection('providers').document(provider_id), STAT_FIELDS
+    )
+    shard_docs = firestore_reads.select_fields(shards_collection(db, provider_id), STAT_FIELDS).get()
+    profile_doc = profile_future.result()
+    profile = profile_doc.to_dict() if profile_doc.exists else {}
+    pending = _pending_deltas(shard_docs)
+    return {field: (profile.get(field) or 0) + pending[field] for field in STAT_FIELDS}
+
+
+def _drain_provider(db, provider_id, shard_docs):
+    """Move one provider's pending deltas onto the profile; False if a shard changed meanwhile."""
+    deltas = _pending_deltas(shard_docs)
+    batch = db.batch()
+    profile_update = {field: firestore.Increment(amount) for field, amount in deltas.items() if amount}
+    if profile_update:
+        profile_update['statsMaterializedAt'] = firestore.SERVER_TIMESTAMP
+        batch.update(db.collection('providers').document(provider_id), profile_update)
+    for shard_doc in shard_docs:
+        data = shard_doc.to_dict() or {}
+        shard_update = {field: firestore.Increment(-data[field]) for field in STAT_FIELDS if data.get(field)}
+        shard_update['dirty'] = False
+        batch.update(shard_doc.reference, shard_update,
+                     option=db.write_option(last_update_time=shard_doc.update_time))
+    try:
+        batch.commit()
+    except google_exceptions.FailedPrecondition:
+        return False
+    return True
+
+
+def materialize(db, max_shards=MATERIALIZE_PAGE_SIZE):
+    """Drain dirty shards into provider profiles. Returns a report of what was applied."""
+    # Clean shards hold no deltas (draining zeroes a shard and clears dirty in the same write)
+    dirty = firestore_reads.select_fields(
+        db.collection_group(SHARDS_COLLECTION).where('dirty', '==', True).limit(max_shards),
+        STAT_FIELDS
+    ).get()
+    by_provider = defaultdict(list)
+    for shard_doc in dirty:
+        by_provider[shard_doc.reference.parent.parent.id].append(shard_doc)
+
+    report = {'dirty_shards': len(dirty), 'providers': len(by_provider), 'materialized': 0,
+              'retry_later': 0, 'missing': 0, 'failed': 0}
+    for provider_id, shard_docs in by_provider.items():
+        try:
+            if _drain_provider(db, provider_id, shard_docs):
+                report['materialized'] += 1
+                continue
+            # A shard moved under us: drain the others one by one so a busy provider still makes progress
+            drained = [_drain_provider(db, provider_id, [shard_doc]) for shard_doc in shard_docs]
+            report['materialized' if any(drained) else 'retry_later'] += 1
+        except google_exceptions.NotFound:
+            logging.warning(f"Provider {provider_id} has stat shards but no profile")
+            report['missing'] += 1
+        except Exception as e:
+            logging.error(f"Error materializing stats for provider {provider_id}: {str(e)}")
+            report['failed'] += 1
+    return report
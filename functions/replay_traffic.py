@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Replay recorded function calls against locally served Cloud Functions.
+
+Accepted inputs (any mix, several files allowed):
+  - function_test_requests.json: {"firebase_function_tests": {name: {url, method, headers, body}}}
+  - JSONL files or captured logs, one call per line:
+        {"function": "submit_bid", "body": {...}, "timestamp": "2025-08-17T18:15:00Z"}
+    "url" may be given instead of "function"; "method" and "headers" are optional.
+  - a single bid payload such as test_bid_response.json (replayed as submit_bid)
+
+Calls are sent at a fixed rate (--rate) or with their recorded inter-arrival
+times (--recorded, optionally sped up), with at most --concurrency in flight.
+The report has latency histograms per function and an error breakdown.
+
+Usage:
+    firebase emulators:start --only functions
+    python replay_traffic.py ../function_test_requests.json --rate 20 --repeat 50
+    python replay_traffic.py prod_calls.jsonl --recorded --speedup 10 --concurrency 64
+"""
+
+import argparse
+import bisect
+import json
+import math
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+
+DEFAULT_BASE_URL = "http://127.0.0.1:5001/magic-home-01/us-central1"
+
+# Upper bounds (ms) of the latency histogram buckets
+HISTOGRAM_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, math.inf]
+
+
+class ReplayCall:
+    def __init__(self, function, body, method='POST', headers=None, timestamp=None):
+        self.function = function
+        self.body = body
+        self.method = method
+        self.headers = headers or {'Content-Type': 'application/json'}
+        self.timestamp = timestamp
+
+
+def _function_from_url(url):
+    """Derive the function name from a cloudfunctions.net or Cloud Run URL."""
+    parsed = urlparse(url)
+    path = parsed.path.strip('/')
+    if path:
+        return path.split('/')[-1]
+    # Cloud Run: https://update-provider-status-24e4euigxq-uc.a.run.app
+    service = parsed.hostname.split('.')[0]
+    return '_'.join(service.split('-')[:-2])
+
+
+def _parse_timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) / 1000.0 if value > 1e11 else float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def _call_from_record(record):
+    """Turn one recorded entry into a ReplayCall, or None if it has no usable call."""
+    function = record.get('function') or record.get('function_name')
+    if not function and record.get('url'):
+        function = _function_from_url(record['url'])
+    body = record.get('body', record.get('payload'))
+    if function and body is not None:
+        return ReplayCall(
+            function,
+            body,
+            method=record.get('method', 'POST'),
+            headers=record.get('headers'),
+            timestamp=_parse_timestamp(record.get('timestamp') or record.get('time')),
+        )
+    # A bare bid payload (test_bid_response.json shape)
+    if 'request_id' in record and 'provider_id' in record and (
+            'bid_amount' in record or 'price_quote' in record):
+        return ReplayCall('submit_bid', {
+            'request_id': record['request_id'],
+            'provider_id': record['provider_id'],
+            'price_quote': record.get('price_quote', record.get('bid_amount')),
+            'availability': record.get('availability', ''),
+            'bid_message': record.get('bid_message', record.get('provider_message', '')),
+        }, timestamp=_parse_timestamp(record.get('bid_timestamp')))
+    return None
+
+
+def load_calls(paths):
+    """Load ReplayCalls from the given files, returning (calls, skipped_count)."""
+    calls = []
+    skipped = 0
+    for path in paths:
+        with open(path, 'r') as f:
+            if path.endswith('.jsonl') or path.endswith('.log'):
+                records = []
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        skipped += 1
+            else:
+                data = json.load(f)
+                if isinstance(data, dict) and 'firebase_function_tests' in data:
+                    records = list(data['firebase_function_tests'].values())
+                elif isinstance(data, list):
+                    records = data
+                else:
+                    records = [data]
+        for record in records:
+            call = _call_from_record(record) if isinstance(record, dict) else None
+            if call is None:
+                skipped += 1
+            else:
+                calls.append(call)
+    return calls, skipped
+
+
+def build_schedule(calls, rate=None, recorded=False, speedup=1.0, repeat=1):
+    """Return [(offset_seconds, call)] sorted by offset."""
+    schedule = []
+    offset = 0.0
+    for _ in range(repeat):
+        timestamps = [c.timestamp for c in calls]
+        use_recorded = recorded and all(t is not None for t in timestamps)
+        first = min(timestamps) if use_recorded else None
+        pass_start = offset
+        for index, call in enumerate(calls):
+            if use_recorded:
+                offset = pass_start + (call.timestamp - first) / speedup
+            elif rate:
+                offset = pass_start + index / rate
+            schedule.append((offset, call))
+        if use_recorded:
+            offset += 1.0 / rate if rate else 0.0
+        elif rate:
+            offset = pass_start + len(calls) / rate
+    schedule.sort(key=lambda item: item[0])
+    return schedule
+
+
+class ReplayStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.histograms = {}
+        self.errors = {}
+        self.outcomes = {}
+
+    def record(self, function, latency_ms, outcome):
+        with self._lock:
+            self.latencies.setdefault(function, []).append(latency_ms)
+            histogram = self.histograms.setdefault(function, [0] * len(HISTOGRAM_BUCKETS_MS))
+            histogram[bisect.bisect_left(HISTOGRAM_BUCKETS_MS, latency_ms)] += 1
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            if outcome != '2xx':
+                key = (function, outcome)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def report(self, wall_seconds):
+        total = sum(len(v) for v in self.latencies.values())
+        lines = [
+            f"Replayed {total} calls in {wall_seconds:.2f}s ({total / wall_seconds if wall_seconds else 0:.1f} req/s)",
+            f"Outcomes: {self.outcomes}",
+            '',
+        ]
+        for function in sorted(self.latencies):
+            values = sorted(self.latencies[function])
+            lines.append(
+                f"{function}: n={len(values)} mean={statistics.fmean(values):.1f}ms "
+                f"p50={_percentile(values, 50):.1f}ms p90={_percentile(values, 90):.1f}ms "
+                f"p99={_percentile(values, 99):.1f}ms max={values[-1]:.1f}ms"
+            )
+            peak = max(self.histograms[function]) or 1
+            lower = 0
+            for bound, count in zip(HISTOGRAM_BUCKETS_MS, self.histograms[function]):
+                if count:
+                    label = f"{lower}-{bound}ms" if bound != math.inf else f">{lower}ms"
+                    lines.append(f"  {label:>14} {count:>7} {'#' * max(1, int(40 * count / peak))}")
+                lower = bound
+            lines.append('')
+        if self.errors:
+            lines.append('Errors:')
+            for (function, outcome), count in sorted(self.errors.items(), key=lambda item: -item[1]):
+                lines.append(f"  {function:<32} {outcome:<28} {count}")
+        return '\n'.join(lines)
+
+    def to_dict(self, wall_seconds):
+        return {
+            'wall_seconds': wall_seconds,
+            'outcomes': self.outcomes,
+            'functions': {
+                function: {
+                    'count': len(values),
+                    'p50_ms': _percentile(sorted(values), 50),
+                    'p90_ms': _percentile(sorted(values), 90),
+                    'p99_ms': _percentile(sorted(values), 99),
+                    'histogram': dict(zip(
+                        [str(b) for b in HISTOGRAM_BUCKETS_MS], self.histograms[function])),
+                }
+                for function, values in self.latencies.items()
+            },
+            'errors': [
+                {'function': function, 'outcome': outcome, 'count': count}
+                for (function, outcome), count in self.errors.items()
+            ],
+        }
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def send_call(base_url, call, timeout):
+    """Send one call and return (latency_ms, outcome)."""
+    url = f"{base_url.rstrip('/')}/{call.function}"
+    data = json.dumps(call.body).encode('utf-8') if call.method != 'GET' else None
+    request = urllib.request.Request(url, data=data, method=call.method, headers=call.headers)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            outcome = f"{response.status // 100}xx"
+    except urllib.error.HTTPError as e:
+        outcome = f"HTTP {e.code}"
+    except urllib.error.URLError as e:
+        outcome = f"URLError: {e.reason}"
+    except Exception as e:
+        outcome = type(e).__name__
+    return (time.perf_counter() - start) * 1000.0, outcome
+
+
+def replay(schedule, base_url, concurrency, timeout):
+    stats = ReplayStats()
+    in_flight = threading.Semaphore(concurrency)
+
+    def worker(call):
+        try:
+            latency_ms, outcome = send_call(base_url, call, timeout)
+            stats.record(call.function, latency_ms, outcome)
+        finally:
+            in_flight.release()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for offset, call in schedule:
+            wait = offset - (time.perf_counter() - start)
+            if wait > 0:
+                time.sleep(wait)
+            in_flight.acquire()
+            executor.submit(worker, call)
+    return stats, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded requests against local Cloud Functions')
+    parser.add_argument('files', nargs='+', help='Recorded request files (.json, .jsonl, .log)')
+    parser.add_argument('--base-url', default=DEFAULT_BASE_URL, help='Functions base URL (emulator by default)')
+    parser.add_argument('--rate', type=float, default=None, help='Fixed send rate in requests/second (default: as fast as concurrency allows)')
+    parser.add_argument('--recorded', action='store_true', help='Use recorded inter-arrival times')
+    parser.add_argument('--speedup', type=float, default=1.0, help='Divide recorded gaps by this factor')
+    parser.add_argument('--repeat', type=int, default=1, help='Replay the corpus this many times')
+    parser.add_argument('--concurrency', type=int, default=16, help='Maximum requests in flight')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds')
+    parser.add_argument('--only', action='append', help='Replay only the named function (repeatable)')
+    parser.add_argument('--json-report', help='Also write the report as JSON to this path')
+    args = parser.parse_args()
+
+    calls, skipped = load_calls(args.files)
+    if args.only:
+        calls = [c for c in calls if c.function in args.only]
+    if not calls:
+        print("No replayable calls found")
+        return
+    print(f"Loaded {len(calls)} calls ({skipped} records skipped)")
+
+    schedule = build_schedule(calls, rate=args.rate, recorded=args.recorded,
+                              speedup=args.speedup, repeat=args.repeat)
+    stats, wall_seconds = replay(schedule, args.base_url, args.concurrency, args.timeout)
+    print(stats.report(wall_seconds))
+
+    if args.json_report:
+        with open(args.json_report, 'w') as f:
+            json.dump(stats.to_dict(wall_seconds), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
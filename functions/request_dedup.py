@@ -0,0 +1,226 @@
+"""
+Near-duplicate detection for user requests before bidding fan-out.
+
+A request is fingerprinted as a MinHash signature over character shingles of
+its normalized description. Signatures are compared only within a scope:
+the same user, service category and normalized address. For locality-
+sensitive hashing the signature is cut into LSH_BANDS bands; each band,
+salted with the scope, becomes a band key. Two requests that share any band
+key are candidates, and a candidate whose estimated Jaccard similarity
+reaches SIMILARITY_THRESHOLD within DUPLICATE_WINDOW_MINUTES is a duplicate.
+
+Each warm instance keeps recent fingerprints in memory, so a repeat it has
+seen costs no reads. Every instance registers fingerprints in a compact
+Firestore store:
+
+    request_signatures/{requestId}
+        userId, scope, bandKeys[LSH_BANDS], signature (packed bytes), createdAt
+
+A memory miss falls back to one array-contains-any query on bandKeys,
+limited to fingerprints created inside the window, newest first.
+"""
+
+import hashlib
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+import firestore_reads
+from text_normalize import normalize
+
+SIGNATURES_COLLECTION = 'request_signatures'
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+
+SHINGLE_SIZE = 5
+
+SIMILARITY_THRESHOLD = float(os.environ.get('DUPLICATE_SIMILARITY_THRESHOLD', '0.8'))
+DUPLICATE_WINDOW_MINUTES = int(os.environ.get('DUPLICATE_WINDOW_MINUTES', '30'))
+
+# Fingerprints kept per instance (oldest dropped first)
+MEMORY_INDEX_SIZE = 5000
+
+# Signatures read from the store on a memory miss
+STORE_CANDIDATE_LIMIT = 20
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _permutations():
+    # Fixed coefficients, so every instance computes identical signatures
+    coefficients = []
+    for i in range(NUM_PERMUTATIONS):
+        digest = hashlib.sha256(f'minhash-{i}'.encode()).digest()
+        a, b = struct.unpack('>QQ', digest[:16])
+        coefficients.append((a % (_MERSENNE_PRIME - 1) + 1, b % _MERSENNE_PRIME))
+    return coefficients
+
+
+_PERMUTATIONS = _permutations()
+
+
+def shingles(text):
+    text = normalize(text)
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def signature(text):
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), 'big')
+              for shingle in shingles(text)]
+    if not hashes:
+        return [_MAX_HASH] * NUM_PERMUTATIONS
+    return [min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return sum(1 for x, y in zip(signature_a, signature_b) if x == y) / NUM_PERMUTATIONS
+
+
+def scope_key(request_data):
+    address = request_data.get('address') or ''
+    if not address and isinstance(request_data.get('location'), dict):
+        address = request_data['location'].get('address', '')
+    raw = '|'.join([request_data.get('userId', ''), request_data.get('serviceCategory', ''), normalize(address)])
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def band_keys(scope, request_signature):
+    keys = []
+    for band in range(LSH_BANDS):
+        rows = request_signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        keys.append(hashlib.sha1(f"{scope}:{band}:{','.join(map(str, rows))}".encode()).hexdigest()[:20])
+    return keys
+
+
+def pack(request_signature):
+    return struct.pack(f'>{NUM_PERMUTATIONS}I', *request_signature)
+
+
+def unpack(packed):
+    return list(struct.unpack(f'>{NUM_PERMUTATIONS}I', bytes(packed)))
+
+
+class Fingerprint:
+    def __init__(self, request_id, request_data):
+        self.request_id = request_id
+        self.user_id = request_data.get('userId', '')
+        self.scope = scope_key(request_data)
+        self.signature = signature(request_data.get('description', ''))
+        self.band_keys = band_keys(self.scope, self.signature)
+
+    def record(self):
+        return {
+            'userId': self.user_id,
+            'scope': self.scope,
+            'bandKeys': self.band_keys,
+            'signature': pack(self.signature),
+            'createdAt': firestore.SERVER_TIMESTAMP,
+        }
+
+
+class DuplicateIndex:
+    """Per-instance LSH index of recent fingerprints."""
+
+    def __init__(self, size=MEMORY_INDEX_SIZE):
+        self._size = size
+        self._entries = {}  # request_id -> (monotonic time added, scope, signature, band keys)
+        self._bands = {}    # band key -> set of request ids
+        self._lock = threading.Lock()
+
+    def add(self, request_id, scope, request_signature, keys, added_at=None):
+        with self._lock:
+            if request_id in self._entries:
+                return
+            self._entries[request_id] = (added_at if added_at is not None else time.monotonic(), scope,
+                                         request_signature, keys)
+            for key in keys:
+                self._bands.setdefault(key, set()).add(request_id)
+            while len(self._entries) > self._size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, request_id):
+        _added_at, _scope, _signature, keys = self._entries.pop(request_id)
+        for key in keys:
+            members = self._bands.get(key)
+            if members is not None:
+                members.discard(request_id)
+                if not members:
+                    del self._bands[key]
+
+    def find(self, fingerprint, window_seconds):
+        """Best (request_id, similarity) match for ``fingerprint`` in the window, or None."""
+        cutoff = time.monotonic() - window_seconds
+        with self._lock:
+            candidates = set()
+            for key in fingerprint.band_keys:
+                candidates |= self._bands.get(key, set())
+            best = None
+            for request_id in candidates:
+                added_at, scope, request_signature, _keys = self._entries[request_id]
+                if request_id == fingerprint.request_id or scope != fingerprint.scope or added_at < cutoff:
+                    continue
+                score = similarity(fingerprint.signature, request_signature)
+                if score >= SIMILARITY_THRESHOLD and (best is None or score > best[1]):
+                    best = (request_id, score)
+            return best
+
+
+_index = DuplicateIndex()
+
+
+def get_index():
+    return _index
+
+
+def find_duplicate(db, fingerprint, window_minutes=DUPLICATE_WINDOW_MINUTES):
+    """
+    Return (original_request_id, similarity) for a recent near-duplicate of ``fingerprint``, or None.
+    Checks this instance's index first, then the signature store.
+    """
+    match = _index.find(fingerprint, window_minutes * 60)
+    if match:
+        return match
+
+    since = datetime.now(timezone.utc) - timedelta(minutes=window_minutes)
+    # Newest candidates inside the window first, so older band-key matches cannot crowd them out
+    query = (db.collection(SIGNATURES_COLLECTION)
+             .where('bandKeys', 'array_contains_any', fingerprint.band_keys)
+             .where('createdAt', '>=', since)
+             .order_by('createdAt', direction=firestore.Query.DESCENDING)
+             .limit(STORE_CANDIDATE_LIMIT))
+    best = None
+    for snapshot in firestore_reads.select_fields(query, ['scope', 'signature', 'bandKeys', 'createdAt']).stream():
+        if snapshot.id == fingerprint.request_id:
+            continue
+        data = snapshot.to_dict()
+        created_at = data.get('createdAt')
+        if data.get('scope') != fingerprint.scope or created_at is None or created_at < since:
+            continue
+        request_signature = unpack(data['signature'])
+        age = (datetime.now(timezone.utc) - created_at).total_seconds()
+        _index.add(snapshot.id, data['scope'], request_signature, data.get('bandKeys', []),
+                   added_at=time.monotonic() - age)
+        score = similarity(fingerprint.signature, request_signature)
+        if score >= SIMILARITY_THRESHOLD and (best is None or score > best[1]):
+            best = (snapshot.id, score)
+    return best
+
+
+def register(db, fingerprint, batch=None):
+    """Store a fingerprint (and index it locally) once its request has fanned out."""
+    ref = db.collection(SIGNATURES_COLLECTION).document(fingerprint.request_id)
+    if batch is not None:
+        batch.set(ref, fingerprint.record())
+    else:
+        ref.set(fingerprint.record())
+    _index.add(fingerprint.request_id, fingerprint.scope, fingerprint.signature, fingerprint.band_keys)
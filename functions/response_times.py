@@ -0,0 +1,241 @@
+"""
+Provider response-time statistics: how long a provider takes to bid after
+being notified of a request.
+
+Bidding fan-outs record when each provider was notified, one document per
+request (``bid_notification_marks/{requestId}.notifiedAt.{providerId}``,
+plus ``broadcastAt`` once a topic broadcast for it went out). The same marks
+let a retried fan-out skip whoever it already reached.
+When a bid is created, its latency is folded into the provider's compact
+stats document:
+
+    provider_response_stats/{providerId}
+        count, sumSeconds, minSeconds, maxSeconds
+        ewmaSeconds          exponentially weighted mean (RESPONSE_TIME_EWMA_ALPHA)
+        sketch               {bucket: count} log-bucketed histogram for quantiles
+        dirty, lastBidAt, updatedAt
+
+The sketch buckets latencies geometrically (each bucket RELATIVE_ACCURACY
+wide, relative to its value), so p50/p90 come out within that accuracy from
+at most MAX_BUCKETS counters, without keeping any bid history. The
+materialize step copies a summary onto the provider profile
+(``responseTime`` and a readable ``response_time_avg``) so matching can
+rank on it without extra reads.
+"""
+
+import logging
+import math
+import os
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+from google.api_core import exceptions as google_exceptions
+from google.cloud.firestore_v1.field_path import FieldPath
+
+import fcm_sender
+import firestore_reads
+
+MARKS_COLLECTION = 'bid_notification_marks'
+STATS_COLLECTION = 'provider_response_stats'
+
+EWMA_ALPHA = float(os.environ.get('RESPONSE_TIME_EWMA_ALPHA', '0.2'))
+
+# Quantiles are exact to within this fraction of their value
+RELATIVE_ACCURACY = 0.05
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+
+# Lowest buckets are merged once a sketch grows past this many
+MAX_BUCKETS = 128
+
+# Latencies are clamped to at least this (sub-second bids are test traffic)
+MIN_SECONDS = 1.0
+
+# Dirty stats documents summarized per materialization run
+MATERIALIZE_PAGE_SIZE = 300
+
+
+def record_notifications(db, request_id, provider_ids, broadcast=False):
+    """Record that ``provider_ids`` (and the broadcast, if set) were just notified about ``request_id`` (one write)."""
+    provider_ids = list(dict.fromkeys(provider_ids))
+    if not provider_ids and not broadcast:
+        return
+    marks = {'updatedAt': firestore.SERVER_TIMESTAMP}
+    if provider_ids:
+        marks['notifiedAt'] = {provider_id: firestore.SERVER_TIMESTAMP for provider_id in provider_ids}
+    if broadcast:
+        marks['broadcastAt'] = firestore.SERVER_TIMESTAMP
+    db.collection(MARKS_COLLECTION).document(request_id).set(marks, merge=True)
+
+
+def _reached(future):
+    response = fcm_sender.job_response(future) if future.done() else None
+    return response is not None and response.success_count > 0
+
+
+def record_notification_jobs(db, request_id, jobs, broadcast_job=None):
+    """
+    Record the providers reached by finished scheduler jobs, a list of (provider_id, devices, future),
+    and whether the ``broadcast_job`` future sent anything.
+    """
+    reached = [provider_id for provider_id, _devices, future in jobs if _reached(future)]
+    try:
+        record_notifications(db, request_id, reached,
+                             broadcast=broadcast_job is not None and _reached(broadcast_job))
+    except Exception as e:
+        logging.error(f"Error recording notification times for request {request_id}: {str(e)}")
+
+
+def notified_at(db, request_id, provider_id):
+    """When ``provider_id`` was last notified about ``request_id``, or None."""
+    field = FieldPath('notifiedAt', provider_id)
+    snapshot = firestore_reads.get_fields(
+        db.collection(MARKS_COLLECTION).document(request_id), [field.to_api_repr()]
+    )
+    if not snapshot.exists:
+        return None
+    return (snapshot.to_dict().get('notifiedAt') or {}).get(provider_id)
+
+
+def already_notified(db, request_id):
+    """Providers already notified about ``request_id`` and whether its broadcast went out."""
+    snapshot = firestore_reads.get_fields(
+        db.collection(MARKS_COLLECTION).document(request_id), ['notifiedAt', 'broadcastAt']
+    )
+    if not snapshot.exists:
+        return set(), False
+    marks = snapshot.to_dict()
+    return set(marks.get('notifiedAt') or {}), marks.get('broadcastAt') is not None
+
+
+def bucket_index(seconds):
+    return math.ceil(math.log(max(seconds, MIN_SECONDS)) / math.log(GAMMA))
+
+
+def bucket_value(index):
+    """Representative latency of a bucket (its midpoint in relative terms)."""
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+def add_to_sketch(sketch, seconds):
+    sketch = dict(sketch or {})
+    key = str(bucket_index(seconds))
+    sketch[key] = sketch.get(key, 0) + 1
+    if len(sketch) > MAX_BUCKETS:
+        keys = sorted(sketch, key=int)
+        overflow = keys[:len(keys) - MAX_BUCKETS + 1]
+        merged = sum(sketch.pop(k) for k in overflow)
+        sketch[overflow[-1]] = merged
+    return sketch
+
+
+def quantile(sketch, q):
+    total = sum((sketch or {}).values())
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for key in sorted(sketch, key=int):
+        seen += sketch[key]
+        if seen > rank:
+            return bucket_value(int(key))
+    return bucket_value(int(max(sketch, key=int)))
+
+
+def add_sample(stats, seconds, bid_at=None):
+    """Return ``stats`` (possibly empty) with one more latency sample folded in."""
+    stats = stats or {}
+    seconds = max(float(seconds), MIN_SECONDS)
+    count = stats.get('count', 0) + 1
+    previous_ewma = stats.get('ewmaSeconds')
+    return {
+        'count': count,
+        'sumSeconds': stats.get('sumSeconds', 0.0) + seconds,
+        'minSeconds': seconds if stats.get('minSeconds') is None else min(stats['minSeconds'], seconds),
+        'maxSeconds': seconds if stats.get('maxSeconds') is None else max(stats['maxSeconds'], seconds),
+        'ewmaSeconds': seconds if previous_ewma is None else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * previous_ewma,
+        'sketch': add_to_sketch(stats.get('sketch'), seconds),
+        'lastBidAt': bid_at,
+        'dirty': True,
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }
+
+
+def summarize(stats):
+    """Profile-sized summary of a stats document, in minutes."""
+    def minutes(seconds):
+        return round(seconds / 60, 1) if seconds is not None else None
+    return {
+        'samples': stats.get('count', 0),
+        'ewmaMinutes': minutes(stats.get('ewmaSeconds')),
+        'p50Minutes': minutes(quantile(stats.get('sketch'), 0.5)),
+        'p90Minutes': minutes(quantile(stats.get('sketch'), 0.9)),
+    }
+
+
+def describe(summary):
+    """Readable form for ``response_time_avg``, e.g. 'within 25 minutes'."""
+    minutes = summary.get('p50Minutes')
+    if minutes is None:
+        return None
+    if minutes < 1:
+        return 'within a minute'
+    if minutes < 90:
+        return f'within {round(minutes)} minutes'
+    hours = minutes / 60
+    if hours < 36:
+        return f'within {round(hours)} hours'
+    return f'within {round(hours / 24)} days'
+
+
+@firestore.transactional
+def _record_sample(transaction, stats_ref, seconds, bid_at):
+    snapshot = stats_ref.get(transaction=transaction)
+    stats = add_sample(snapshot.to_dict() if snapshot.exists else None, seconds, bid_at)
+    transaction.set(stats_ref, stats)
+    return stats
+
+
+def record_bid(db, provider_id, request_id, bid_at=None):
+    """
+    Fold the latency of a provider's bid into its stats.
+    Returns the latency in seconds, or None when there is no notification to measure from.
+    """
+    sent_at = notified_at(db, request_id, provider_id)
+    if sent_at is None:
+        return None
+    bid_at = bid_at or datetime.now(timezone.utc)
+    if bid_at.tzinfo is None:
+        bid_at = bid_at.replace(tzinfo=timezone.utc)
+    seconds = (bid_at - sent_at).total_seconds()
+    if seconds < 0:
+        logging.warning(f"Bid by {provider_id} on {request_id} predates its notification; skipped")
+        return None
+    _record_sample(db.transaction(), db.collection(STATS_COLLECTION).document(provider_id), seconds, bid_at)
+    return seconds
+
+
+def materialize(db, max_docs=MATERIALIZE_PAGE_SIZE):
+    """Copy summaries of changed stats onto provider profiles. Returns the number of profiles updated."""
+    dirty = db.collection(STATS_COLLECTION).where('dirty', '==', True).limit(max_docs).get()
+    updated = 0
+    for snapshot in dirty:
+        summary = summarize(snapshot.to_dict())
+        profile_update = {'responseTime': summary}
+        description = describe(summary)
+        if description:
+            profile_update['response_time_avg'] = description
+        batch = db.batch()
+        batch.update(db.collection('providers').document(snapshot.id), profile_update)
+        # Only clear the flag if no bid was folded in since this read
+        batch.update(snapshot.reference, {'dirty': False},
+                     option=db.write_option(last_update_time=snapshot.update_time))
+        try:
+            batch.commit()
+            updated += 1
+        except google_exceptions.FailedPrecondition:
+            continue
+        except google_exceptions.NotFound:
+            # The provider is gone; drop its stats so they stop taking up every run's page
+            logging.warning(f"Deleting response stats of missing provider {snapshot.id}")
+            snapshot.reference.delete()
+    return updated
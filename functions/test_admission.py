@@ -0,0 +1,81 @@
+"""
+Behaviour of admission control: caller identity, per caller rate and
+concurrency limits, and the instance-wide in-flight cap.
+
+Usage: python -m pytest test_admission.py
+"""
+
+import threading
+
+import pytest
+from firebase_functions import https_fn
+from flask import Request
+from werkzeug.test import EnvironBuilder
+
+import admission
+
+
+def _request(body=None, headers=None, remote_addr='10.0.0.1'):
+    builder = EnvironBuilder(method='POST', json=body or {}, headers=headers or {},
+                             environ_base={'REMOTE_ADDR': remote_addr})
+    return Request(builder.get_environ())
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    controller = admission.AdmissionController(max_in_flight=2, queue_timeout=0)
+    monkeypatch.setattr(admission, '_controller', controller)
+    monkeypatch.setattr(admission, 'ENABLED', True)
+    return controller
+
+
+def test_caller_is_the_bearer_token_or_the_connection_address():
+    token_key = admission.caller_key(_request(headers={'Authorization': 'Bearer abc'}))
+    assert token_key.startswith('token:') and 'abc' not in token_key
+    assert token_key == admission.caller_key(_request(headers={'Authorization': 'Bearer abc'}, remote_addr='10.0.0.9'))
+    assert admission.caller_key(_request()) == 'ip:10.0.0.1'
+
+
+def test_client_supplied_ids_do_not_change_the_caller():
+    spoofed = _request({'provider_id': 'prov_123', 'user_id': 'user_9'},
+                       headers={'X-Forwarded-For': '203.0.113.7'})
+    assert admission.caller_key(spoofed) == 'ip:10.0.0.1'
+
+
+def test_rate_limit_rejects_past_the_burst(controller):
+    handler = admission.limit('admin')(lambda req: https_fn.Response('ok'))
+    statuses = [handler(_request({'provider_id': f'prov_{i}'})).status_code for i in range(3)]
+    assert statuses == [200, 200, 429]
+    assert controller.stats()['policies']['admin']['rejected_rate'] == 1
+    # Another caller has its own bucket
+    assert handler(_request(remote_addr='10.0.0.2')).status_code == 200
+
+
+def test_per_caller_concurrency_and_overload(controller):
+    assert controller.try_admit('fanout', 'ip:a') is None
+    assert controller.try_admit('fanout', 'ip:a')[0] == 'concurrency'
+    assert controller.try_admit('default', 'ip:b') is None
+    # Both instance slots are taken and the queue timeout is zero
+    assert controller.try_admit('default', 'ip:c')[0] == 'overload'
+    controller.release('fanout', 'ip:a')
+    assert controller.try_admit('default', 'ip:c') is None
+    assert controller.stats()['in_flight'] == 2
+
+
+def test_rejection_carries_retry_after(controller):
+    started, finish = threading.Event(), threading.Event()
+
+    def slow(req):
+        started.set()
+        finish.wait(5)
+        return https_fn.Response('ok')
+
+    handler = admission.limit('fanout')(slow)
+    worker = threading.Thread(target=handler, args=(_request(),))
+    worker.start()
+    started.wait(5)
+    rejected = handler(_request())
+    finish.set()
+    worker.join()
+    assert rejected.status_code == 429
+    assert int(rejected.headers['Retry-After']) >= 1
@@ -0,0 +1,86 @@
+"""
+Behaviour of hot/cold archival against the in-memory fakes: finished
+requests become tombstones, live requests keep their bids, and reruns
+are idempotent.
+
+Usage: python -m pytest test_archival.py
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import archival
+import fake_firebase
+
+OLD = datetime.now(timezone.utc) - timedelta(days=archival.ARCHIVE_AFTER_DAYS + 5)
+
+
+@pytest.fixture
+def db():
+    backend = fake_firebase.install(latency_ms=0, failure_rate=0, seed=1)
+    yield backend.db
+    fake_firebase.uninstall()
+
+
+def _seed_request(db, request_id, status, bid_count=2, session_status='completed'):
+    db.seed('user_requests', {request_id: {
+        'userId': 'user_1', 'serviceCategory': 'plumbing', 'description': 'Leaky faucet',
+        'status': status, 'createdAt': OLD, 'selectedBidId': f'{request_id}_bid_0',
+        'internalNotes': 'not needed by the app',
+    }})
+    bids = {f'{request_id}_bid_{i}': {'requestId': request_id, 'providerId': f'prov_{i}', 'priceQuote': 100 + i}
+            for i in range(bid_count)}
+    db.seed('service_bids', bids)
+    db.seed('bidding_sessions', {f'{request_id}_session': {
+        'requestId': request_id, 'userId': 'user_1', 'sessionStatus': session_status,
+        'createdAt': OLD, 'deadline': OLD, 'receivedBids': list(bids),
+    }})
+
+
+def test_finished_request_becomes_a_tombstone_that_keeps_its_status(db):
+    _seed_request(db, 'req_done', 'completed')
+    report = archival.run(db)
+    assert (report['requests'], report['sessions'], report['bids']) == (1, 1, 2)
+
+    tombstone = db.dump('user_requests')['req_done']
+    assert tombstone['status'] == 'completed' and tombstone['archived'] is True
+    assert tombstone['selectedBidId'] == 'req_done_bid_0'
+    assert 'internalNotes' not in tombstone
+    assert not db.dump('bidding_sessions') and not db.dump('service_bids')
+
+    archived = db.dump(archival.ARCHIVED_REQUESTS_COLLECTION)['req_done']
+    assert archival.unpack(archived['blob'])['internalNotes'] == 'not needed by the app'
+    [session] = archival.find_archived_sessions(db, 'req_done')
+    assert sorted(session['bids']) == ['req_done_bid_0', 'req_done_bid_1']
+
+
+def test_live_requests_keep_their_sessions_and_bids(db):
+    _seed_request(db, 'req_live', 'assigned')
+    _seed_request(db, 'req_bidding', 'pending', session_status='active')
+    report = archival.run(db)
+    assert report['skipped_live'] == 2 and report['sessions'] == 0
+    assert len(db.dump('bidding_sessions')) == 2
+    assert len(db.dump('service_bids')) == 4
+
+
+def test_sessions_of_missing_requests_are_archived_alone(db):
+    _seed_request(db, 'req_gone', 'completed')
+    db.document('user_requests/req_gone').delete()
+    report = archival.run(db)
+    assert (report['requests'], report['sessions'], report['bids']) == (0, 1, 2)
+    assert 'req_gone' not in db.dump('user_requests')
+
+
+def test_rerun_and_run_limits(db):
+    for i in range(3):
+        _seed_request(db, f'req_{i}', 'cancelled', bid_count=1)
+    first = archival.run(db, max_items=2)
+    assert first['requests'] == 1
+    archival.run(db)
+    assert len(db.dump(archival.ARCHIVED_REQUESTS_COLLECTION)) == 3
+
+    tombstones = db.dump('user_requests')
+    again = archival.run(db)
+    assert again == {'requests': 0, 'sessions': 0, 'bids': 0, 'skipped_live': 0, 'failed': 0}
+    assert db.dump('user_requests') == tombstones
@@ -0,0 +1,91 @@
+"""
+End-to-end check of wave fan-out against the in-memory fakes:
+bids submitted through submit_bid must count toward the wave target.
+
+Usage: python -m pytest test_bidding_waves.py
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import fake_firebase
+from bench_functions import make_change_event, make_request, new_matched_request, seed
+
+
+@pytest.fixture
+def backend():
+    backend = fake_firebase.install(latency_ms=0, failure_rate=0, fcm_latency_ms=0, fcm_failure_rate=0, seed=1)
+    import main
+    main.admission.ENABLED = False
+    yield backend, main
+    main.admission.ENABLED = True
+    fake_firebase.uninstall()
+
+
+def _start_session(db, main, provider_ids):
+    request_id = new_matched_request(db, provider_ids)
+    data = db.dump('user_requests')[request_id]
+    event = make_change_event(db, f'user_requests/{request_id}', {**data, 'status': 'pending'}, data,
+                              {'request_id': request_id})
+    main.initiate_bidding_session.__wrapped__(event)
+    session_id = next(sid for sid, s in db.dump('bidding_sessions').items() if s['requestId'] == request_id)
+    return request_id, session_id
+
+
+def _make_wave_due(db, session_id):
+    session = db.dump('bidding_sessions')[session_id]
+    session['waveState']['nextWaveAt'] = datetime.now(timezone.utc) - timedelta(seconds=1)
+    db.seed('bidding_sessions', {session_id: session})
+
+
+def _bid(main, request_id, provider_id):
+    return main.submit_bid.__wrapped__(make_request({
+        'request_id': request_id,
+        'provider_id': provider_id,
+        'price_quote': 150,
+        'availability': 'Available today',
+        'bid_message': 'Happy to help.',
+    }))
+
+
+def test_bids_after_the_first_reach_the_wave_target(backend):
+    fake, main = backend
+    db = fake.db
+    provider_ids = seed(db, 12, 1)
+    request_id, session_id = _start_session(db, main, provider_ids)
+    first_wave = db.dump('bidding_sessions')[session_id]['notifiedProviders']
+    assert len(first_wave) == 5
+
+    for provider_id in first_wave[:3]:
+        assert _bid(main, request_id, provider_id).status_code == 200
+    assert db.dump('user_requests')[request_id]['status'] == 'bidding'
+
+    _make_wave_due(db, session_id)
+    main.advance_bidding_waves.__wrapped__(None)
+
+    session = db.dump('bidding_sessions')[session_id]
+    assert session['bidAggregates']['count'] == 3
+    assert session['waveState']['active'] is False
+    assert session['waveState']['completedReason'] == 'target_bids'
+    assert session['notifiedProviders'] == first_wave
+
+
+def test_next_wave_goes_out_while_bids_are_short(backend):
+    fake, main = backend
+    db = fake.db
+    provider_ids = seed(db, 12, 1)
+    request_id, session_id = _start_session(db, main, provider_ids)
+    first_wave = db.dump('bidding_sessions')[session_id]['notifiedProviders']
+
+    assert _bid(main, request_id, first_wave[0]).status_code == 200
+
+    _make_wave_due(db, session_id)
+    main.advance_bidding_waves.__wrapped__(None)
+
+    session = db.dump('bidding_sessions')[session_id]
+    assert len(session['notifiedProviders']) == 10
+    assert session['waveState']['wave'] == 2
+
+    # A provider from the second wave can still bid once the request is in 'bidding'
+    assert _bid(main, request_id, session['notifiedProviders'][-1]).status_code == 200
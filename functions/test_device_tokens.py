@@ -0,0 +1,92 @@
+"""
+Behaviour of the device-token registry against the in-memory fakes:
+registration, moves between owners, legacy token fallback and pruning.
+
+Usage: python -m pytest test_device_tokens.py
+"""
+
+import pytest
+from firebase_admin import messaging
+
+import device_tokens
+import fake_firebase
+import fcm_topics
+
+PROVIDER = {
+    'companyName': 'Pipes Inc',
+    'status': 'verified',
+    'service_categories': ['plumbing'],
+    'service_areas': ['Seattle'],
+}
+
+
+@pytest.fixture
+def backend():
+    backend = fake_firebase.install(latency_ms=0, failure_rate=0, seed=1)
+    backend.db.seed('providers', {
+        'prov_1': dict(PROVIDER, fcmTokens=['legacy_token']),
+        'prov_2': dict(PROVIDER, service_categories=['electrical']),
+    })
+    yield backend
+    fake_firebase.uninstall()
+
+
+def _devices(db, owner_collection, owner_id):
+    return db.dump(f'{owner_collection}/{owner_id}/{device_tokens.DEVICES_COLLECTION}')
+
+
+def test_refreshing_a_token_keeps_one_device(backend):
+    db = backend.db
+    device_tokens.register(db, 'providers', 'prov_1', 'token_a', 'ios', '1.0.0')
+    device_tokens.register(db, 'providers', 'prov_1', 'token_a', 'ios', '1.1.0')
+    devices = _devices(db, 'providers', 'prov_1')
+    assert list(devices) == [device_tokens.device_id('token_a')]
+    assert devices[device_tokens.device_id('token_a')]['appVersion'] == '1.1.0'
+
+
+def test_registry_devices_come_first_and_legacy_tokens_fill_in(backend):
+    db = backend.db
+    device_tokens.register(db, 'providers', 'prov_1', 'token_a', 'android')
+    devices = device_tokens.load_devices(db, 'providers', ['prov_1', 'prov_2'], {
+        'prov_1': ['legacy_token', 'token_a'],
+    })
+    assert [(device.token, device.platform) for device in devices['prov_1']] == [
+        ('token_a', 'android'), ('legacy_token', 'unknown')]
+    assert devices['prov_2'] == []
+
+
+def test_messages_only_carry_the_platform_config_they_need():
+    apns = messaging.APNSConfig()
+    android = messaging.AndroidConfig()
+    ios_message = device_tokens.build_message(device_tokens.Device('t', 'ios'), apns=apns, android=android)
+    assert ios_message.apns is apns and ios_message.android is None
+    legacy_message = device_tokens.build_message(device_tokens.Device('t'), apns=apns, android=android)
+    assert legacy_message.apns is apns and legacy_message.android is android
+
+
+def test_moved_token_leaves_the_previous_providers_topics(backend):
+    db = backend.db
+    device_tokens.register(db, 'providers', 'prov_1', 'token_a', 'ios')
+    fcm_topics.sync_provider_subscriptions('prov_1', None, PROVIDER, ['token_a'])
+    assert 'token_a' in backend.messaging.topics['bidding_plumbing_seattle']
+
+    device_tokens.register(db, 'providers', 'prov_2', 'token_a', 'ios')
+    assert 'token_a' not in backend.messaging.topics['bidding_plumbing_seattle']
+    assert _devices(db, 'providers', 'prov_1') == {}
+    assert device_tokens.device_id('token_a') in _devices(db, 'providers', 'prov_2')
+
+
+def test_unregistered_tokens_are_pruned(backend):
+    db = backend.db
+    device_tokens.register(db, 'providers', 'prov_1', 'token_a', 'ios')
+    devices = device_tokens.load_devices(db, 'providers', ['prov_1'],
+                                         {'prov_1': ['legacy_token']})['prov_1']
+    gone = messaging.SendResponse(None, messaging.UnregisteredError('Token is gone'))
+    flaky = messaging.SendResponse(None, messaging.QuotaExceededError('Slow down'))
+
+    pruner = device_tokens.FailurePruner(db)
+    pruner.add('providers', 'prov_1', devices, messaging.BatchResponse([flaky, gone]))
+    pruner.commit()
+    assert pruner.removed == 1
+    assert db.dump('providers')['prov_1']['fcmTokens'] == []
+    assert _devices(db, 'providers', 'prov_1')[device_tokens.device_id('token_a')]['failureCount'] == 1
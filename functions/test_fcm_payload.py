@@ -0,0 +1,51 @@
+"""
+Behaviour of FCM payload compaction and fitting: byte budgets, shrinking
+oversized messages and skipping ones that cannot fit.
+
+Usage: python -m pytest test_fcm_payload.py
+"""
+
+import pytest
+from firebase_admin import messaging
+
+import fcm_payload
+
+
+def _build(data, extra=None):
+    return messaging.Message(topic='bidding_plumbing_seattle', data={**data, **(extra or {})})
+
+
+def test_truncate_cuts_on_a_character_boundary():
+    assert fcm_payload.truncate('short', 10) == 'short'
+    cut = fcm_payload.truncate('ééééé', 7)
+    assert cut.endswith(fcm_payload.ELLIPSIS)
+    assert len(cut.encode('utf-8')) <= 7
+    cut.encode('utf-8').decode('utf-8')
+
+
+def test_compact_data_drops_empties_and_keeps_ids_whole():
+    request_id = 'r' * 400
+    data = fcm_payload.compact_data({'request_id': request_id, 'urgency': '', 'task_description': 'x' * 1000,
+                                     'deadline_hours': 2, 'price': None})
+    assert data['request_id'] == request_id
+    assert 'urgency' not in data and 'price' not in data
+    assert data['deadline_hours'] == '2'
+    assert len(data['task_description'].encode('utf-8')) <= fcm_payload.FIELD_BUDGETS['task_description']
+
+
+def test_fit_shrinks_the_shrinkable_fields():
+    data = {'request_id': 'req_1', 'task_description': 'leak ' * 1000}
+    message = fcm_payload.fit(_build, data)
+    assert message.data['request_id'] == 'req_1'
+    assert len(message.data.get('task_description', '')) < len(data['task_description'])
+    assert fcm_payload.measure(message)['data'] <= fcm_payload.MAX_PAYLOAD_BYTES - fcm_payload.HEADROOM_BYTES
+
+
+def test_message_that_cannot_fit_is_skipped():
+    def build(data):
+        return _build(data, {'attachment': 'x' * fcm_payload.MAX_PAYLOAD_BYTES})
+
+    with pytest.raises(fcm_payload.PayloadTooLargeError) as raised:
+        fcm_payload.fit(build, {'request_id': 'req_1', 'task_description': 'leak'})
+    assert raised.value.sizes['data'] > fcm_payload.MAX_PAYLOAD_BYTES
+    assert fcm_payload.fit_or_skip(build, {'request_id': 'req_1'}, 'test alert') is None
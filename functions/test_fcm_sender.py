@@ -0,0 +1,95 @@
+"""
+Behaviour of rate-limited FCM sending against the in-memory fakes: the
+token bucket, retries of transient failures and partial sends under
+backpressure, end to end through send_bidding_notification.
+
+Usage: python -m pytest test_fcm_sender.py
+"""
+
+import pytest
+from firebase_admin import messaging
+
+import fake_firebase
+import fcm_sender
+from bench_functions import make_request, seed
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = fake_firebase.install(latency_ms=0, failure_rate=0, fcm_latency_ms=0, fcm_failure_rate=0, seed=1)
+    monkeypatch.setattr(fcm_sender, '_limiter', fcm_sender.TokenBucket(1000, 500))
+    monkeypatch.setattr(fcm_sender, 'BACKOFF_BASE_SECONDS', 0)
+    import main
+    main.admission.ENABLED = False
+    yield backend, main
+    main.admission.ENABLED = True
+    fake_firebase.uninstall()
+
+
+def _messages(count):
+    return [messaging.Message(token=f'token_{i}', data={'n': str(i)}) for i in range(count)]
+
+
+def test_token_bucket_reports_the_wait_for_missing_tokens():
+    bucket = fcm_sender.TokenBucket(rate=10, capacity=5)
+    assert bucket.try_acquire(5) == 0.0
+    assert bucket.try_acquire(2) == pytest.approx(0.2, abs=0.02)
+    with pytest.raises(fcm_sender.FCMBackpressureError):
+        bucket.acquire(5, max_wait=0)
+    with pytest.raises(ValueError):
+        bucket.acquire(6)
+
+
+def test_transient_failures_are_retried_by_index(backend, monkeypatch):
+    fake, _main = backend
+    outcomes = iter([True, False, True] + [False] * 10)
+    monkeypatch.setattr(fake.messaging.conditions, 'should_fail', lambda: next(outcomes))
+
+    response = fcm_sender.send_each(_messages(3))
+    assert response.success_count == 3
+    assert sorted(message.token for message in fake.messaging.sent) == ['token_0', 'token_1', 'token_2']
+    assert fake.messaging.api_calls == 2
+
+
+def test_permanent_failures_are_not_retried(backend, monkeypatch):
+    fake, _main = backend
+    error = messaging.UnregisteredError('Token is gone')
+    monkeypatch.setattr(fake.messaging, '_failure', lambda: error)
+    monkeypatch.setattr(fake.messaging.conditions, 'should_fail', lambda: True)
+
+    response = fcm_sender.send_each(_messages(2))
+    assert response.failure_count == 2
+    assert fake.messaging.api_calls == 1
+    assert fcm_sender.is_token_invalid(response.responses[0].exception)
+
+
+def test_backpressure_hands_back_what_was_sent(backend, monkeypatch):
+    fake, _main = backend
+    monkeypatch.setattr(fcm_sender, '_limiter', fcm_sender.TokenBucket(0.001, 2))
+
+    with pytest.raises(fcm_sender.FCMBackpressureError) as raised:
+        fcm_sender.send_each(_messages(5), max_wait=0)
+    partial = raised.value.partial
+    assert (partial.success_count, partial.failure_count, partial.unsent_count) == (2, 0, 3)
+    assert len(fake.messaging.sent) == 2
+
+
+def test_retry_after_backpressure_only_reaches_the_rest(backend, monkeypatch):
+    fake, main = backend
+    provider_ids = seed(fake.db, 3, 1)
+    body = {'provider_ids': provider_ids, 'request_id': 'req_1', 'task_description': 'Burst pipe',
+            'urgency': 'critical'}
+
+    monkeypatch.setattr(fcm_sender, '_limiter', fcm_sender.TokenBucket(0.001, 2))
+    throttled = main.send_bidding_notification.__wrapped__(make_request(body))
+    assert throttled.status_code == 429
+    assert 'Retry-After' in throttled.headers
+    first_tokens = {message.token for message in fake.messaging.sent}
+    assert len(first_tokens) == 2
+
+    monkeypatch.setattr(fcm_sender, '_limiter', fcm_sender.TokenBucket(1000, 500))
+    retried = main.send_bidding_notification.__wrapped__(make_request(body))
+    assert retried.status_code == 200
+    tokens = [message.token for message in fake.messaging.sent]
+    assert len(tokens) == 3 and set(tokens) == {f'token_{i}_0' for i in range(3)}
+    assert len(fake.db.dump('service_requests')) == 1
@@ -0,0 +1,104 @@
+"""
+Behaviour of category x area topic subscriptions against the in-memory
+fakes: topic naming, conditions, diffs over legacy and registry tokens,
+and the full resync.
+
+Usage: python -m pytest test_fcm_topics.py
+"""
+
+import pytest
+
+import device_tokens
+import fake_firebase
+import fcm_topics
+from bench_functions import make_change_event, make_request
+
+PROVIDER = {
+    'companyName': 'Pipes Inc',
+    'status': 'verified',
+    'service_categories': ['Plumbing'],
+    'service_areas': ['Seattle', 'Bellevue'],
+    'fcmTokens': ['legacy_token'],
+}
+TOPICS = {'bidding_plumbing_seattle', 'bidding_plumbing_bellevue'}
+
+
+@pytest.fixture
+def backend():
+    backend = fake_firebase.install(latency_ms=0, failure_rate=0, fcm_latency_ms=0, fcm_failure_rate=0, seed=1)
+    import main
+    main.admission.ENABLED = False
+    yield backend, main
+    main.admission.ENABLED = True
+    fake_firebase.uninstall()
+
+
+def _subscribed(fake, token):
+    return {topic for topic, members in fake.messaging.topics.items() if token in members}
+
+
+def test_topics_and_conditions():
+    assert fcm_topics.topics_for('Home Cleaning', ['Seattle, WA']) == ['bidding_home-cleaning_seattle-wa']
+    assert fcm_topics.provider_topics(PROVIDER) == TOPICS
+    assert fcm_topics.provider_topics(dict(PROVIDER, accepting_new_requests=False)) == set()
+    assert fcm_topics.reached_by(PROVIDER, ['bidding_plumbing_seattle'])
+    assert not fcm_topics.reached_by(dict(PROVIDER, status='pending'), ['bidding_plumbing_seattle'])
+
+    conditions = fcm_topics.build_conditions([f't{i}' for i in range(7)])
+    assert len(conditions) == 2
+    assert conditions[1] == "'t5' in topics || 't6' in topics"
+
+
+def test_sync_only_sends_the_difference(backend):
+    fake, _main = backend
+    assert fcm_topics.sync_provider_subscriptions('prov_1', None, PROVIDER) == (2, 0)
+    calls = fake.messaging.api_calls
+    assert fcm_topics.sync_provider_subscriptions('prov_1', PROVIDER, dict(PROVIDER, companyName='New')) == (0, 0)
+    assert fake.messaging.api_calls == calls
+
+    moved = dict(PROVIDER, service_areas=['Seattle', 'Redmond'])
+    assert fcm_topics.sync_provider_subscriptions('prov_1', PROVIDER, moved) == (1, 1)
+    assert _subscribed(fake, 'legacy_token') == {'bidding_plumbing_seattle', 'bidding_plumbing_redmond'}
+
+
+def test_registry_devices_leave_topics_with_the_profile(backend):
+    fake, main = backend
+    fake.db.seed('providers', {'prov_1': PROVIDER})
+    device_tokens.register(fake.db, 'providers', 'prov_1', 'device_token', 'ios')
+    fcm_topics.sync_provider_subscriptions('prov_1', None, PROVIDER, ['device_token'])
+    assert _subscribed(fake, 'device_token') == TOPICS
+
+    suspended = dict(PROVIDER, status='suspended')
+    fake.db.seed('providers', {'prov_1': suspended})
+    main.send_provider_notification.__wrapped__(make_change_event(
+        fake.db, 'providers/prov_1', PROVIDER, suspended, {'provider_id': 'prov_1'}))
+    assert _subscribed(fake, 'device_token') == set()
+    assert _subscribed(fake, 'legacy_token') == set()
+
+
+def test_registered_token_dropped_from_the_profile_keeps_its_topics(backend):
+    fake, main = backend
+    with_device = dict(PROVIDER, fcmTokens=['legacy_token', 'device_token'])
+    fake.db.seed('providers', {'prov_1': with_device})
+    device_tokens.register(fake.db, 'providers', 'prov_1', 'device_token', 'android')
+    fcm_topics.sync_provider_subscriptions('prov_1', None, with_device)
+
+    main.send_provider_notification.__wrapped__(make_change_event(
+        fake.db, 'providers/prov_1', with_device, PROVIDER, {'provider_id': 'prov_1'}))
+    assert _subscribed(fake, 'device_token') == TOPICS
+
+
+def test_resync_unsubscribes_topics_that_no_longer_apply(backend):
+    fake, main = backend
+    fake.db.seed('providers', {
+        'prov_1': dict(PROVIDER, service_areas=['Seattle']),
+        'prov_2': dict(PROVIDER, status='rejected', fcmTokens=['rejected_token']),
+    })
+    # Left over from before prov_1 dropped Bellevue and prov_2 was rejected
+    for topic in TOPICS:
+        fake.messaging.subscribe_to_topic(['legacy_token', 'rejected_token'], topic)
+
+    response = main.resync_provider_topics.__wrapped__(make_request({}))
+    assert response.status_code == 200
+    assert _subscribed(fake, 'legacy_token') == {'bidding_plumbing_seattle'}
+    assert _subscribed(fake, 'rejected_token') == set()
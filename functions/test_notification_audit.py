@@ -0,0 +1,54 @@
+"""
+Behaviour of the notification audit logger against the in-memory fakes:
+bucketed rollups, sampled audit records and the status history path.
+
+Usage: python -m pytest test_notification_audit.py
+"""
+
+import pytest
+
+import fake_firebase
+import notification_audit
+
+
+@pytest.fixture
+def db():
+    backend = fake_firebase.install(latency_ms=0, failure_rate=0, seed=1)
+    yield backend.db
+    fake_firebase.uninstall()
+
+
+def test_sends_in_one_bucket_share_a_rollup(db):
+    logger = notification_audit.AuditLogger(db, sample_rate=0)
+    logger.record('prov_1', 'new_request', 2, 2, 0)
+    logger.record('prov_1', 'bid_reminder', 1, 0, 1)
+    logger.flush()
+
+    rollups = db.dump(notification_audit.ROLLUP_COLLECTION)
+    assert len(rollups) == 1
+    rollup = next(iter(rollups.values()))
+    assert rollup['totals'] == {'notifications': 2, 'sentTo': 3, 'success': 2, 'failure': 1}
+    assert rollup['byType']['bid_reminder']['failure'] == 1
+    assert not db.dump(notification_audit.SAMPLE_COLLECTION)
+
+
+def test_sampled_bidding_details_stay_out_of_the_app_history(db):
+    logger = notification_audit.AuditLogger(db, sample_rate=1.0)
+    logger.record('prov_1', 'new_request', 1, 1, 0, detail={'requestId': 'req_1'})
+    logger.flush()
+
+    samples = list(db.dump(notification_audit.SAMPLE_COLLECTION).values())
+    assert len(samples) == 1
+    assert samples[0]['requestId'] == 'req_1' and samples[0]['sampleRate'] == 1.0
+    assert not db.dump(notification_audit.HISTORY_COLLECTION)
+
+
+def test_status_sends_get_a_history_record_and_no_rollup(db):
+    logger = notification_audit.status_logger(db)
+    logger.record('prov_1', 'status_update', 1, 1, 0, detail={'title': 'Account approved'})
+    logger.flush()
+
+    history = list(db.dump(notification_audit.HISTORY_COLLECTION).values())
+    assert [record['title'] for record in history] == ['Account approved']
+    assert not db.dump(notification_audit.ROLLUP_COLLECTION)
+    assert not db.dump(notification_audit.SAMPLE_COLLECTION)
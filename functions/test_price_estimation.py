@@ -0,0 +1,82 @@
+"""
+Behaviour of the price estimate cache against the in-memory fakes: memory,
+shared store and backend layers, batching and per-backend keys.
+
+Usage: python -m pytest test_price_estimation.py
+"""
+
+import pytest
+
+import fake_firebase
+import price_estimation
+
+
+class CountingBackend(price_estimation.StubBackend):
+    def __init__(self, name='stub'):
+        self.name = name
+        self.calls = []
+
+    def estimate_batch(self, items):
+        self.calls.append(len(items))
+        return super().estimate_batch(items)
+
+
+@pytest.fixture
+def db():
+    backend = fake_firebase.install(latency_ms=0, failure_rate=0, seed=1)
+    yield backend.db
+    fake_firebase.uninstall()
+
+
+def test_second_instance_is_served_from_the_shared_store(db):
+    first_backend = CountingBackend()
+    first = price_estimation.PriceEstimator(first_backend).estimate(db, 'plumbing', 'Replace kitchen faucet', '98101')
+    assert first['source'] == 'computed'
+    assert first_backend.calls == [1]
+
+    # A cold instance has an empty memory cache but must not call the model again
+    second_backend = CountingBackend()
+    second = price_estimation.PriceEstimator(second_backend).estimate(db, 'plumbing', 'replace kitchen faucet!', '98101-1234')
+    assert second['source'] == 'firestore'
+    assert second_backend.calls == []
+    assert second['suggestedRange'] == first['suggestedRange']
+    assert second['cacheKey'] == first['cacheKey']
+
+
+def test_repeat_on_the_same_instance_is_a_memory_hit(db):
+    backend = CountingBackend()
+    estimator = price_estimation.PriceEstimator(backend)
+    estimator.estimate(db, 'cleaning', 'Deep clean two bedroom apartment')
+    again = estimator.estimate(db, 'cleaning', 'Deep clean two bedroom apartment')
+    assert again['source'] == 'memory'
+    assert backend.calls == [1]
+    assert estimator.stats()['memory_hits'] == 1
+
+
+def test_misses_are_sent_to_the_backend_in_batches(db):
+    backend = CountingBackend()
+    estimator = price_estimation.PriceEstimator(backend)
+    items = [price_estimation.EstimateRequest('handyman', f'Hang {i} shelves', 'Seattle')
+             for i in range(price_estimation.MAX_BATCH_SIZE + 5)]
+    # Duplicates in one call are resolved once
+    estimates = estimator.estimate_many(db, items + items[:3])
+    assert len(estimates) == len(items) + 3
+    assert backend.calls == [price_estimation.MAX_BATCH_SIZE, 5]
+    assert estimates[-1]['cacheKey'] == estimates[2]['cacheKey']
+
+
+def test_stored_estimates_are_kept_per_backend(db):
+    price_estimation.PriceEstimator(CountingBackend('stub')).estimate(db, 'hvac', 'Install new thermostat')
+    other_backend = CountingBackend('other')
+    estimate = price_estimation.PriceEstimator(other_backend).estimate(db, 'hvac', 'Install new thermostat')
+    assert estimate['source'] == 'computed'
+    assert other_backend.calls == [1]
+    assert len(db.dump(price_estimation.ESTIMATES_COLLECTION)) == 2
+
+
+def test_expired_store_entries_are_recomputed(db):
+    price_estimation.PriceEstimator(CountingBackend(), ttl_seconds=-1).estimate(db, 'electrical', 'Add outlet')
+    backend = CountingBackend()
+    estimate = price_estimation.PriceEstimator(backend).estimate(db, 'electrical', 'Add outlet')
+    assert estimate['source'] == 'computed'
+    assert backend.calls == [1]
@@ -0,0 +1,60 @@
+"""
+Behaviour of provider profile normalization and the profile backfill
+against the in-memory fakes.
+
+Usage: python -m pytest test_provider_profile.py
+"""
+
+import pytest
+
+import fake_firebase
+import provider_profile
+from bench_functions import make_change_event, make_request
+
+
+@pytest.fixture
+def backend():
+    backend = fake_firebase.install(latency_ms=0, failure_rate=0, fcm_latency_ms=0, fcm_failure_rate=0, seed=1)
+    import main
+    main.admission.ENABLED = False
+    yield backend, main
+    main.admission.ENABLED = True
+    fake_firebase.uninstall()
+
+
+def test_diff_only_holds_missing_or_changed_fields():
+    current = {'name': 'Ann', 'status': 'pending', 'fcmTokens': ['t']}
+    changes = provider_profile.profile_diff(current, provider_profile.normalize_provider_profile('prov_0001', current))
+    assert 'name' not in changes and 'status' not in changes
+    assert changes['referralCode'] == 'PROV0001'
+    normalized = dict(current, **changes)
+    assert provider_profile.profile_diff(normalized, provider_profile.normalize_provider_profile('prov_0001', normalized)) == {}
+
+
+def test_validation_reports_each_problem():
+    errors = provider_profile.validate_provider_record({'email': 'nope', 'status': 'gone', 'rating': 7,
+                                                        'is_active': 'yes'})
+    assert len(errors) == 5
+    assert provider_profile.validate_provider_record({'companyName': 'Pipes Inc', 'rating': '4.5'}) == []
+
+
+def test_backfilled_status_does_not_notify_the_provider(backend):
+    fake, main = backend
+    fake.db.seed('providers', {'prov_1': {'companyName': 'Pipes Inc', 'fcmTokens': ['token_1']}})
+    before = fake.db.dump('providers')['prov_1']
+
+    report = main.backfill_provider_profiles.__wrapped__(make_request({'restart': True}))
+    assert report.status_code == 200
+    after = fake.db.dump('providers')['prov_1']
+    assert after['status'] == 'verified'
+    assert after[main.PROFILE_BACKFILL_FIELD] is not None
+
+    main.send_provider_notification.__wrapped__(make_change_event(
+        fake.db, 'providers/prov_1', before, after, {'provider_id': 'prov_1'}))
+    assert fake.messaging.sent == []
+
+    # A later real status change still notifies
+    approved = dict(after, status='active')
+    main.send_provider_notification.__wrapped__(make_change_event(
+        fake.db, 'providers/prov_1', after, approved, {'provider_id': 'prov_1'}))
+    assert [message.token for message in fake.messaging.sent] == ['token_1']
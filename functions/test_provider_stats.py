@@ -0,0 +1,79 @@
+"""
+Behaviour of the sharded provider stat counters against the in-memory
+fakes: review verification, shard increments and materialization.
+
+Usage: python -m pytest test_provider_stats.py
+"""
+
+import pytest
+
+import fake_firebase
+import provider_stats
+
+
+@pytest.fixture
+def db():
+    backend = fake_firebase.install(latency_ms=0, failure_rate=0, seed=1)
+    backend.db.seed('providers', {'prov_1': {'companyName': 'Pipes Inc', 'thumbs_up_count': 4,
+                                             'total_jobs_completed': 10}})
+    backend.db.seed('user_requests', {'req_1': {'userId': 'user_1', 'assignedProviderId': 'prov_1',
+                                                'status': 'completed'}})
+    yield backend.db
+    fake_firebase.uninstall()
+
+
+def _review(**overrides):
+    return {'userId': 'user_1', 'providerId': 'prov_1', 'requestId': 'req_1',
+            'serviceExpectationsMet': True, 'wouldRecommend': True, **overrides}
+
+
+def test_review_of_a_completed_request_counts_once(db):
+    assert provider_stats.record_review(db, 'rev_1', _review()) == {'total_jobs_completed': 1, 'thumbs_up_count': 1}
+    # A second review of the same job adds nothing
+    assert provider_stats.record_review(db, 'rev_2', _review()) is None
+    assert provider_stats.get_stats(db, 'prov_1') == {'thumbs_up_count': 5, 'total_jobs_completed': 11}
+    assert db.dump('user_requests')['req_1']['statsReviewId'] == 'rev_1'
+
+
+def test_thumbs_up_needs_both_answers_positive(db):
+    deltas = provider_stats.record_review(db, 'rev_1', _review(wouldRecommend=False))
+    assert deltas == {'total_jobs_completed': 1, 'thumbs_up_count': 0}
+
+
+@pytest.mark.parametrize('review, request_update', [
+    (_review(userId='someone_else'), {}),
+    (_review(providerId='prov_2'), {}),
+    (_review(requestId='missing'), {}),
+    (_review(), {'status': 'assigned'}),
+])
+def test_reviews_that_do_not_match_their_request_are_ignored(db, review, request_update):
+    if request_update:
+        db.seed('user_requests', {'req_1': {**db.dump('user_requests')['req_1'], **request_update}})
+    assert provider_stats.record_review(db, 'rev_1', review) is None
+    assert provider_stats.get_stats(db, 'prov_1') == {'thumbs_up_count': 4, 'total_jobs_completed': 10}
+
+
+def test_increment_rejects_unknown_stats(db):
+    with pytest.raises(ValueError):
+        provider_stats.increment(db, 'prov_1', {'rating': 5})
+
+
+def test_materialize_moves_shard_deltas_onto_the_profile(db):
+    for _ in range(25):
+        provider_stats.increment(db, 'prov_1', {'total_jobs_completed': 1, 'thumbs_up_count': 1})
+    before = provider_stats.get_stats(db, 'prov_1')
+
+    report = provider_stats.materialize(db)
+    assert report['materialized'] == 1
+    profile = db.dump('providers')['prov_1']
+    assert (profile['thumbs_up_count'], profile['total_jobs_completed']) == (29, 35)
+    assert provider_stats.get_stats(db, 'prov_1') == before
+
+    shards = db.dump('providers/prov_1/stat_shards')
+    assert all(not shard['dirty'] and not shard.get('total_jobs_completed') for shard in shards.values())
+    assert provider_stats.materialize(db)['dirty_shards'] == 0
+
+
+def test_shards_of_a_missing_profile_are_reported(db):
+    provider_stats.increment(db, 'gone', {'total_jobs_completed': 1})
+    assert provider_stats.materialize(db)['missing'] == 1
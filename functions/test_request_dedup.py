@@ -0,0 +1,85 @@
+"""
+Behaviour of near-duplicate detection against the in-memory fakes: LSH
+thresholds, scoping, and the signature store fallback.
+
+Usage: python -m pytest test_request_dedup.py
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import fake_firebase
+import request_dedup
+
+DESCRIPTION = 'Kitchen sink is leaking under the cabinet and the trap needs replacing soon'
+
+
+def _request(description=DESCRIPTION, **overrides):
+    return {'userId': 'user_1', 'serviceCategory': 'plumbing', 'address': '12 Pine St, Seattle',
+            'description': description, **overrides}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    backend = fake_firebase.install(latency_ms=0, failure_rate=0, seed=1)
+    # Each test starts from a cold instance
+    monkeypatch.setattr(request_dedup, '_index', request_dedup.DuplicateIndex())
+    yield backend.db
+    fake_firebase.uninstall()
+
+
+def test_similarity_tracks_wording():
+    same = request_dedup.signature(DESCRIPTION)
+    assert request_dedup.similarity(same, request_dedup.signature(DESCRIPTION.upper() + '!!')) == 1.0
+    reworded = request_dedup.signature(DESCRIPTION.replace('soon', 'today'))
+    assert request_dedup.similarity(same, reworded) >= request_dedup.SIMILARITY_THRESHOLD
+    unrelated = request_dedup.signature('Mow the front lawn and trim the hedges along the driveway')
+    assert request_dedup.similarity(same, unrelated) < 0.2
+
+
+def test_near_duplicate_in_scope_is_found_in_memory(db):
+    request_dedup.register(db, request_dedup.Fingerprint('original', _request()))
+    match = request_dedup.find_duplicate(db, request_dedup.Fingerprint('repeat', _request(DESCRIPTION + '.')))
+    assert match is not None and match[0] == 'original'
+    assert match[1] >= request_dedup.SIMILARITY_THRESHOLD
+
+
+@pytest.mark.parametrize('overrides', [
+    {'userId': 'user_2'},
+    {'serviceCategory': 'electrical'},
+    {'address': '99 Oak Ave, Bellevue'},
+    {'description': 'Mow the front lawn and trim the hedges along the driveway'},
+])
+def test_other_scope_or_wording_is_not_a_duplicate(db, overrides):
+    request_dedup.register(db, request_dedup.Fingerprint('original', _request()))
+    assert request_dedup.find_duplicate(db, request_dedup.Fingerprint('other', _request(**overrides))) is None
+
+
+def test_cold_instance_finds_the_duplicate_in_the_store(db, monkeypatch):
+    request_dedup.register(db, request_dedup.Fingerprint('original', _request()))
+    monkeypatch.setattr(request_dedup, '_index', request_dedup.DuplicateIndex())
+    match = request_dedup.find_duplicate(db, request_dedup.Fingerprint('repeat', _request()))
+    assert match == ('original', 1.0)
+
+
+def test_old_signatures_do_not_crowd_out_a_recent_duplicate(db, monkeypatch):
+    old = datetime.now(timezone.utc) - timedelta(minutes=request_dedup.DUPLICATE_WINDOW_MINUTES * 4)
+    records = {}
+    for i in range(request_dedup.STORE_CANDIDATE_LIMIT + 5):
+        record = request_dedup.Fingerprint(f'old_{i}', _request()).record()
+        records[f'old_{i}'] = dict(record, createdAt=old + timedelta(seconds=i))
+    db.seed(request_dedup.SIGNATURES_COLLECTION, records)
+    request_dedup.register(db, request_dedup.Fingerprint('recent', _request()))
+    monkeypatch.setattr(request_dedup, '_index', request_dedup.DuplicateIndex())
+
+    match = request_dedup.find_duplicate(db, request_dedup.Fingerprint('repeat', _request()))
+    assert match == ('recent', 1.0)
+
+
+def test_duplicates_outside_the_window_are_ignored(db):
+    old = datetime.now(timezone.utc) - timedelta(minutes=request_dedup.DUPLICATE_WINDOW_MINUTES + 1)
+    db.seed(request_dedup.SIGNATURES_COLLECTION, {
+        'original': dict(request_dedup.Fingerprint('original', _request()).record(), createdAt=old)
+    })
+    assert request_dedup.find_duplicate(db, request_dedup.Fingerprint('repeat', _request())) is None
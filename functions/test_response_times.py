@@ -0,0 +1,87 @@
+"""
+Behaviour of provider response-time stats against the in-memory fakes:
+sketch quantiles, recording bids and materializing onto profiles.
+
+Usage: python -m pytest test_response_times.py
+"""
+
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import fake_firebase
+import response_times
+
+
+@pytest.fixture
+def db():
+    backend = fake_firebase.install(latency_ms=0, failure_rate=0, seed=1)
+    backend.db.seed('providers', {'prov_1': {'companyName': 'Pipes Inc'}})
+    yield backend.db
+    fake_firebase.uninstall()
+
+
+def _exact_quantile(samples, q):
+    return sorted(samples)[int(q * (len(samples) - 1))]
+
+
+def test_sketch_quantiles_stay_within_relative_accuracy():
+    rng = random.Random(7)
+    samples = [rng.lognormvariate(6, 1.2) + 1 for _ in range(5000)]
+    stats = None
+    for seconds in samples:
+        stats = response_times.add_sample(stats, seconds)
+    assert stats['count'] == len(samples)
+    assert len(stats['sketch']) <= response_times.MAX_BUCKETS
+    for q in (0.5, 0.9):
+        exact = _exact_quantile(samples, q)
+        estimate = response_times.quantile(stats['sketch'], q)
+        assert abs(estimate - exact) / exact <= response_times.RELATIVE_ACCURACY * 1.5
+
+
+def test_sketch_merges_lowest_buckets_past_the_limit():
+    sketch = {}
+    for seconds in (1.05 ** i for i in range(response_times.MAX_BUCKETS * 3)):
+        sketch = response_times.add_to_sketch(sketch, seconds)
+    assert len(sketch) <= response_times.MAX_BUCKETS
+    assert sum(sketch.values()) == response_times.MAX_BUCKETS * 3
+
+
+def test_describe_reads_naturally():
+    assert response_times.describe({'p50Minutes': 0.4}) == 'within a minute'
+    assert response_times.describe({'p50Minutes': 25}) == 'within 25 minutes'
+    assert response_times.describe({'p50Minutes': 180}) == 'within 3 hours'
+    assert response_times.describe({'p50Minutes': None}) is None
+
+
+def test_bid_latency_is_measured_from_the_notification(db):
+    response_times.record_notifications(db, 'req_1', ['prov_1'])
+    sent_at = response_times.notified_at(db, 'req_1', 'prov_1')
+    assert response_times.record_bid(db, 'prov_1', 'req_1', sent_at + timedelta(minutes=12)) == 720
+    # No notification, no sample
+    assert response_times.record_bid(db, 'prov_1', 'req_2') is None
+    stats = db.dump(response_times.STATS_COLLECTION)['prov_1']
+    assert stats['count'] == 1 and stats['dirty'] is True
+
+
+def test_materialize_summarizes_onto_the_profile(db):
+    response_times.record_notifications(db, 'req_1', ['prov_1'])
+    sent_at = response_times.notified_at(db, 'req_1', 'prov_1')
+    response_times.record_bid(db, 'prov_1', 'req_1', sent_at + timedelta(minutes=20))
+
+    assert response_times.materialize(db) == 1
+    profile = db.dump('providers')['prov_1']
+    assert profile['responseTime']['samples'] == 1
+    assert abs(profile['responseTime']['p50Minutes'] - 20) <= 20 * response_times.RELATIVE_ACCURACY
+    assert profile['response_time_avg'] == response_times.describe(profile['responseTime'])
+    assert db.dump(response_times.STATS_COLLECTION)['prov_1']['dirty'] is False
+    assert response_times.materialize(db) == 0
+
+
+def test_stats_of_a_missing_provider_are_dropped(db):
+    db.seed(response_times.STATS_COLLECTION, {
+        'gone': response_times.add_sample(None, 60, datetime.now(timezone.utc)) | {'updatedAt': None}
+    })
+    assert response_times.materialize(db) == 0
+    assert 'gone' not in db.dump(response_times.STATS_COLLECTION)
@@ -0,0 +1,16 @@
+"""
+Text normalization shared by the modules that key or compare requests by
+their wording (duplicate detection, price estimate cache keys).
+
+``normalize`` lowercases, turns punctuation into spaces and collapses
+whitespace, so "Leaky  faucet!" and "leaky faucet" compare equal. Changing
+it changes every derived key: stored price estimates and request signatures
+written before the change will no longer match.
+"""
+
+import re
+
+
+def normalize(text):
+    text = re.sub(r'[^a-z0-9\s]', ' ', (text or '').lower())
+    return re.sub(r'\s+', ' ', text).strip()
@@ -311,10 +311,7 @@ class _CustomerReviewScreenState extends State<CustomerReviewScreen> {
           
       print('✅ Review submitted successfully with ID: ${docRef.id}');
 
-      // Update provider stats (optional - could be done via Cloud Function)
-      if (widget.task.assignedProviderId != null) {
-        await _updateProviderStats();
-      }
+      // Provider stats are counted by the record_review_stats function once it has checked the review
 
       // Show success and navigate back
       if (mounted) {
@@ -377,39 +374,6 @@ class _CustomerReviewScreenState extends State<CustomerReviewScreen> {
     return rating.clamp(1, 5);
   }
 
-  Future<void> _updateProviderStats() async {
-    if (widget.task.assignedProviderId == null) return;
-    
-    try {
-      final providerRef = FirebaseFirestore.instance
-          .collection('providers')
-          .doc(widget.task.assignedProviderId!);
-      
-      await FirebaseFirestore.instance.runTransaction((transaction) async {
-        final providerDoc = await transaction.get(providerRef);
-        
-        if (providerDoc.exists) {
-          final data = providerDoc.data()!;
-          final currentJobs = data['total_jobs_completed'] ?? 0;
-          final currentThumbsUp = data['thumbs_up_count'] ?? 0;
-          
-          int newThumbsUp = currentThumbsUp;
-          if (_serviceExpectationsMet == true && _wouldRecommend == true) {
-            newThumbsUp += 1;
-          }
-          
-          transaction.update(providerRef, {
-            'total_jobs_completed': currentJobs + 1,
-            'thumbs_up_count': newThumbsUp,
-            'updatedAt': FieldValue.serverTimestamp(),
-          });
-        }
-      });
-    } catch (error) {
-      print('❌ Error updating provider stats: $error');
-    }
-  }
-
   @override
   Widget build(BuildContext context) {
     return Scaffold(
@@ -46,7 +46,7 @@ class BiddingService {
     print('🔍 BIDDING_SERVICE: Looking for opportunities for provider: $providerId');
     return _firestore
         .collection('user_requests')
-        .where('status', isEqualTo: 'matched')
+        .where('status', whereIn: ['matched', 'bidding'])
         .where('matchedProviders', arrayContains: providerId)
         .orderBy('createdAt', descending: true)
         .snapshots()
@@ -155,7 +155,7 @@ class BiddingService {
       }
       
       final requestData = requestDoc.data()!;
-      if (requestData['status'] != 'matched') {
+      if (!['matched', 'bidding'].contains(requestData['status'])) {
         throw Exception('Bidding is no longer active for this request');
       }
 
@@ -357,7 +357,8 @@ class BiddingService {
       
       final requestData = requestDoc.data()!;
       
-      if (requestData['status'] != 'matched') {
+      // Bidding stays open after the first bid moves the request to 'bidding'
+      if (!['matched', 'bidding'].contains(requestData['status'])) {
         return {
           'canBid': false,
           'reason': 'Bidding is no longer active',
@@ -1,5 +1,6 @@
 import 'dart:convert';
 import 'package:http/http.dart' as http;
+import '../config/api_config.dart';
 
 // EXAMPLE: Real AI/LLM Integration for Production Use
 // This shows how to integrate with actual AI services for much better understanding
@@ -160,7 +161,32 @@ Category:''';
   }
 
   // Price estimation using AI
-  static Future<Map<String, dynamic>> estimatePriceWithAI(String serviceDescription, String category, List<String> tags) async {
+  static Future<Map<String, dynamic>> estimatePriceWithAI(String serviceDescription, String category, List<String> tags, {String area = ''}) async {
+    // The estimate_price function caches estimates, so repeated jobs are answered instantly and consistently
+    if (ApiConfig.isFirebaseFunctionsConfigured) {
+      try {
+        final response = await http.post(
+          Uri.parse('${ApiConfig.firebaseFunctionsUrl}/estimate_price'),
+          headers: {'Content-Type': 'application/json'},
+          body: jsonEncode({'category': category, 'description': serviceDescription, 'area': area}),
+        ).timeout(ApiConfig.apiTimeout);
+        if (response.statusCode == 200) {
+          final estimate = jsonDecode(response.body) as Map<String, dynamic>;
+          final range = estimate['suggestedRange'] as Map<String, dynamic>;
+          return {
+            'min': range['min'],
+            'max': range['max'],
+            'average': estimate['average'],
+            'confidence': estimate['confidenceLevel'],
+            'factors': estimate['factors'],
+          };
+        }
+        print('estimate_price returned ${response.statusCode}; falling back to direct AI call');
+      } catch (e) {
+        print('Error calling estimate_price: $e');
+      }
+    }
+
     final prompt = '''
 Estimate a fair market price range for this home service:
 - Service: $serviceDescription